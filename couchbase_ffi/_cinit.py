@@ -28,6 +28,7 @@ void memset(void*,int,int);
 
 VERIFY_INPUT = """
 #include <assert.h>
+#include <stdarg.h>
 #include <stdlib.h>
 #include <stdio.h>
 #include <sys/time.h>
@@ -45,6 +46,44 @@ void _Cb_set_val(void *cmd, const void *val, size_t nval) {
 void _Cb_do_callback(lcb_socket_t s, short events, lcb_ioE_callback cb, void *arg) {
     cb(s, events, arg);
 }
+
+typedef void (*_Cb_log_handler)(unsigned int, const char*, int, const char*, int, const char*);
+typedef struct _Cb_LOGGER {
+    lcb_logprocs base; /* Must be first */
+    int minlevel;
+    _Cb_log_handler handler;
+} _Cb_LOGGER;
+
+/* Records below the minimum level are dropped here, without formatting
+ * them or entering Python */
+static void _Cb_log_callback(struct lcb_logprocs_st *procs, unsigned int iid,
+    const char *subsys, int severity, const char *srcfile, int srcline,
+    const char *fmt, va_list ap) {
+    _Cb_LOGGER *logger = (_Cb_LOGGER *)procs;
+    char buf[1024];
+    if (severity < logger->minlevel) {
+        return;
+    }
+    vsnprintf(buf, sizeof(buf), fmt, ap);
+    logger->handler(iid, subsys, severity, srcfile, srcline, buf);
+}
+_Cb_LOGGER *_Cb_logger_new(int minlevel, _Cb_log_handler handler) {
+    _Cb_LOGGER *logger = calloc(1, sizeof(*logger));
+    logger->base.version = 0;
+    logger->base.v.v0.callback = _Cb_log_callback;
+    logger->minlevel = minlevel;
+    logger->handler = handler;
+    return logger;
+}
+void _Cb_logger_free(_Cb_LOGGER *logger) {
+    free(logger);
+}
+void _Cb_logger_set_level(_Cb_LOGGER *logger, int minlevel) {
+    logger->minlevel = minlevel;
+}
+lcb_logprocs *_Cb_logger_procs(_Cb_LOGGER *logger) {
+    return &logger->base;
+}
 LIBCOUCHBASE_API
 lcb_error_t
 lcb_n1p_synctok_for(lcb_N1QLPARAMS *params, lcb_t instance,
@@ -198,10 +237,20 @@ def get_handle():
 #define LCB_RESP_F_FINAL ...
 #define LCB_CNTL_SET ...
 #define LCB_CNTL_GET ...
+#define LCB_CNTL_OP_TIMEOUT ...
 #define LCB_CNTL_BUCKETNAME ...
 #define LCB_CNTL_VBMAP ...
+#define LCB_CNTL_LOGGER ...
+#define LCB_CNTL_IOPS ...
+#define LCB_IOPROCS_VERSION ...
 #define LCB_CMDVIEWQUERY_F_INCLUDE_DOCS ...
 #define LCB_N1P_QUERY_STATEMENT ...
+typedef struct _Cb_LOGGER _Cb_LOGGER;
+typedef void (*_Cb_log_handler)(unsigned int, const char*, int, const char*, int, const char*);
+_Cb_LOGGER *_Cb_logger_new(int minlevel, _Cb_log_handler handler);
+void _Cb_logger_free(_Cb_LOGGER *logger);
+void _Cb_logger_set_level(_Cb_LOGGER *logger, int minlevel);
+lcb_logprocs *_Cb_logger_procs(_Cb_LOGGER *logger);
 ''')
 
     C = ffi.verify(VERIFY_INPUT,
@@ -44,11 +44,13 @@ class _PyCBC_Class(object):
         self.fmt_auto = None
         self.pypy_mres_factory = None
         self.view_path_helper = None
+        self._lcb_exc_cache = {}
 
     def configure(self, key, value):
         if not hasattr(self, key):
             raise KeyError('No such key: {0}'.format(key))
         setattr(self, key, value)
+        self._lcb_exc_cache.clear()
 
     def get(self, key):
         return getattr(self, key)
@@ -79,12 +81,30 @@ class _PyCBC_Class(object):
     def exc_enc(self, msg='Bad key/value encoding', obj=None):
         self.exc_common(PYCBC_EXC_ENCODING, msg, 0, objextra=obj)
 
-    def exc_lcb(self, rc, msg='Operational error'):
+    def lcb_exc_class(self, rc):
+        """
+        Get the exception class for a libcouchbase error code. Lookups are
+        cached, as this is resolved for every failed operation.
+        """
+        try:
+            return self._lcb_exc_cache[rc]
+        except KeyError:
+            pass
         try:
             cls = self.lcb_errno_map[rc]
         except KeyError:
             cls = self.default_exception.rc_to_exctype(rc)
-        raise cls({'rc': rc, 'message': msg})
+        self._lcb_exc_cache[rc] = cls
+        return cls
+
+    def make_exc_lcb(self, rc, msg='Operational error'):
+        """
+        Create (but do not raise) the exception for a libcouchbase error code
+        """
+        return self.lcb_exc_class(rc)({'rc': rc, 'message': msg})
+
+    def exc_lcb(self, rc, msg='Operational error'):
+        raise self.make_exc_lcb(rc, msg)
 
     def exc_lock(self, msg=None):
         if msg is None:
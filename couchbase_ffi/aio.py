@@ -0,0 +1,191 @@
+"""
+Native :mod:`asyncio` support.
+
+:class:`AsyncioIOPS` drives libcouchbase's I/O from an asyncio event loop,
+and :class:`AsyncBucket` exposes the bucket operations as futures, so that
+any number of coroutines can share a single connection::
+
+    bucket = AsyncBucket('couchbase://localhost/default')
+    yield from bucket.connect()
+    result = yield from bucket.get('key')
+
+Requires Python 3.4 or later.
+"""
+import asyncio
+
+from couchbase_ffi.bucket import Bucket
+from couchbase_ffi.completions import CompletionBatcher
+from couchbase_ffi.iops import IOEvent, TimerEvent
+from couchbase_ffi.constants import (
+    PYCBC_EVACTION_WATCH, PYCBC_CONN_F_ASYNC, PYCBC_CONN_F_ASYNC_DTOR,
+    LCB_READ_EVENT, LCB_WRITE_EVENT)
+
+
+class AsyncioIOEvent(IOEvent):
+    def __init__(self):
+        super(AsyncioIOEvent, self).__init__()
+        # The descriptor and events currently registered with the loop
+        self._aio_fd = -1
+        self._aio_flags = 0
+
+
+class AsyncioTimer(TimerEvent):
+    def __init__(self):
+        super(AsyncioTimer, self).__init__()
+        self._aio_handle = None
+
+
+class AsyncioIOPS(object):
+    """
+    I/O procs for :class:`~couchbase_ffi.iops.IOPSWrapper` backed by an
+    asyncio event loop. Sockets are watched with ``add_reader`` and
+    ``add_writer``, and timers are scheduled with ``call_later``.
+    """
+
+    def __init__(self, loop=None):
+        self.loop = loop or asyncio.get_event_loop()
+
+    def io_event_factory(self):
+        return AsyncioIOEvent()
+
+    def timer_event_factory(self):
+        return AsyncioTimer()
+
+    def update_event(self, event, action, flags):
+        loop = self.loop
+        if action != PYCBC_EVACTION_WATCH:
+            flags = 0
+
+        cur_flags = event._aio_flags
+        if event._aio_fd != event.fd:
+            # The event was moved to a new socket
+            self._unregister(event, cur_flags)
+            cur_flags = 0
+
+        if flags & LCB_READ_EVENT and not cur_flags & LCB_READ_EVENT:
+            loop.add_reader(event.fd, event.ready_r)
+        elif cur_flags & LCB_READ_EVENT and not flags & LCB_READ_EVENT:
+            loop.remove_reader(event.fd)
+
+        if flags & LCB_WRITE_EVENT and not cur_flags & LCB_WRITE_EVENT:
+            loop.add_writer(event.fd, event.ready_w)
+        elif cur_flags & LCB_WRITE_EVENT and not flags & LCB_WRITE_EVENT:
+            loop.remove_writer(event.fd)
+
+        event._aio_fd = event.fd
+        event._aio_flags = flags
+
+    def _unregister(self, event, cur_flags):
+        if cur_flags & LCB_READ_EVENT:
+            self.loop.remove_reader(event._aio_fd)
+        if cur_flags & LCB_WRITE_EVENT:
+            self.loop.remove_writer(event._aio_fd)
+
+    def update_timer(self, timer, action, usecs):
+        if timer._aio_handle is not None:
+            timer._aio_handle.cancel()
+            timer._aio_handle = None
+        if action == PYCBC_EVACTION_WATCH:
+            timer._aio_handle = self.loop.call_later(
+                usecs / 1000000.0, timer.ready)
+
+    def start_watching(self):
+        pass
+
+    def stop_watching(self):
+        pass
+
+
+def _new_future(loop):
+    try:
+        return loop.create_future()
+    except AttributeError:
+        return asyncio.Future(loop=loop)
+
+
+def _to_future(meth):
+    def wrapped(self, *args, **kwargs):
+        fut = _new_future(self._loop)
+        try:
+            res = meth(self, *args, **kwargs)
+        except Exception as e:
+            fut.set_exception(e)
+            return fut
+
+        def on_ok(result):
+            if not fut.cancelled():
+                fut.set_result(result)
+
+        def on_err(_, exc_type, exc_value, tb):
+            if not fut.cancelled():
+                fut.set_exception(exc_value)
+
+        res.set_callbacks(on_ok, on_err)
+        return fut
+
+    wrapped.__name__ = meth.__name__
+    wrapped.__doc__ = meth.__doc__
+    return wrapped
+
+
+class AsyncBucket(Bucket):
+    """
+    A bucket whose operations return :class:`asyncio.Future` objects.
+
+    Single-key operations resolve to their result object and multi-key
+    operations to their :class:`~couchbase_ffi.result.AsyncResult`. Failed
+    operations set the exception which the synchronous bucket would have
+    raised.
+    """
+
+    def __init__(self, *args, **kwargs):
+        """
+        Accepts the same arguments as :class:`Bucket`, along with:
+        :param loop: The asyncio event loop. Defaults to the current loop
+        :param batch_completions: Resolve the futures of all operations
+            completed in one loop iteration from a single callback (see
+            :class:`~couchbase_ffi.completions.CompletionBatcher`)
+        """
+        loop = kwargs.pop('loop', None) or asyncio.get_event_loop()
+        batch_completions = kwargs.pop('batch_completions', False)
+        kwargs['_iops'] = AsyncioIOPS(loop)
+        kwargs['_flags'] = kwargs.get('_flags', 0) | \
+            PYCBC_CONN_F_ASYNC | PYCBC_CONN_F_ASYNC_DTOR
+        super(AsyncBucket, self).__init__(*args, **kwargs)
+        self._loop = loop
+        if batch_completions:
+            self.completion_batcher = CompletionBatcher(loop.call_soon)
+
+    __slots__ = ['_loop']
+
+    def connect(self):
+        """
+        Connect to the cluster
+        :return: A future which completes once the bucket is ready
+        """
+        fut = _new_future(self._loop)
+
+        def on_connected(err):
+            if fut.cancelled():
+                return
+            if err is not None:
+                fut.set_exception(err)
+            else:
+                fut.set_result(self)
+
+        self._conncb = on_connected
+        try:
+            self._connect()
+        except Exception as e:
+            self._conncb = None
+            fut.set_exception(e)
+        return fut
+
+    for _name in Bucket._VALUE_METHS + Bucket._KEY_METHS:
+        locals()[_name] = _to_future(getattr(Bucket, _name))
+        locals()[_name + '_multi'] = \
+            _to_future(getattr(Bucket, _name + '_multi'))
+    del _name
+
+    # noinspection PyUnresolvedReferences
+    unlock_multi = _unlock_multi
@@ -0,0 +1,209 @@
+"""
+Automatic batching of single-key operations issued from many threads
+"""
+import sys
+from threading import Condition, Event, Thread
+
+from couchbase.exceptions import CouchbaseError
+
+from couchbase_ffi._rtconfig import PyCBC
+from couchbase_ffi.metrics import Histogram, clock
+
+
+class _Request(object):
+    __slots__ = ['name', 'key', 'value', 'quiet', 'queued', 'done',
+                 'result', 'exc_info']
+
+    def __init__(self, name, key, value, quiet):
+        self.name = name
+        self.key = key
+        self.value = value
+        self.quiet = quiet
+        self.queued = clock()
+        self.done = Event()
+        self.result = None
+        self.exc_info = None
+
+
+def _result_exc_info(result):
+    """
+    Create the exception information for a failed result, in the same way
+    :meth:`MultiResult._add_bad_rc` would
+    """
+    ex = PyCBC.make_exc_lcb(result.rc)
+    ex.key = result.key
+    ex.result = result
+    return type(ex), ex, None
+
+
+class AutoBatcher(object):
+    """
+    Front end for a synchronous :class:`~couchbase_ffi.bucket.Bucket` which
+    collects single ``get`` and ``upsert`` calls made from many threads and
+    submits them together as one multi operation. This lets callers which
+    only ever deal with one key at a time share the scheduling and
+    ``lcb_wait`` overhead of a batch.
+
+    A batch is submitted once ``max_ops`` requests are queued or when the
+    oldest queued request has waited ``max_delay`` seconds. Each caller
+    blocks until its own result (or exception) is available.
+
+    The batch is run from a dedicated thread, so the bucket should not be
+    used concurrently by other threads unless it was created with
+    ``LOCKMODE_WAIT``.
+    """
+
+    def __init__(self, bucket, max_ops=64, max_delay=0.0005):
+        """
+        :param bucket: The bucket to submit operations to
+        :param max_ops: The maximum number of requests in a batch
+        :param max_delay: The maximum time, in seconds, a request is held
+            back waiting for other requests to join its batch
+        """
+        self._bucket = bucket
+        self.max_ops = max_ops
+        self.max_delay = max_delay
+
+        self.batch_sizes = Histogram()
+        """Histogram of the number of requests in each submitted batch"""
+
+        self.added_latency = Histogram()
+        """
+        Histogram of the time, in microseconds, requests spent queued
+        before being submitted
+        """
+
+        self._cond = Condition()
+        self._pending = []
+        self._closed = False
+        self._thread = Thread(target=self._run, name='couchbase-autobatch')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def get(self, key, quiet=None):
+        """
+        Retrieve a single key as part of the next batch
+        :param key: The key to retrieve
+        :param quiet: Whether a missing key should return a failed result
+            rather than raise an exception. Defaults to the bucket's setting
+        :return: The :class:`ValueResult`
+        """
+        if quiet is None:
+            quiet = self._bucket.quiet
+        return self._submit(_Request('get', key, None, quiet))
+
+    def upsert(self, key, value):
+        """
+        Store a single value as part of the next batch
+        :param key: The key to store
+        :param value: The value to store
+        :return: The :class:`OperationResult`
+        """
+        return self._submit(_Request('upsert', key, value, False))
+
+    def stats(self):
+        """
+        :return: A dictionary containing snapshots of the batch size and
+            added latency histograms
+        """
+        return {
+            'batch_sizes': self.batch_sizes.snapshot(),
+            'added_latency': self.added_latency.snapshot()
+        }
+
+    def close(self):
+        """
+        Submit any outstanding requests and stop the batching thread
+        """
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        self._thread.join()
+
+    def _submit(self, req):
+        with self._cond:
+            if self._closed:
+                PyCBC.exc_args('Batcher is closed')
+            self._pending.append(req)
+            if len(self._pending) == 1 or len(self._pending) >= self.max_ops:
+                self._cond.notify()
+
+        req.done.wait()
+        if req.exc_info:
+            PyCBC.raise_helper(*req.exc_info)
+        return req.result
+
+    def _next_batch(self):
+        with self._cond:
+            while not self._pending and not self._closed:
+                self._cond.wait()
+
+            if self._pending:
+                deadline = self._pending[0].queued + self.max_delay
+                while len(self._pending) < self.max_ops and not self._closed:
+                    remaining = deadline - clock()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+
+            batch = self._pending[:self.max_ops]
+            del self._pending[:self.max_ops]
+            return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if not batch:
+                return
+            self._dispatch(batch)
+
+    def _dispatch(self, batch):
+        now = clock()
+        self.batch_sizes.record(len(batch))
+        for req in batch:
+            self.added_latency.record((now - req.queued) * 1000000)
+
+        # Gets for the same key share an entry. Upserts for the same key
+        # must each be submitted, so a duplicate starts a new round.
+        gets = {}
+        upsert_rounds = []
+        for req in batch:
+            if req.name == 'get':
+                gets.setdefault(req.key, []).append(req)
+                continue
+            for rnd in upsert_rounds:
+                if req.key not in rnd:
+                    break
+            else:
+                rnd = {}
+                upsert_rounds.append(rnd)
+            rnd[req.key] = req
+
+        if gets:
+            self._run_multi('get', list(gets), gets, quiet=True)
+        for rnd in upsert_rounds:
+            kv = dict((k, req.value) for k, req in rnd.items())
+            self._run_multi(
+                'upsert', kv, dict((k, [req]) for k, req in rnd.items()))
+
+    def _run_multi(self, name, kv, waiters, **kwargs):
+        try:
+            mres = self._bucket._execute_multi(name, kv, **kwargs)
+            exc_info = None
+        except CouchbaseError as e:
+            exc_info = sys.exc_info()
+            mres = getattr(e, 'all_results', None)
+        except Exception:
+            exc_info = sys.exc_info()
+            mres = None
+
+        for key, reqs in waiters.items():
+            result = mres.get(key) if mres is not None else None
+            for req in reqs:
+                if result is None:
+                    req.exc_info = exc_info
+                elif result.rc and not req.quiet:
+                    req.exc_info = _result_exc_info(result)
+                else:
+                    req.result = result
+                req.done.set()
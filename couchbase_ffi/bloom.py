@@ -0,0 +1,148 @@
+"""
+Bloom filter used to avoid round trips for keys known not to exist
+"""
+import hashlib
+import math
+import struct
+
+
+class BloomFilter(object):
+    """
+    A Bloom filter over encoded document keys.
+
+    When assigned to :attr:`Bucket.key_filter`, ``get`` operations on a
+    synchronous bucket skip any key which is definitely not in the filter,
+    and fail it locally with ``LCB_KEY_ENOENT`` instead of contacting the
+    server. Keys successfully stored or incremented through the bucket are
+    added to the filter automatically.
+
+    Bloom filters cannot forget keys, so removing a document leaves its key
+    in the filter. This is always safe (the key is merely looked up on the
+    server) but adds to the false positive rate over time; rebuild the
+    filter periodically if the keyspace churns.
+
+    Keys are encoded with the transcoder's ``encode_key``, as the bucket
+    encodes them; a bucket with a custom transcoder needs a filter using
+    the same one.
+    """
+
+    def __init__(self, capacity, error_rate=0.01, transcoder=None):
+        """
+        :param capacity: The number of keys the filter is sized for
+        :param error_rate: The desired false positive probability once
+            `capacity` keys have been added
+        :param transcoder: The transcoder used to encode keys. Defaults to
+            the default transcoder
+        """
+        if capacity < 1 or not 0 < error_rate < 1:
+            raise ValueError('Invalid capacity or error rate')
+
+        nbits = int(math.ceil(
+            -capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self.nbits = max(8, nbits)
+        self.nhashes = max(1, int(round(
+            float(self.nbits) / capacity * math.log(2))))
+        self._bits = bytearray((self.nbits + 7) // 8)
+        self.transcoder = transcoder
+
+        self.skipped = 0
+        """Lookups answered locally because the key was definitely absent"""
+
+        self.false_positives = 0
+        """Lookups which passed the filter but were not found on the server"""
+
+    @classmethod
+    def from_keys(cls, keys, error_rate=0.01, capacity=None,
+                  transcoder=None):
+        """
+        Build a filter from an existing set of keys, e.g. a key dump or
+        the document IDs of a view
+        :param keys: An iterable of keys
+        :param error_rate: The desired false positive probability
+        :param capacity: The expected number of keys. Defaults to the number
+            of keys provided
+        :param transcoder: The transcoder used to encode keys
+        :return: A new :class:`BloomFilter`
+        """
+        keys = list(keys)
+        if capacity is None:
+            capacity = len(keys)
+        bf = cls(max(1, capacity), error_rate, transcoder)
+        bf.update(keys)
+        return bf
+
+    def _encode(self, key):
+        tc = self.transcoder
+        if tc is None:
+            from couchbase_ffi._libcouchbase import Transcoder
+            tc = self.transcoder = Transcoder()
+        return tc.encode_key(key)
+
+    def _positions(self, key):
+        h1, h2 = struct.unpack('<QQ', hashlib.md5(key).digest())
+        nbits = self.nbits
+        return [(h1 + i * h2) % nbits for i in range(self.nhashes)]
+
+    def add(self, key):
+        """
+        Add a key to the filter
+        :param key: The key
+        """
+        self._add_encoded(self._encode(key))
+
+    def _add_encoded(self, k_enc):
+        bits = self._bits
+        for pos in self._positions(k_enc):
+            bits[pos >> 3] |= 1 << (pos & 7)
+
+    def update(self, keys):
+        """
+        Add several keys to the filter
+        :param keys: An iterable of keys
+        """
+        for key in keys:
+            self.add(key)
+
+    def __contains__(self, key):
+        return self._contains_encoded(self._encode(key))
+
+    def _contains_encoded(self, k_enc):
+        bits = self._bits
+        for pos in self._positions(k_enc):
+            if not bits[pos >> 3] & (1 << (pos & 7)):
+                return False
+        return True
+
+    def check(self, k_enc):
+        """
+        Check whether a lookup must be sent to the server, and account for
+        the lookup in the filter's statistics. Called by the bucket
+        :param k_enc: The key, as encoded by the transcoder
+        :return: False if the key is definitely absent
+        """
+        if self._contains_encoded(k_enc):
+            return True
+        self.skipped += 1
+        return False
+
+    @property
+    def false_positive_rate(self):
+        """
+        The observed fraction of absent keys which the filter failed to
+        exclude
+        """
+        negatives = self.false_positives + self.skipped
+        if not negatives:
+            return 0.0
+        return float(self.false_positives) / negatives
+
+    def stats(self):
+        """
+        :return: A dictionary with the number of round trips saved and the
+            observed false positive rate
+        """
+        return {
+            'saved_round_trips': self.skipped,
+            'false_positives': self.false_positives,
+            'false_positive_rate': self.false_positive_rate
+        }
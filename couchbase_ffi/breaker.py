@@ -0,0 +1,253 @@
+"""
+Circuit breaking and load shedding for the scheduling path
+"""
+import sys
+import time
+
+from couchbase.exceptions import CouchbaseError
+
+from couchbase_ffi._cinit import get_handle
+from couchbase_ffi.constants import (
+    LCB_ERRTYPE_NETWORK, LCB_ERRTYPE_TRANSIENT, LCB_ERRTYPE_FATAL)
+
+ffi, C = get_handle()
+
+_FAILURE_ERRTYPES = LCB_ERRTYPE_NETWORK | LCB_ERRTYPE_TRANSIENT | \
+    LCB_ERRTYPE_FATAL
+
+
+class CircuitOpenError(CouchbaseError):
+    """
+    An operation was rejected without being scheduled, because the circuit
+    for the bucket (or for the server owning the key) is open
+    """
+
+
+class TooManyInFlightError(CouchbaseError):
+    """
+    An operation was rejected without being scheduled, because the bucket
+    already has the maximum number of operations in flight
+    """
+
+
+class _Circuit(object):
+    __slots__ = ['state', 'opened_at', 'window_start', 'requests',
+                 'failures', 'probes']
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, now):
+        self.state = self.CLOSED
+        self.opened_at = 0
+        self.probes = 0
+        self.reset_window(now)
+
+    def reset_window(self, now):
+        self.window_start = now
+        self.requests = 0
+        self.failures = 0
+
+
+class CircuitBreaker(object):
+    """
+    Tracks the rate of network, transient and fatal errors (including
+    timeouts) of a bucket's operations, and fails new operations fast
+    while that rate is too high.
+
+    The circuit opens once at least ``min_requests`` results were seen in
+    the current ``window`` and ``failure_ratio`` of them failed. While open,
+    operations raise :exc:`CircuitOpenError` without being scheduled. After
+    ``reset_timeout`` seconds the circuit becomes half-open and admits up to
+    ``half_open_probes`` operations; the first result of a probe either
+    closes the circuit again or re-opens it. A probe which fails to be
+    scheduled (e.g. because a value cannot be encoded), or whose keys were
+    all rejected or completed locally, is given back.
+
+    With ``per_server``, an additional circuit is kept for each server
+    index (as reported by :meth:`Bucket._vbmap`), so only keys owned by a
+    failing node are rejected. This costs a vBucket lookup per key. A
+    half-open server circuit counts an operation as one probe, however many
+    of its keys the server owns. Rejected keys are not scheduled; their
+    results have an error code of ``LCB_ETMPFAIL`` and the operation fails
+    with :exc:`CircuitOpenError`, while the other keys proceed. Keys which
+    cannot be mapped (e.g. before the first configuration) are only
+    tracked by the bucket's circuit.
+
+    Independently of the error rate, ``max_in_flight`` caps the number of
+    operations awaiting completion; once reached, new operations raise
+    :exc:`TooManyInFlightError`.
+    """
+
+    def __init__(self, failure_ratio=0.5, min_requests=20, window=10.0,
+                 reset_timeout=5.0, half_open_probes=1, per_server=False,
+                 max_in_flight=None):
+        self.failure_ratio = failure_ratio
+        self.min_requests = min_requests
+        self.window = window
+        self.reset_timeout = reset_timeout
+        self.half_open_probes = half_open_probes
+        self.per_server = per_server
+        self.max_in_flight = max_in_flight
+
+        self._circuit = _Circuit(time.time())
+        self._servers = {}
+
+        # Half-open circuits which admitted the operation being scheduled
+        self._probes = []
+
+        # Whether each server was admitted for the operation being scheduled
+        self._op_servers = {}
+
+        self.rejected = 0
+        """Operations rejected because a circuit was open"""
+
+        self.shed = 0
+        """Operations rejected because of the in-flight limit"""
+
+    @staticmethod
+    def is_failure(rc):
+        """
+        Whether an error code counts against the circuit. Data errors such
+        as a missing key do not, as they say nothing about the cluster's
+        health.
+        """
+        return bool(rc and C.lcb_get_errtype(rc) & _FAILURE_ERRTYPES)
+
+    def _admit(self, circuit, now, msg):
+        if circuit.state == _Circuit.OPEN:
+            if now - circuit.opened_at < self.reset_timeout:
+                self.rejected += 1
+                raise CircuitOpenError.pyexc(msg)
+            circuit.state = _Circuit.HALF_OPEN
+            circuit.probes = 0
+
+        if circuit.state == _Circuit.HALF_OPEN:
+            if circuit.probes >= self.half_open_probes:
+                self.rejected += 1
+                raise CircuitOpenError.pyexc(msg)
+            circuit.probes += 1
+            self._probes.append(circuit)
+
+    def _record(self, circuit, now, failed):
+        if circuit.state == _Circuit.HALF_OPEN:
+            if failed:
+                circuit.state = _Circuit.OPEN
+                circuit.opened_at = now
+            else:
+                circuit.state = _Circuit.CLOSED
+                circuit.reset_window(now)
+            return
+        if circuit.state == _Circuit.OPEN:
+            return
+
+        if now - circuit.window_start > self.window:
+            circuit.reset_window(now)
+        circuit.requests += 1
+        if failed:
+            circuit.failures += 1
+            if circuit.requests >= self.min_requests and \
+                    circuit.failures >= self.failure_ratio * circuit.requests:
+                circuit.state = _Circuit.OPEN
+                circuit.opened_at = now
+
+    def _server_index(self, parent, c_key, c_len):
+        try:
+            return parent._vbmap_c(c_key, c_len)[1]
+        except CouchbaseError:
+            return None
+
+    def _server_circuit(self, ix, now):
+        try:
+            return self._servers[ix]
+        except KeyError:
+            circuit = self._servers[ix] = _Circuit(now)
+            return circuit
+
+    def admit(self, parent):
+        """
+        Called before an operation is scheduled
+        :param parent: The bucket
+        """
+        del self._probes[:]
+        self._op_servers.clear()
+        if self.max_in_flight is not None and \
+                len(parent._handles) >= self.max_in_flight:
+            self.shed += 1
+            raise TooManyInFlightError.pyexc(
+                'Too many operations in flight', obj=len(parent._handles))
+        self._admit(self._circuit, time.time(), 'Circuit open for bucket')
+
+    def release(self):
+        """
+        Called when the operation last admitted failed to be scheduled, or
+        had none of its keys scheduled, so that it does not hold on to
+        half-open probes which will never produce a result
+        """
+        for circuit in self._probes:
+            if circuit.state == _Circuit.HALF_OPEN and circuit.probes:
+                circuit.probes -= 1
+        del self._probes[:]
+
+    def admit_key(self, parent, c_key, c_len, result, mres):
+        """
+        Called before each key of an operation is scheduled, when
+        tracking servers individually. A rejected key is completed with an
+        error instead.
+        :param parent: The bucket
+        :param c_key: The pointer to the encoded key
+        :param c_len: The length of the key
+        :param result: The result object for the key
+        :param mres: The operation's MultiResult
+        :return: True if the key may be scheduled
+        """
+        ix = self._server_index(parent, c_key, c_len)
+        if ix is None:
+            return True
+        admitted = self._op_servers.get(ix)
+        if admitted is None:
+            now = time.time()
+            try:
+                self._admit(self._server_circuit(ix, now), now,
+                            'Circuit open for server')
+                admitted = True
+            except CircuitOpenError:
+                admitted = False
+                ex = sys.exc_info()
+                ex[1].key = result.key
+                ex[1].all_results = mres
+                mres._add_err(ex)
+            self._op_servers[ix] = admitted
+
+        if not admitted:
+            result.rc = C.LCB_ETMPFAIL
+        return admitted
+
+    def record(self, parent, rc, c_key, c_len):
+        """
+        Record the result of a single key
+        :param parent: The bucket
+        :param rc: The result's error code
+        :param c_key: The pointer to the encoded key
+        :param c_len: The length of the key
+        """
+        now = time.time()
+        failed = self.is_failure(rc)
+        self._record(self._circuit, now, failed)
+        if self.per_server:
+            ix = self._server_index(parent, c_key, c_len)
+            if ix is not None:
+                self._record(self._server_circuit(ix, now), now, failed)
+
+    def stats(self):
+        """
+        :return: A dictionary with the state of the bucket's circuit, the
+            state of each server's circuit, and the rejection counters
+        """
+        return {
+            'state': self._circuit.state,
+            'servers': dict((ix, c.state) for ix, c in self._servers.items()),
+            'rejected': self.rejected,
+            'shed': self.shed
+        }
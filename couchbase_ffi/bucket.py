@@ -1,6 +1,8 @@
 import sys
+import time
 import warnings
 import weakref
+from array import array
 from threading import Lock
 
 from couchbase_ffi._cinit import get_handle
@@ -12,6 +14,18 @@ from couchbase_ffi.http import HttpRequest
 from couchbase_ffi.iops import IOPSWrapper
 from couchbase_ffi.lcbcntl import CNTL_VTYPE_MAP
 from couchbase_ffi.bufmanager import BufManager
+from couchbase_ffi.writebehind import WriteBehindBuffer
+from couchbase_ffi.retry import RetryPolicy
+from couchbase_ffi.breaker import CircuitBreaker
+from couchbase_ffi.ratelimit import RateLimiter
+from couchbase_ffi.hedge import HedgePolicy
+from couchbase_ffi.timeouts import AdaptiveTimeout
+from couchbase_ffi.profiles import OPTIONAL, READABLE, parse_profile
+from couchbase_ffi.metrics import OperationMetrics, PhaseTimes, clock
+from couchbase_ffi.tracing import Tracer
+from couchbase_ffi.hotkeys import HotKeyTracker
+from couchbase_ffi.completions import CompletionBatcher
+from couchbase_ffi import lcblog
 from couchbase_ffi._rtconfig import (
     PyCBC, pycbc_exc_enc, pycbc_exc_args, pycbc_exc_lcb)
 from couchbase_ffi._strutil import from_cstring
@@ -25,6 +39,7 @@ ffi, C = get_handle()
 
 
 CALLBACK_DECL = 'void(lcb_t,int,const lcb_RESPBASE*)'
+TIMER_DECL = 'void(lcb_timer_t,lcb_t,const void*)'
 
 
 def _make_transcoder():
@@ -49,6 +64,44 @@ def _gen_keymeth(name):
     return do_single, do_multi
 
 
+class _LcbTimer(object):
+    """
+    A one-shot libcouchbase timer which invokes a Python callable. Pending
+    timers count as outstanding work, so ``lcb_wait`` will not return
+    until they have fired or been cancelled, unless they are standalone.
+    """
+    def __init__(self, parent, fn):
+        self.parent = parent
+        self.fn = fn
+        self._cdata = ffi.new_handle(self)
+        self._c_timer = None
+        self.standalone = False
+
+    def start(self, usec, flags=0):
+        errp = ffi.new('lcb_error_t*')
+        c_timer = C.lcb_timer_create(
+            self.parent._lcbh, self._cdata, usec, flags,
+            self.parent._bound_cb['_timer'], errp)
+        if errp[0]:
+            raise pycbc_exc_lcb(errp[0])
+        self._c_timer = c_timer
+        self.standalone = bool(flags & C.LCB_TIMER_STANDALONE)
+        self.parent._timers.add(self)
+
+    def cancel(self):
+        if self._c_timer is None:
+            return
+        C.lcb_timer_destroy(self.parent._lcbh, self._c_timer)
+        self._c_timer = None
+        self.parent._timers.discard(self)
+
+    def _fired(self):
+        # Non-periodic timers are destroyed by the library once fired
+        self._c_timer = None
+        self.parent._timers.discard(self)
+        self.fn()
+
+
 class InstanceReference(weakref.ref):
     """
     This magical class exists because we can't really have a __del__ method
@@ -95,6 +148,7 @@ class InstanceReference(weakref.ref):
 
     def __init__(self, bucket):
         self.dtorhook = None
+        self.logger = None
         self._is_async = bucket._is_async
         self._boundcb = ffi.callback('void(const void*)', self._async_dtor_cb)
         self.instance = bucket._lcbh
@@ -147,9 +201,66 @@ class Bucket(object):
 
         # Internal (used by couchbase and couchbase_ffi
         '_dur_persist_to', '_dur_replicate_to', '_dur_timeout', '_dur_testhook',
-        '_privflags', '_conncb'
+        '_privflags', '_conncb',
+
+        # Request coalescing
+        '_inflight_gets', '_coalesced_count',
+
+        # Key existence filter
+        '_key_filter',
+
+        # Retrying of transient failures
+        '_retry_policy',
+
+        # Circuit breaking and load shedding
+        '_breaker',
+
+        # Rate limiting and adaptive concurrency
+        '_rate_limiter',
+
+        # Adaptive operation timeout
+        '_timeout_ctl',
+
+        # Timers and hedged reads
+        '_timers', '_hedge_policy',
+
+        # Latency histograms, phase profiling, tracing and hot keys
+        '_metrics', '_phase_totals', '_tracer', '_hot_keys',
+
+        # Logging
+        '_lcb_logger',
+
+        # Settings applied through tuning profiles
+        '_profile',
+
+        # Reused by _vbmap_c
+        '_vbinfo',
+
+        # Deferred delivery of completed asynchronous operations
+        '_completion_queue',
+
+        # Set while an I/O thread groups several operations into one
+        # scheduling context
+        '_sched_batch',
+
+        # Operations which passed their deadline but are still pending in
+        # the library
+        '_stale'
     ]
 
+    # Operation callbacks, as (callback type, key in _bound_cb, method)
+    _CALLBACK_TYPES = (
+        (C.LCB_CALLBACK_DEFAULT, '_default', '_default_callback'),
+        (C.LCB_CALLBACK_STORE, 'store', '_storage_callback'),
+        (C.LCB_CALLBACK_GET, 'get', '_get_callback'),
+        (C.LCB_CALLBACK_GETREPLICA, 'get', '_get_callback'),
+        (C.LCB_CALLBACK_REMOVE, 'remove', '_remove_callback'),
+        (C.LCB_CALLBACK_COUNTER, 'counter', '_counter_callback'),
+        (C.LCB_CALLBACK_OBSERVE, 'observe', '_observe_callback'),
+        (C.LCB_CALLBACK_STATS, 'stats', '_stats_callback'),
+        (C.LCB_CALLBACK_HTTP, 'http', '_http_callback')
+    )
+
     @property
     def _tc(self):
         return self.__transcoder
@@ -206,7 +317,8 @@ class Bucket(object):
             '_bootstrap': ffi.callback('void(lcb_t,lcb_error_t)',
                                        self._bootstrap_callback),
             '_dtor': ffi.callback('void(const void*)',
-                                  self._instance_destroyed)
+                                  self._instance_destroyed),
+            '_timer': ffi.callback(TIMER_DECL, self._timer_callback)
         }
 
         self._executors = {
@@ -228,15 +340,8 @@ class Bucket(object):
             '_rget': executors.GetReplicaExecutor(self)
         }
 
-        self._install_cb(C.LCB_CALLBACK_DEFAULT, '_default')
-        self._install_cb(C.LCB_CALLBACK_STORE, 'store')
-        self._install_cb(C.LCB_CALLBACK_GET, 'get')
-        self._install_cb(C.LCB_CALLBACK_GETREPLICA, 'get')
-        self._install_cb(C.LCB_CALLBACK_REMOVE, 'remove')
-        self._install_cb(C.LCB_CALLBACK_COUNTER, 'counter')
-        self._install_cb(C.LCB_CALLBACK_OBSERVE, 'observe')
-        self._install_cb(C.LCB_CALLBACK_STATS, 'stats')
-        self._install_cb(C.LCB_CALLBACK_HTTP, 'http')
+        self._init_state()
+        self._install_callbacks()
         C.lcb_set_bootstrap_callback(self._lcbh, self._bound_cb['_bootstrap'])
 
         # Set our properties
@@ -256,11 +361,39 @@ class Bucket(object):
         self.__connected = False
         self._lockmode = lockmode if unlock_gil else LOCKMODE_NONE
         self._lock = Lock()
-        self._pipeline_queue = None
 
         self._embedref = None
         InstanceReference.addref(self)
 
+        if lcblog.get_default_logger() is not None:
+            self.lcb_logger = lcblog.get_default_logger()
+
+    def _init_state(self):
+        """
+        Initialize the state of the optional features (all disabled) and of
+        the scheduling path. None of it depends on the library handle.
+        """
+        self._pipeline_queue = None
+        self._inflight_gets = None
+        self._coalesced_count = 0
+        self._key_filter = None
+        self._retry_policy = None
+        self._breaker = None
+        self._rate_limiter = None
+        self._timeout_ctl = None
+        self._timers = set()
+        self._hedge_policy = None
+        self._metrics = None
+        self._phase_totals = None
+        self._tracer = None
+        self._hot_keys = None
+        self._lcb_logger = None
+        self._profile = {}
+        self._vbinfo = None
+        self._completion_queue = None
+        self._sched_batch = False
+        self._stale = 0
+
     @property
     def default_format(self):
         return self.__default_format
@@ -308,6 +441,358 @@ class Bucket(object):
             self.__transcoder = arg
             self.__is_default_tc = True
 
+    @property
+    def coalesce_gets(self):
+        """
+        Whether concurrent ``get`` requests for the same key share a single
+        in-flight operation. This only has an effect on asynchronous
+        connections, where several callers may request the same key before
+        the first response arrives.
+        """
+        return self._inflight_gets is not None
+
+    @coalesce_gets.setter
+    def coalesce_gets(self, arg):
+        if arg:
+            if self._inflight_gets is None:
+                self._inflight_gets = {}
+        else:
+            self._inflight_gets = None
+
+    @property
+    def coalesced_count(self):
+        """
+        The number of ``get`` requests which were attached to an already
+        in-flight ``get`` rather than being scheduled on their own
+        """
+        return self._coalesced_count
+
+    @property
+    def key_filter(self):
+        """
+        An optional :class:`~couchbase_ffi.bloom.BloomFilter` of the keys
+        which exist in the bucket. When set, ``get`` operations on a
+        synchronous connection fail keys missing from the filter locally,
+        and successfully stored keys are added to it.
+        """
+        return self._key_filter
+
+    @key_filter.setter
+    def key_filter(self, arg):
+        self._key_filter = arg
+
+    @property
+    def retry_policy(self):
+        """
+        An optional :class:`~couchbase_ffi.retry.RetryPolicy` used to
+        resubmit keys which failed with transient errors. Only applies to
+        synchronous operations outside of a pipeline.
+        """
+        return self._retry_policy
+
+    @retry_policy.setter
+    def retry_policy(self, arg):
+        if arg is not None and not isinstance(arg, RetryPolicy):
+            raise pycbc_exc_args('Must be a RetryPolicy', obj=arg)
+        self._retry_policy = arg
+
+    @property
+    def circuit_breaker(self):
+        """
+        An optional :class:`~couchbase_ffi.breaker.CircuitBreaker` which
+        rejects new operations while the bucket (or a server) is failing,
+        or while too many operations are in flight
+        """
+        return self._breaker
+
+    @circuit_breaker.setter
+    def circuit_breaker(self, arg):
+        if arg is not None and not isinstance(arg, CircuitBreaker):
+            raise pycbc_exc_args('Must be a CircuitBreaker', obj=arg)
+        self._breaker = arg
+
+    @property
+    def rate_limiter(self):
+        """
+        An optional :class:`~couchbase_ffi.ratelimit.RateLimiter` which
+        throttles the scheduling of operations
+        """
+        return self._rate_limiter
+
+    @rate_limiter.setter
+    def rate_limiter(self, arg):
+        if arg is not None and not isinstance(arg, RateLimiter):
+            raise pycbc_exc_args('Must be a RateLimiter', obj=arg)
+        self._rate_limiter = arg
+
+    @property
+    def timeout_controller(self):
+        """
+        An optional :class:`~couchbase_ffi.timeouts.AdaptiveTimeout` which
+        adjusts the operation timeout to the observed latencies
+        """
+        return self._timeout_ctl
+
+    @timeout_controller.setter
+    def timeout_controller(self, arg):
+        if arg is not None and not isinstance(arg, AdaptiveTimeout):
+            raise pycbc_exc_args('Must be an AdaptiveTimeout', obj=arg)
+        if self._timeout_ctl is not None:
+            self._timeout_ctl.detach()
+        if arg is not None:
+            arg.attach(self)
+        self._timeout_ctl = arg
+
+    @property
+    def hedge_policy(self):
+        """
+        An optional :class:`~couchbase_ffi.hedge.HedgePolicy`. When set,
+        synchronous single-key gets which are slow to complete are raced
+        against a replica read.
+        """
+        return self._hedge_policy
+
+    @hedge_policy.setter
+    def hedge_policy(self, arg):
+        if arg is not None and not isinstance(arg, HedgePolicy):
+            raise pycbc_exc_args('Must be a HedgePolicy', obj=arg)
+        self._hedge_policy = arg
+
+    @property
+    def metrics_enabled(self):
+        """
+        Whether the latency of each operation is recorded. This is disabled
+        by default. See :meth:`metrics`
+        """
+        return self._metrics is not None
+
+    @metrics_enabled.setter
+    def metrics_enabled(self, arg):
+        if not arg:
+            self._metrics = None
+        elif self._metrics is None:
+            self._metrics = OperationMetrics()
+
+    def metrics(self):
+        """
+        Get the recorded operation latencies, in microseconds. Latencies
+        are only recorded while :attr:`metrics_enabled` is set.
+        :return: A dictionary mapping each operation type (e.g. ``get``,
+            ``upsert``, ``view``) to a summary of its latencies, as
+            returned by :meth:`~.Histogram.snapshot`
+        """
+        if self._metrics is None:
+            return {}
+        return self._metrics.snapshot()
+
+    def traffic_metrics(self, large_values=None):
+        """
+        Get the number of bytes sent and received, and the sizes of the
+        values transferred, by each operation type. These are only recorded
+        while :attr:`metrics_enabled` is set.
+        :param large_values: The number of keys with the largest values to
+            include. Defaults to all the tracked keys
+        :return: A dictionary mapping each operation type to its counters
+            (see :meth:`~couchbase_ffi.metrics.OperationMetrics.traffic`).
+            The ``large_values`` entry contains a list of ``(key, size)``
+            tuples for the largest values seen, largest first
+        """
+        if self._metrics is None:
+            return {}
+        rv = self._metrics.traffic()
+        rv['large_values'] = [
+            (self._tc.decode_key(k), size)
+            for k, size in self._metrics.large_values.top(large_values)]
+        return rv
+
+    def _account_value(self, mres, c_key, c_len, nvalue, sent):
+        """
+        Account for a value sent or received while metrics are enabled
+        :param mres: The operation's MultiResult
+        :param c_key: Pointer to the encoded key
+        :param c_len: Length of the encoded key
+        :param nvalue: Size of the value
+        :param sent: Whether the value was sent (or received)
+        """
+        name = mres._op_name
+        if name is None:
+            return
+        metrics = self._metrics
+        if sent:
+            metrics.add_bytes(name, sent=nvalue)
+        else:
+            metrics.add_bytes(name, received=nvalue)
+        metrics.record_value_size(name, nvalue)
+        if metrics.large_values.accepts(nvalue):
+            metrics.large_values.add(bytes(ffi.buffer(c_key, c_len)), nvalue)
+
+    @property
+    def server_metrics_enabled(self):
+        """
+        Whether the latency of each key is also recorded per server. This
+        implies :attr:`metrics_enabled`, and costs a vBucket lookup per key.
+        See :meth:`server_metrics`
+        """
+        return self._metrics is not None and self._metrics.per_server
+
+    @server_metrics_enabled.setter
+    def server_metrics_enabled(self, arg):
+        if arg:
+            self.metrics_enabled = True
+            self._metrics.per_server = True
+        elif self._metrics is not None:
+            self._metrics.per_server = False
+
+    def server_metrics(self):
+        """
+        Get the number of keys and their latencies, in microseconds, for
+        each server
+        :return: A dictionary mapping each server index to a summary of the
+            latencies of its keys (see :meth:`~.Histogram.snapshot`); the
+            summary's ``count`` is the number of keys
+        """
+        if self._metrics is None:
+            return {}
+        return self._metrics.servers()
+
+    def reset_metrics(self):
+        """
+        Discard all recorded operation latencies and traffic counters
+        """
+        if self._metrics is not None:
+            self._metrics.reset()
+
+    @property
+    def profile_phases(self):
+        """
+        Whether the time spent in each phase of an operation (encoding,
+        scheduling, waiting, callbacks and decoding) is measured. This is
+        disabled by default as it adds several clock reads per key. The
+        times are available on each operation's
+        :attr:`~.MultiResult.phase_times` and summed up by
+        :meth:`phase_times`.
+        """
+        return self._phase_totals is not None
+
+    @profile_phases.setter
+    def profile_phases(self, arg):
+        arg = bool(arg)
+        if arg == self.profile_phases:
+            return
+        self._phase_totals = PhaseTimes() if arg else None
+        self._install_callbacks()
+
+    def phase_times(self):
+        """
+        Get the time spent in each phase by all operations scheduled while
+        :attr:`profile_phases` was set
+        :return: A dictionary as returned by
+            :meth:`~couchbase_ffi.metrics.PhaseTimes.as_dict`, or None if
+            phases are not being profiled
+        """
+        if self._phase_totals is None:
+            return None
+        return self._phase_totals.as_dict()
+
+    def reset_phase_times(self):
+        """
+        Discard the phase times accumulated so far. Operations already in
+        progress continue to accumulate into the previous totals.
+        """
+        if self._phase_totals is not None:
+            self._phase_totals = PhaseTimes()
+
+    @property
+    def tracer(self):
+        """
+        An optional :class:`~couchbase_ffi.tracing.Tracer` which receives a
+        span for each sampled operation
+        """
+        return self._tracer
+
+    @tracer.setter
+    def tracer(self, arg):
+        if arg is not None and not isinstance(arg, Tracer):
+            raise pycbc_exc_args('Must be a Tracer', obj=arg)
+        self._tracer = arg
+
+    @property
+    def completion_batcher(self):
+        """
+        An optional :class:`~couchbase_ffi.completions.CompletionBatcher`
+        through which completed asynchronous operations are delivered in
+        batches, rather than as each one completes
+        """
+        queue = self._completion_queue
+        return queue if isinstance(queue, CompletionBatcher) else None
+
+    @completion_batcher.setter
+    def completion_batcher(self, arg):
+        if arg is not None and not isinstance(arg, CompletionBatcher):
+            raise pycbc_exc_args('Must be a CompletionBatcher', obj=arg)
+        if self._completion_queue is not None and \
+                not isinstance(self._completion_queue, CompletionBatcher):
+            raise pycbc_exc_args(
+                'Completions are already delivered by this bucket')
+        old = self._completion_queue
+        self._completion_queue = arg
+        if old is not None:
+            old.drain()
+
+    @property
+    def hot_key_tracker(self):
+        """
+        An optional :class:`~couchbase_ffi.hotkeys.HotKeyTracker` counting
+        the keys scheduled by each operation. See :meth:`hot_keys`
+        """
+        return self._hot_keys
+
+    @hot_key_tracker.setter
+    def hot_key_tracker(self, arg):
+        if arg is not None and not isinstance(arg, HotKeyTracker):
+            raise pycbc_exc_args('Must be a HotKeyTracker', obj=arg)
+        self._hot_keys = arg
+
+    def hot_keys(self, n=None):
+        """
+        Get the most frequently accessed keys and vBuckets
+        :param n: The maximum number of entries to return per operation
+            type
+        :return: A dictionary as returned by
+            :meth:`~couchbase_ffi.hotkeys.HotKeyTracker.snapshot`, with the
+            keys decoded, or an empty dictionary if no tracker is set
+        """
+        if self._hot_keys is None:
+            return {}
+        rv = self._hot_keys.snapshot(n)
+        for op, entries in rv['keys'].items():
+            rv['keys'][op] = [(self._tc.decode_key(k), count, vb)
+                              for k, count, vb in entries]
+        return rv
+
+    @property
+    def lcb_logger(self):
+        """
+        An optional :class:`~couchbase_ffi.lcblog.LcbLogger` receiving the
+        library's log messages
+        """
+        return self._lcb_logger
+
+    @lcb_logger.setter
+    def lcb_logger(self, arg):
+        if arg is not None and not isinstance(arg, lcblog.LcbLogger):
+            raise pycbc_exc_args('Must be an LcbLogger', obj=arg)
+
+        procs = arg._procs if arg is not None else ffi.NULL
+        rc = C.lcb_cntl(self._lcbh, C.LCB_CNTL_SET, C.LCB_CNTL_LOGGER, procs)
+        if rc:
+            raise pycbc_exc_lcb(rc)
+        self._lcb_logger = arg
+        # The library may still log while the handle is being destroyed
+        wref = InstanceReference.INSTANCES.get(self._lcbh)
+        if wref is not None:
+            wref.logger = arg
+
     @property
     def _is_async(self):
         return self._privflags & PYCBC_CONN_F_ASYNC
@@ -338,6 +823,95 @@ class Bucket(object):
     def _install_cb(self, cbtype, name):
         C.lcb_install_callback3(self._lcbh, cbtype, self._bound_cb[name])
 
+    def _install_callbacks(self):
+        """
+        Install the operation callbacks, using timed variants of them
+        while phases are being profiled
+        """
+        for cbtype, name, meth in self._CALLBACK_TYPES:
+            if self._phase_totals is not None:
+                name = '_profiled' + name
+                if name not in self._bound_cb:
+                    self._bound_cb[name] = ffi.callback(
+                        CALLBACK_DECL, self._profiled_callback(meth))
+            self._install_cb(cbtype, name)
+
+    def _profiled_callback(self, meth):
+        fn = getattr(self, meth)
+
+        def timed(instance, cbtype, resp):
+            phases = ffi.from_handle(resp.cookie)._phases
+            if phases is None:
+                return fn(instance, cbtype, resp)
+
+            t_start = clock()
+            decoded = phases.decode
+            try:
+                fn(instance, cbtype, resp)
+            finally:
+                phases.add('callback',
+                           clock() - t_start - (phases.decode - decoded))
+        return timed
+
+    def _begin_op(self, mres, name):
+        """
+        Called when a new operation is created
+        :param mres: The operation's MultiResult
+        :param name: The operation type
+        """
+        if self._metrics is not None:
+            self._metrics.start(mres, name)
+        elif self._timeout_ctl is not None:
+            mres._op_name = name
+            mres._t_start = clock()
+        if self._phase_totals is not None:
+            mres._phases = PhaseTimes(self._phase_totals)
+            mres._phases.operations = 1
+            self._phase_totals.operations += 1
+        if self._tracer is not None:
+            mres._span = self._tracer.start_span(name)
+
+    def _end_op(self, mres, rc=0):
+        """
+        Called when an operation is complete
+        :param mres: The operation's MultiResult
+        :param rc: The operation's error code, if not recorded per key
+        """
+        ctl = self._timeout_ctl
+        if ctl is not None and mres._op_name is not None:
+            bad_rc = mres._bad_rc
+            timed_out = rc == C.LCB_ETIMEDOUT or (
+                bad_rc is not None and bad_rc[0] == C.LCB_ETIMEDOUT)
+            ctl.record(self, mres._op_name, clock() - mres._t_start,
+                       timed_out)
+        if self._metrics is not None:
+            self._metrics.finish(mres)
+        else:
+            mres._op_name = None
+        span = mres._span
+        if span is not None:
+            mres._span = None
+            if rc and not span.rc:
+                span.rc = rc
+            span.end = clock()
+            self._tracer.finish_span(span)
+
+    def _wait(self, mres):
+        """
+        Run the event loop until all scheduled operations are complete,
+        accounting the time spent waiting to `mres`
+        """
+        phases = mres._phases
+        if phases is None:
+            C.lcb_wait(self._lcbh)
+            return
+
+        t_start = clock()
+        handled = phases.callback + phases.decode
+        C.lcb_wait(self._lcbh)
+        phases.add('wait', clock() - t_start -
+                   (phases.callback + phases.decode - handled))
+
     def _connect(self):
         rc = C.lcb_connect(self._lcbh)
         if rc != C.LCB_SUCCESS:
@@ -414,41 +988,248 @@ class Bucket(object):
                 rv.append(mres)
         return rv
 
-    def _run_sync(self, mres):
-        self._handles.add(mres)
+    def _run_sync(self, mres, retry=None):
+        if mres._remaining:
+            self._handles.add(mres)
+        elif mres._cdata is not None:
+            # Every entry was completed without being scheduled. (The
+            # cookie is released once scheduled entries have completed, in
+            # which case the operation was already ended.)
+            self._end_op(mres)
+            if self._breaker is not None:
+                self._breaker.release()
         if self._pipeline_queue is None:
-            C.lcb_wait(self._lcbh)
+            self._wait(mres)
+            if retry and self._retry_policy is not None and \
+                    not mres._expired:
+                proc, kv, kwargs = retry
+                self._retry_policy.run(self, proc, kv, kwargs, mres)
             mres._maybe_throw()
         else:
             self._pipeline_queue.append(mres)
         return mres
 
     def _run_async(self, mres):
+        if not mres._remaining:
+            # Every entry was completed without being scheduled. The caller
+            # sets the callbacks once this returns, so deliver later.
+            self._end_op(mres)
+            if self._breaker is not None:
+                self._breaker.release()
+            self._start_timer(0, lambda: self._deliver(mres))
+            return mres
         self._handles.add(mres)
         return mres
 
-    def _run_sync_single(self, mres):
-        return self._run_sync(mres).unwrap_single()
+    def _run_sync_single(self, mres, retry=None):
+        return self._run_sync(mres, retry).unwrap_single()
 
-    def _run_single(self, mres):
+    def _run_single(self, mres, retry=None):
         if not self._is_async:
-            return self._run_sync_single(mres)
+            return self._run_sync_single(mres, retry)
         else:
             return self._run_async(mres)
 
-    def _run_multi(self, mres):
+    def _run_multi(self, mres, retry=None):
         mres._is_single = False
         if not self._is_async:
-            return self._run_sync(mres)
+            return self._run_sync(mres, retry)
         else:
             return self._run_async(mres)
 
+    def _resubmit(self, proc, kv, kwargs, mres):
+        """
+        Schedule some of the entries of a completed operation again and wait
+        for them. The new results replace the existing ones in `mres`. If
+        the entries fail to be scheduled, the existing results are restored
+        and the error is raised.
+        :param proc: The executor which ran the operation
+        :param kv: The entries to schedule again
+        :param kwargs: The operation's original options
+        :param mres: The completed MultiResult
+        """
+        previous = dict((key, mres.pop(key)) for key in kv)
+        mres._rescan_bad_rc()
+
+        if mres._cdata is None:
+            mres._cdata = ffi.new_handle(mres)
+        kwargs = dict(kwargs)
+        kwargs['_MRES'] = mres
+        try:
+            proc.execute(kv, **kwargs)
+        except Exception:
+            # Nothing was scheduled
+            mres.update(previous)
+            mres._rescan_bad_rc()
+            raise
+
+        if mres._remaining:
+            self._handles.add(mres)
+        self._wait(mres)
+
+    def _get_coalesce_key(self, key, kwargs):
+        """
+        Get the key under which a ``get`` may be coalesced with other
+        in-flight requests
+        :return: The coalescing key, or None if the request cannot share
+            its operation with others
+        """
+        if not self._is_async:
+            return None
+        if kwargs.get('ttl') or kwargs.get('replica'):
+            return None
+        if kwargs.get('deadline') is not None:
+            # Each caller's deadline must time out its own get
+            return None
+
+        quiet = kwargs.get('quiet')
+        if quiet is None:
+            quiet = self.quiet
+        ckey = (key, bool(quiet), bool(kwargs.get('no_format')))
+        try:
+            hash(ckey)
+        except TypeError:
+            return None
+        return ckey
+
+    def _should_hedge(self, kwargs):
+        return self._hedge_policy is not None and not self._is_async and \
+            self._pipeline_queue is None and \
+            not kwargs.get('ttl') and not kwargs.get('replica') and \
+            kwargs.get('deadline') is None
+
+    def _arm_deadline(self, mres, deadline):
+        """
+        Complete `mres` with a timeout once `deadline` passes, rather than
+        waiting for the library's operation timeout
+        :param mres: The scheduled operation
+        :param deadline: The deadline, as a :func:`time.time` timestamp
+        """
+        if mres._deadline_timer is not None or mres._expired:
+            return
+        mres._deadline_timer = self._start_timer(
+            max(deadline - time.time(), 0), lambda: self._expire(mres))
+
+    def _abandon(self, mres):
+        """
+        Stop waiting for an operation which is still pending in the library.
+        Responses still arrive for its keys in flight; they are counted by
+        _chk_op_done, but otherwise ignored, and synchronous waits return
+        once only abandoned operations are left
+        :param mres: The pending MultiResult
+        """
+        mres._expired = True
+        self._stale += 1
+
+    def _expire(self, mres):
+        mres._deadline_timer = None
+        if mres not in self._handles:
+            return
+
+        self._abandon(mres)
+        first = None
+        for result in mres.values():
+            if result.rc == -1:
+                result.rc = C.LCB_ETIMEDOUT
+                if first is None:
+                    first = result
+        mres._add_bad_rc(C.LCB_ETIMEDOUT, first)
+        self._end_op(mres, C.LCB_ETIMEDOUT)
+        if self._is_async:
+            self._deliver(mres)
+        elif len(self._handles) == self._stale:
+            C.lcb_breakout(self._lcbh)
+
+    def _start_timer(self, timeout, fn, standalone=False):
+        """
+        Invoke `fn` from within the event loop after `timeout` seconds
+        :param standalone: Whether the timer is left out of the work which
+            ``lcb_wait`` waits for. A standalone timer only fires while the
+            event loop runs for other reasons
+        :return: The timer, which may be cancelled using its `cancel` method
+        """
+        timer = _LcbTimer(self, fn)
+        timer.start(int(timeout * 1000000),
+                    C.LCB_TIMER_STANDALONE if standalone else 0)
+        return timer
+
+    def _timer_callback(self, _, instance, cookie):
+        ffi.from_handle(cookie)._fired()
+
     def _execute_single_k(self, name, key, **kwargs):
+        """
+        Schedule a single-key operation. The optional features are applied
+        in this order:
+
+        1. ``coalesce_gets``: an asynchronous get of a key which is already
+           being fetched becomes a follower of that get, and none of the
+           following steps are taken
+        2. ``rate_limiter``: an asynchronous operation is queued until it is
+           admitted; a synchronous one waits for its tokens
+        3. Locking, as per ``lockmode``
+        4. ``circuit_breaker``: the bucket's circuit and the in-flight limit
+           admit the operation. The admission is released if the operation
+           fails to be scheduled, or if none of its keys were scheduled
+        5. ``hedge_policy`` or the executor schedules the key (see
+           :meth:`~.BaseExecutor._invoke_submit` for the per-key steps)
+        6. A get which may be coalesced is registered as in flight
+
+        This method is entered again for operations admitted by the rate
+        limiter (with ``_ADMITTED``) and for operations submitted from
+        another thread, with the ``_MRES`` already returned to the caller.
+        All the steps run again, except for the rate limiter on admitted
+        operations: a queued get may still be coalesced, and the circuit
+        breaker judges the operation when it is actually scheduled. Such an
+        operation was already begun (see :meth:`_begin_op`), so the
+        executor does not begin it again.
+        :param name: The operation type
+        :param key: The key
+        :return: The result, or an :class:`AsyncResult` for asynchronous
+            buckets
+        """
+        ckey = None
+        if name == 'get' and self._inflight_gets is not None:
+            ckey = self._get_coalesce_key(key, kwargs)
+            if ckey is not None:
+                primary = self._inflight_gets.get(ckey)
+                if primary is not None:
+                    # A result created by the caller (a deferred or
+                    # I/O-thread submission) must be the one completed
+                    self._coalesced_count += 1
+                    return primary._add_follower(kwargs.get('_MRES'))
+
+        limiter = self._rate_limiter
+        if limiter is not None and not kwargs.pop('_ADMITTED', False):
+            if self._is_async:
+                return limiter.defer(self, Bucket._execute_single_k, name,
+                                     (key,), kwargs, 1, True)
+            limiter.wait(1)
+
         self._do_lock()
         try:
+            breaker = self._breaker
+            if breaker is not None:
+                breaker.admit(self)
             proc = self._executors[name]
-            mres = proc.execute((key,), **kwargs)
-            return self._run_single(mres)
+            kv = (key,)
+            hedged = name == 'get' and self._should_hedge(kwargs)
+            try:
+                if hedged:
+                    mres = self._hedge_policy.execute(self, key, kwargs)
+                else:
+                    mres = proc.execute(kv, **kwargs)
+            except Exception:
+                if breaker is not None:
+                    breaker.release()
+                raise
+
+            if hedged:
+                mres._maybe_throw()
+                return mres.unwrap_single()
+            if ckey is not None:
+                mres._coalesce_key = ckey
+                self._inflight_gets[ckey] = mres
+            return self._run_single(mres, (proc, kv, kwargs))
         finally:
             self._do_unlock()
 
@@ -458,20 +1239,56 @@ class Bucket(object):
         except TypeError:
             raise pycbc_exc_enc('Bad key-value', obj=(key,value))
 
+        limiter = self._rate_limiter
+        if limiter is not None and not kwargs.pop('_ADMITTED', False):
+            if self._is_async:
+                return limiter.defer(self, Bucket._execute_single_kv, name,
+                                     (key, value), kwargs, 1, True)
+            limiter.wait(1)
+
         self._do_lock()
         try:
+            breaker = self._breaker
+            if breaker is not None:
+                breaker.admit(self)
             proc = self._executors[name]
-            mres = proc.execute(kv, **kwargs)
-            return self._run_single(mres)
+            try:
+                mres = proc.execute(kv, **kwargs)
+            except Exception:
+                if breaker is not None:
+                    breaker.release()
+                raise
+            return self._run_single(mres, (proc, kv, kwargs))
         finally:
             self._do_unlock()
 
     def _execute_multi(self, name, kv, **kwargs):
+        limiter = self._rate_limiter
+        if limiter is not None and kwargs.pop('_ADMITTED', False):
+            limiter = None
+        if limiter is not None and self._is_async:
+            return limiter.defer(self, Bucket._execute_multi, name, (kv,),
+                                 kwargs, len(kv), False)
+
         self._do_lock()
         try:
+            breaker = self._breaker
+            if breaker is not None:
+                breaker.admit(self)
             proc = self._executors[name]
-            mres = proc.execute(kv, **kwargs)
-            return self._run_multi(mres)
+            try:
+                if limiter is None or '_MRES' in kwargs:
+                    mres = proc.execute(kv, **kwargs)
+                elif self._pipeline_queue is not None:
+                    limiter.wait(len(kv))
+                    mres = proc.execute(kv, **kwargs)
+                else:
+                    mres = limiter.run_chunked(self, proc, kv, kwargs)
+            except Exception:
+                if breaker is not None:
+                    breaker.release()
+                raise
+            return self._run_multi(mres, (proc, kv, kwargs))
         finally:
             self._do_unlock()
 
@@ -489,6 +1306,14 @@ class Bucket(object):
 
         locals().update({n_single: m_single, n_multi: m_multi})
 
+    def write_behind(self, **kwargs):
+        """
+        Create a buffer which coalesces upserts to this bucket and writes
+        them in batches. See :class:`~.WriteBehindBuffer` for the options.
+        :return: A :class:`~.WriteBehindBuffer`
+        """
+        return WriteBehindBuffer(self, **kwargs)
+
     # This name is used by couchbase.bucket.Bucket
     def _stats(self, kv):
         return self._execute_multi('stats', kv)
@@ -510,6 +1335,7 @@ class Bucket(object):
         self._chk_no_pipeline('View requests not valid in pipeline mode')
         res = ViewResult(design, view, options, include_docs)
         mres = self._make_mres()
+        self._begin_op(mres, 'view')
         mres[None] = res
         res._schedule(self, mres)
         return mres
@@ -518,17 +1344,79 @@ class Bucket(object):
         self._chk_no_pipeline('HTTP requests not valid in pipeline mode')
         htreq = HttpRequest(path, **kwargs)
         mres = self._make_mres()
+        self._begin_op(mres, 'http')
         htreq._schedule(self, mres)
+        mres._remaining = 1
         self._handles.add(mres)
         return self._run_single(mres)
 
+    def _cntlstr_rc(self, cntl_key, cntl_value):
+        return C.lcb_cntl_string(self._lcbh,
+                                 cntl_key.encode('utf-8'),
+                                 cntl_value.encode('utf-8'))
+
     def _cntlstr(self, cntl_key, cntl_value):
-        rc = C.lcb_cntl_string(self._lcbh,
-                               cntl_key.encode('utf-8'),
-                               cntl_value.encode('utf-8'))
+        rc = self._cntlstr_rc(cntl_key, cntl_value)
         if rc:
             raise pycbc_exc_lcb(rc)
 
+    def _setting(self, key):
+        """
+        Get the current value of an ``lcb_cntl_string()`` setting, if known
+        :return: The value as a string, or None
+        """
+        if key in READABLE:
+            op, value_type = READABLE[key]
+            return str(self._cntl(op, value_type=value_type))
+        return self._profile.get(key)
+
+    def apply_profile(self, profile):
+        """
+        Apply a group of settings at once
+        :param profile: The name of a predefined profile (see
+            :data:`~couchbase_ffi.profiles.PROFILES`), a dictionary of
+            ``lcb_cntl_string()`` settings, or a connection string fragment
+            such as ``operation_timeout=2.5&compression=on``
+        :return: The settings applied
+
+        If a setting is rejected, those already applied are restored and
+        the error is raised. Only the timeouts, and settings previously
+        applied through this method, have a known value to restore, so
+        they are applied first. Settings in
+        :data:`~couchbase_ffi.profiles.OPTIONAL` which the library does not
+        support are skipped, and left out of the returned settings.
+        """
+        settings = parse_profile(profile)
+        old = dict((key, self._setting(key)) for key in settings)
+        applied = []
+        for key in sorted(settings, key=lambda k: (old[k] is None, k)):
+            rc = self._cntlstr_rc(key, settings[key])
+            if rc == C.LCB_NOT_SUPPORTED and key in OPTIONAL:
+                continue
+            if rc:
+                for prev in reversed(applied):
+                    if old[prev] is not None:
+                        self._cntlstr_rc(prev, old[prev])
+                pycbc_exc_lcb(rc, 'Cannot apply setting ' + key)
+            applied.append(key)
+
+        rv = {}
+        for key in applied:
+            rv[key] = self._profile[key] = settings[key]
+        return rv
+
+    def get_profile(self):
+        """
+        Get the effective settings: the timeouts (in seconds) as reported
+        by the library, and the other settings applied through
+        :meth:`apply_profile`
+        :return: A dictionary of the settings, as strings
+        """
+        rv = dict(self._profile)
+        for key, (op, value_type) in READABLE.items():
+            rv[key] = str(self._cntl(op, value_type=value_type))
+        return rv
+
     OLD_CNTL_MAP = {
         0x00: 'uint32_t',
         0x01: 'uint32_t'
@@ -543,15 +1431,65 @@ class Bucket(object):
             raise pycbc_exc_args('Invalid value type', obj=value_type)
         return handler.execute(self._lcbh, op, value)
 
-    def _vbmap(self, key):
-        bm = BufManager(ffi)
-        info_obj = ffi.new('lcb_cntl_vbinfo_t*')
-        info_obj.v.v0.key, info_obj.v.v0.nkey = bm.new_cbuf(key)
+    def _vbmap_c(self, c_key, c_len):
+        """
+        Map an encoded key already held in a C buffer
+        :return: A tuple of ``(vbucket, server_index)``
+        """
+        info_obj = self._vbinfo
+        if info_obj is None:
+            info_obj = self._vbinfo = ffi.new('lcb_cntl_vbinfo_t*')
+        info_obj.v.v0.key = c_key
+        info_obj.v.v0.nkey = c_len
         rc = C.lcb_cntl(self._lcbh, C.LCB_CNTL_GET, C.LCB_CNTL_VBMAP, info_obj)
         if rc:
             raise pycbc_exc_lcb(rc)
         return info_obj.v.v0.vbucket, info_obj.v.v0.server_index
 
+    def _vbmap(self, key):
+        bm = BufManager(ffi)
+        return self._vbmap_c(*bm.new_cbuf(key))
+
+    def vbmap_multi(self, keys):
+        """
+        Map many keys to their vBuckets and servers. The keys are encoded
+        using the bucket's transcoder, as they would be for an operation.
+        :param keys: An iterable of keys
+        :return: A tuple of two :class:`array.array` objects, holding the
+            vBucket and the server index of each key, in the order of `keys`
+        """
+        vbuckets = array('i')
+        servers = array('i')
+        tc = self._tc
+        c_buf = ffi.new('char[]', 256)
+        c_view = ffi.buffer(c_buf)
+        for key in keys:
+            k_enc = tc.encode_key(key)
+            nkey = len(k_enc)
+            if nkey > len(c_view):
+                c_buf = ffi.new('char[]', nkey)
+                c_view = ffi.buffer(c_buf)
+            c_view[0:nkey] = k_enc
+            vbucket, server = self._vbmap_c(c_buf, nkey)
+            vbuckets.append(vbucket)
+            servers.append(server)
+        return vbuckets, servers
+
+    def group_by_server(self, keys):
+        """
+        Group keys by the server they belong to, e.g. to issue one batch
+        per server
+        :param keys: A list of keys
+        :return: A dictionary mapping each server index to the list of its
+            keys, in their original order
+        """
+        keys = list(keys)
+        _, servers = self.vbmap_multi(keys)
+        rv = {}
+        for key, server in zip(keys, servers):
+            rv.setdefault(server, []).append(key)
+        return rv
+
     @property
     def _closed(self):
         return self._privflags & PYCBC_CONN_F_CLOSED
@@ -606,7 +1544,43 @@ class Bucket(object):
             return
         # So the result is complete
         self._handles.remove(mres)
+        if self._rate_limiter is not None and self._is_async:
+            self._rate_limiter.completed(self, mres)
+        if mres._expired:
+            # Already completed by _expire, or lost a hedged race
+            self._stale -= 1
+            if mres._hedge is not None:
+                mres._hedge.completed(mres)
+            return
+        if mres._deadline_timer is not None:
+            mres._deadline_timer.cancel()
+            mres._deadline_timer = None
+        self._end_op(mres)
+        if mres._hedge is not None:
+            mres._hedge.completed(mres)
         if self._is_async:
+            self._deliver(mres)
+        elif self._stale and len(self._handles) == self._stale:
+            # Only operations past their deadline are left
+            C.lcb_breakout(self._lcbh)
+
+    def _deliver(self, mres):
+        ckey = mres._coalesce_key
+        if ckey is not None and self._inflight_gets and \
+                self._inflight_gets.get(ckey) is mres:
+            del self._inflight_gets[ckey]
+        if mres._followers:
+            # Followers passed in with _MRES were begun as operations of
+            # their own
+            for follower in mres._followers:
+                self._end_op(follower)
+        if self._completion_queue is not None:
+            # Queued separately, since a batch callback does not invoke
+            # the results
+            self._completion_queue.append(mres)
+            for follower in mres._release_followers():
+                self._completion_queue.append(follower)
+        else:
             mres.invoke()
 
     def _chain_endure(self, optype, mres, result, dur):
@@ -636,23 +1610,47 @@ class Bucket(object):
         except:
             raise pycbc_exc_enc(buf)
 
+        if mres._expired:
+            # Arrived after the deadline; keep the delivered result, its
+            # error and its span intact
+            result = type(result)()
+            result.key = key
+
         result.rc = resp.rc
-        if resp.rc:
-            mres._add_bad_rc(resp.rc, result)
-        else:
+        if not resp.rc:
             result.cas = resp.cas
+        elif not mres._expired:
+            mres._add_bad_rc(resp.rc, result)
+            if mres._span is not None and not mres._span.rc:
+                mres._span.rc = resp.rc
+
+        if self._breaker is not None:
+            self._breaker.record(self, resp.rc, resp.key, resp.nkey)
+
+        metrics = self._metrics
+        if metrics is not None and metrics.per_server and \
+                mres._op_name is not None:
+            metrics.record_server(self._vbmap_c(resp.key, resp.nkey)[1],
+                                  mres._t_start)
 
         if self._dur_testhook:
             self._dur_testhook(result)
 
-        if cbtype != C.LCB_CALLBACK_ENDURE and mres._dur:
+        if cbtype != C.LCB_CALLBACK_ENDURE and mres._dur and \
+                not mres._expired:
             if self._chain_endure(cbtype, mres, result, mres._dur):
                 return None, None
 
         return result, mres
 
+    def _filter_add(self, resp):
+        if not resp.rc and self._key_filter is not None:
+            self._key_filter._add_encoded(
+                bytes(ffi.buffer(resp.key, resp.nkey)))
+
     def _storage_callback(self, instance, cbtype, resp):
         _, mres = self._callback_common(instance, cbtype, resp)
+        self._filter_add(resp)
         self._chk_op_done(mres)
 
     def _get_callback(self, instance, cbtype, resp):
@@ -660,12 +1658,28 @@ class Bucket(object):
         resp = ffi.cast('lcb_RESPGET*', resp)
         result.flags = resp.itmflags
 
+        if resp.rc == C.LCB_KEY_ENOENT and mres._key_filter is not None:
+            mres._key_filter.false_positives += 1
+
         if not resp.rc:
             buf = bytes(ffi.buffer(resp.value, resp.nvalue))
-
-            if not self.data_passthrough and not mres._no_format:
+            if mres._span is not None and not mres._expired:
+                mres._span.bytes_in += resp.nvalue
+            if self._metrics is not None:
+                self._account_value(
+                    mres, resp.key, resp.nkey, resp.nvalue, False)
+
+            if not self.data_passthrough and not mres._no_format and \
+                    not mres._expired:
                 try:
-                    result.value = self._tc.decode_value(buf, resp.itmflags)
+                    if mres._phases is None:
+                        result.value = self._tc.decode_value(
+                            buf, resp.itmflags)
+                    else:
+                        t_start = clock()
+                        result.value = self._tc.decode_value(
+                            buf, resp.itmflags)
+                        mres._phases.add('decode', clock() - t_start)
                 except:
                     result.value = buf[::]
                     try:
@@ -686,6 +1700,7 @@ class Bucket(object):
         if not resp.rc:
             resp = ffi.cast('lcb_RESPCOUNTER*', resp)
             result.value = resp.value
+            self._filter_add(resp)
         self._chk_op_done(mres)
 
     def _observe_callback(self, instance, cbtype, resp):
@@ -744,8 +1759,12 @@ class Bucket(object):
         mres = ffi.from_handle(resp.cookie)
         resp = ffi.cast('lcb_RESPHTTP*', resp)
         htres = mres[None]
+        mres._decr_remaining()
         self._handles.remove(mres)
         htres._handle_response(mres, resp)
+        if mres._span is not None:
+            mres._span.bytes_in += resp.nbody
+        self._end_op(mres, resp.rc)
 
     def _warn_dupkey(self, k):
         """
@@ -0,0 +1,69 @@
+"""
+Batched delivery of completed asynchronous operations
+"""
+
+
+class CompletionBatcher(object):
+    """
+    Collects completed :class:`~couchbase_ffi.result.AsyncResult` objects so
+    they can be delivered together rather than one at a time from within
+    libcouchbase's callbacks.
+
+    Assign an instance to :attr:`Bucket.completion_batcher`. The first
+    result completed after each delivery causes `schedule` to be called with
+    :meth:`drain`; typically this is the event loop's "call soon" function
+    (e.g. ``loop.call_soon`` or ``lambda fn: reactor.callLater(0, fn)``), so
+    that all results completed in one loop iteration are delivered in a
+    single call. Without `schedule`, the application calls :meth:`drain`
+    itself.
+
+    By default :meth:`drain` invokes each result's callbacks. If
+    `batch_callback` is given, it is instead called once with the list of
+    results; their own callbacks are not invoked, and errors are left for
+    the batch callback to check (e.g. via ``all_ok``). A get coalesced with
+    another one (see :attr:`Bucket.coalesce_gets`) is queued as a result of
+    its own, right after the one it shared.
+    """
+
+    def __init__(self, schedule=None, batch_callback=None):
+        """
+        :param schedule: A callable which arranges for its argument to be
+            called later, or None
+        :param batch_callback: A callable receiving each list of completed
+            results, or None
+        """
+        self.schedule = schedule
+        self.batch_callback = batch_callback
+        self._pending = []
+        self._scheduled = False
+
+    def append(self, mres):
+        """
+        Queue a completed result. Called by the bucket
+        :param mres: The result
+        """
+        self._pending.append(mres)
+        if not self._scheduled and self.schedule is not None:
+            self._scheduled = True
+            self.schedule(self.drain)
+
+    def __len__(self):
+        return len(self._pending)
+
+    def drain(self):
+        """
+        Deliver all queued results
+        :return: The number of results delivered
+        """
+        self._scheduled = False
+        pending = self._pending
+        if not pending:
+            return 0
+        self._pending = []
+
+        if self.batch_callback is not None:
+            self.batch_callback(pending)
+        else:
+            for mres in pending:
+                mres.invoke()
+        return len(pending)
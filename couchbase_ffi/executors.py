@@ -1,3 +1,4 @@
+import time
 import types
 
 from couchbase._pyport import long, basestring
@@ -9,6 +10,7 @@ from couchbase_ffi.constants import FMT_UTF8
 from couchbase_ffi._cinit import get_handle
 from couchbase_ffi._rtconfig import pycbc_exc_lcb, pycbc_exc_enc, pycbc_exc_args
 from couchbase_ffi.bufmanager import BufManager
+from couchbase_ffi.metrics import clock
 
 ffi, C = get_handle()
 
@@ -209,6 +211,25 @@ class BaseExecutor(object):
     but chained durability operations.
     """
 
+    IDEMPOTENT = True
+    """
+    Whether applying the command twice has the same effect as applying it
+    once. Commands which are not may not be retried after a timeout, as
+    they may already have been applied.
+    """
+
+    CAS_VALUES = False
+    """
+    Whether the values of a dictionary passed to the executor are CAS
+    values (or results carrying them) rather than documents
+    """
+
+    OPNAME = None
+    """
+    The operation type under which latencies are recorded, if the bucket
+    has metrics enabled
+    """
+
     def __init__(self, conn):
         """
         Create a new executor
@@ -285,15 +306,41 @@ class BaseExecutor(object):
         """
         raise NotImplementedError()
 
+    def handle_locally(self, c_key, c_len, result, mres):
+        """
+        Hook for subclasses to complete an entry without scheduling it
+        :param c_key: The pointer to the key
+        :param c_len: The length of the key
+        :param result: The result object for the entry
+        :param mres: The MultiResult
+        :return: True if the entry was completed and should not be scheduled
+        """
+        return False
+
     def _invoke_submit(self, iterobj, is_dict, is_itmcoll, mres, global_kw):
         """
-        Internal function to invoke the actual submit_single function
+        Internal function to invoke the actual submit_single function.
+
+        Once the key is encoded, the optional features see it in this
+        order: traffic metrics, the hot key tracker, the rate limiter's
+        byte budget, the operation's tracing span, :meth:`handle_locally`
+        (e.g. the key filter of gets), and the circuit breaker's per-server
+        circuits (a rejected key is not scheduled). A key completed locally
+        is not seen by the circuits, so it does not use up a probe.
+
+        The same operation is submitted to more than once when the retry
+        policy resubmits failed keys, and when a rate limited operation is
+        scheduled chunk by chunk. All the steps above run for every
+        submission, so resubmitted keys are counted again; the per-server
+        circuits reuse the decisions taken for the operation, since it is
+        not admitted again.
         :param iterobj: The raw object returned as the next item of the iterator
         :param is_dict: True if iterator is a dictionary
         :param is_itmcoll: True if the iterator contains Item objects
         :param mres: The multi result object
         :param global_kw: The global settings
-        :return: The return value of :meth:`submit_single`
+        :return: True if the entry was scheduled, False if it was completed
+            locally
         """
         if is_itmcoll:
             item, key_options = next(iterobj)
@@ -318,11 +365,54 @@ class BaseExecutor(object):
 
         # Attempt to get the encoded key:
         key, value, key_options = self.make_entry_params(key, value, key_options)
-        c_key, c_len = create_key(self.parent._tc, key)
+        if mres._phases is None:
+            c_key, c_len = create_key(self.parent._tc, key)
+        else:
+            t_start = clock()
+            c_key, c_len = create_key(self.parent._tc, key)
+            mres._phases.add('encode', clock() - t_start)
+
+        if self.parent._metrics is not None and mres._op_name is not None:
+            self.parent._metrics.add_bytes(mres._op_name, sent=c_len)
+
+        hot_keys = self.parent._hot_keys
+        if hot_keys is not None:
+            vbucket = None
+            if hot_keys.by_vbucket:
+                try:
+                    vbucket = self.parent._vbmap_c(c_key, c_len)[0]
+                except CouchbaseError:
+                    # No configuration yet; the library will wait for one
+                    pass
+            hot_keys.record(
+                self.OPNAME, bytes(ffi.buffer(c_key, c_len)), vbucket)
+
+        limiter = self.parent._rate_limiter
+        if limiter is not None and limiter.bytes is not None:
+            limiter.charge_bytes(c_len)
+
+        span = mres._span
+        if span is not None:
+            span.keys += 1
+            span.bytes_out += c_len
+            try:
+                span.servers.add(self.parent._vbmap_c(c_key, c_len)[1])
+            except CouchbaseError:
+                # No configuration yet
+                pass
+
+        breaker = self.parent._breaker
+        if self.handle_locally(c_key, c_len, result, mres):
+            scheduled = False
+        elif breaker is not None and breaker.per_server and \
+                not breaker.admit_key(self.parent, c_key, c_len, result, mres):
+            scheduled = False
+        else:
+            rc = self.submit_single(c_key, c_len, value, item, key_options, global_kw, mres)
+            if rc:
+                raise pycbc_exc_lcb(rc)
+            scheduled = True
 
-        rc = self.submit_single(c_key, c_len, value, item, key_options, global_kw, mres)
-        if rc:
-            raise pycbc_exc_lcb(rc)
         try:
             if key in mres and not self.DUPKEY_OK:
                 # For tests:
@@ -331,6 +421,7 @@ class BaseExecutor(object):
             mres[key] = result
         except TypeError:
             raise pycbc_exc_enc(obj=key)
+        return scheduled
 
     def execute(self, kv, **kwargs):
         """
@@ -355,29 +446,52 @@ class BaseExecutor(object):
 
         is_itmcoll = isinstance(kv, ItemCollection)
 
+        deadline = kwargs.get('deadline')
+        if deadline is not None and deadline <= time.time():
+            # Not worth sending
+            raise pycbc_exc_lcb(C.LCB_ETIMEDOUT)
+
         mres = kwargs.get('_MRES')
         if mres is None:
             mres = self.parent._make_mres()
+            self.parent._begin_op(mres, self.OPNAME)
+
+        phases = mres._phases
+        if phases is not None:
+            t_start = clock()
+            encoded = phases.encode
 
         self.set_mres_flags(mres, kwargs)
 
-        C.lcb_sched_enter(self.instance)
+        # Inside a batch the caller owns the scheduling context. Only
+        # single-key operations are batched, so a failure here means
+        # nothing was scheduled for this operation.
+        batched = self.parent._sched_batch
+        if not batched:
+            C.lcb_sched_enter(self.instance)
         num_items = 0
         while True:
             # Clear the previous command object
             C.memset(self.c_command, 0, ffi.sizeof(self.c_command[0]))
 
             try:
-                self._invoke_submit(kviter, is_dict, is_itmcoll, mres, kwargs)
-                num_items += 1
+                if self._invoke_submit(kviter, is_dict, is_itmcoll, mres, kwargs):
+                    num_items += 1
             except StopIteration:
                 break
             except:
-                C.lcb_sched_fail(self.instance)
+                if not batched:
+                    C.lcb_sched_fail(self.instance)
                 raise
 
-        C.lcb_sched_leave(self.instance)
+        if not batched:
+            C.lcb_sched_leave(self.instance)
         mres._remaining += num_items
+        if deadline is not None and num_items:
+            self.parent._arm_deadline(mres, deadline)
+        if phases is not None:
+            phases.add('schedule',
+                       clock() - t_start - (phases.encode - encoded))
         # print "Execute(): mres:", mres
         return mres
 
@@ -396,6 +510,9 @@ class MultiContextExecutor(BaseExecutor):
         raise NotImplementedError()
 
     def execute(self, kv, **kwargs):
+        if kwargs.get('deadline') is not None:
+            raise pycbc_exc_args('deadline is not supported for this '
+                                 'operation')
         mctx = self.create_context(**kwargs)
         kwargs['_MCTX'] = mctx
         try:
@@ -451,7 +568,12 @@ class StorageExecutor(BaseExecutor):
 
 
         try:
-            v_enc, flags = self.parent._tc.encode_value(value, value_format)
+            if mres._phases is None:
+                v_enc, flags = self.parent._tc.encode_value(value, value_format)
+            else:
+                t_start = clock()
+                v_enc, flags = self.parent._tc.encode_value(value, value_format)
+                mres._phases.add('encode', clock() - t_start)
             if not isinstance(v_enc, bytes):
                 raise ValueFormatError.pyexc("Value was not bytes", obj=v_enc)
             s_val = ffi.new('char[]', v_enc)
@@ -462,6 +584,13 @@ class StorageExecutor(BaseExecutor):
 
         C._Cb_set_key(self.c_command, c_key, c_len)
         C._Cb_set_val(self.c_command, s_val, len(v_enc))
+        if mres._span is not None:
+            mres._span.bytes_out += len(v_enc)
+        limiter = self.parent._rate_limiter
+        if limiter is not None and limiter.bytes is not None:
+            limiter.charge_bytes(len(v_enc))
+        if self.parent._metrics is not None:
+            self.parent._account_value(mres, c_key, c_len, len(v_enc), True)
         if self.OPTYPE not in (C.LCB_APPEND, C.LCB_PREPEND):
             try:
                 self.c_command.flags = flags
@@ -476,26 +605,35 @@ class StorageExecutor(BaseExecutor):
 
 class AppendExecutor(StorageExecutor):
     OPTYPE = C.LCB_APPEND
+    OPNAME = 'append'
+    IDEMPOTENT = False
 
 
 class PrependExecutor(StorageExecutor):
     OPTYPE = C.LCB_PREPEND
+    OPNAME = 'prepend'
+    IDEMPOTENT = False
 
 
 class UpsertExecutor(StorageExecutor):
     OPTYPE = C.LCB_SET
+    OPNAME = 'upsert'
 
 
 class ReplaceExecutor(StorageExecutor):
     OPTYPE = C.LCB_REPLACE
+    OPNAME = 'replace'
 
 
 class InsertExecutor(StorageExecutor):
     OPTYPE = C.LCB_ADD
+    OPNAME = 'insert'
+    IDEMPOTENT = False
 
 
 class GetExecutor(BaseExecutor):
     STRUCTNAME = 'lcb_CMDGET'
+    OPNAME = 'get'
     IS_LOCK = False
     IS_RGET = False
 
@@ -508,8 +646,20 @@ class GetExecutor(BaseExecutor):
         set_quiet(mres, self.parent, kwargs)
         if kwargs.get('no_format'):
             mres._no_format = True
+        if not self.IS_LOCK and not self.IS_RGET and \
+                not self.parent._is_async:
+            mres._key_filter = self.parent._key_filter
         super(GetExecutor, self).set_mres_flags(mres, kwargs)
 
+    def handle_locally(self, c_key, c_len, result, mres):
+        kf = mres._key_filter
+        if kf is None or kf.check(bytes(ffi.buffer(c_key, c_len))):
+            return False
+
+        result.rc = C.LCB_KEY_ENOENT
+        mres._add_bad_rc(C.LCB_KEY_ENOENT, result)
+        return True
+
     def submit_single(self, c_key, c_len, value, item, key_options, global_options, mres):
         ttl = get_ttl(key_options, global_options, item)
         if self.IS_LOCK and not ttl:
@@ -531,6 +681,8 @@ class GetExecutor(BaseExecutor):
 
 class GetReplicaExecutor(GetExecutor):
     STRUCTNAME = 'lcb_CMDGETREPLICA'
+    OPNAME = 'get_replica'
+    IS_RGET = True
 
     def submit_single(self, c_key, c_len, value, item, key_options, global_options, mres):
         ix = get_option('replica', key_options, global_options, None)
@@ -547,12 +699,17 @@ class GetReplicaExecutor(GetExecutor):
 
 
 class LockExecutor(GetExecutor):
+    OPNAME = 'lock'
     IS_LOCK = True
+    IDEMPOTENT = False
 
 
 class RemoveExecutor(BaseExecutor):
     STRUCTNAME = 'lcb_CMDREMOVE'
+    OPNAME = 'remove'
     VALUES_ALLOWED = True
+    IDEMPOTENT = False
+    CAS_VALUES = True
 
     def set_mres_flags(self, mres, kwargs):
         set_quiet(mres, self.parent, kwargs)
@@ -573,6 +730,8 @@ class RemoveExecutor(BaseExecutor):
 
 class CounterExecutor(BaseExecutor):
     STRUCTNAME = 'lcb_CMDCOUNTER'
+    OPNAME = 'counter'
+    IDEMPOTENT = False
 
     def make_result(self, key, _):
         vr = ValueResult()
@@ -597,7 +756,9 @@ class CounterExecutor(BaseExecutor):
 
 class UnlockExecutor(BaseExecutor):
     STRUCTNAME = 'lcb_CMDUNLOCK'
+    OPNAME = 'unlock'
     VALUES_ALLOWED = True
+    CAS_VALUES = True
 
     def submit_single(self, c_key, c_len, value, item, key_options, global_options, mres):
         cas = get_cas(key_options, global_options, item)
@@ -614,6 +775,7 @@ class UnlockExecutor(BaseExecutor):
 
 class TouchExecutor(BaseExecutor):
     STRUCTNAME = 'lcb_CMDTOUCH'
+    OPNAME = 'touch'
     VALUES_ALLOWED = True
 
     def submit_single(self, c_key, c_len, value, item, key_options, global_options, mres):
@@ -632,6 +794,7 @@ class TouchExecutor(BaseExecutor):
 
 class DurabilityExecutor(MultiContextExecutor):
     STRUCTNAME = 'lcb_CMDENDURE'
+    OPNAME = 'endure'
     VALUES_ALLOWED = True
 
     @staticmethod
@@ -716,6 +879,7 @@ class DurabilityChainExecutor(DurabilityExecutor):
 
 class ObserveExecutor(MultiContextExecutor):
     STRUCTNAME = 'lcb_CMDOBSERVE'
+    OPNAME = 'observe'
 
     def make_result(self, key, value):
         vr = ValueResult()
@@ -737,6 +901,7 @@ class ObserveExecutor(MultiContextExecutor):
 
 class StatsExecutor(BaseExecutor):
     STRUCTNAME = 'lcb_CMDSTATS'
+    OPNAME = 'stats'
 
     def __run_stat(self, k, mres):
         bm = BufManager(ffi)
@@ -755,6 +920,7 @@ class StatsExecutor(BaseExecutor):
     def execute(self, kv, **kwargs):
         C.lcb_sched_enter(self.instance)
         mres = self.parent._make_mres()
+        self.parent._begin_op(mres, self.OPNAME)
 
         if not kv or not len(kv):
             kv = ['']
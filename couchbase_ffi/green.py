@@ -0,0 +1,168 @@
+"""
+Cooperative :mod:`gevent` support.
+
+:class:`GeventIOPS` drives libcouchbase's I/O from gevent's hub, and
+:class:`GeventBucket` has the same blocking-style API as :class:`Bucket`,
+except that waiting for a result only suspends the calling greenlet, so
+any number of greenlets can share a single connection::
+
+    bucket = GeventBucket('couchbase://localhost/default')
+    results = gevent.joinall([gevent.spawn(bucket.get, key)
+                              for key in keys])
+"""
+import gevent
+from gevent.event import AsyncResult as GeventResult
+
+from couchbase_ffi._rtconfig import pycbc_exc_args
+from couchbase_ffi.bucket import Bucket
+from couchbase_ffi.iops import IOEvent, TimerEvent
+from couchbase_ffi.constants import (
+    PYCBC_EVACTION_WATCH, PYCBC_CONN_F_ASYNC, PYCBC_CONN_F_ASYNC_DTOR,
+    LCB_READ_EVENT, LCB_WRITE_EVENT)
+
+# Event flags of the hub's watchers
+_GEVENT_READ = 1
+_GEVENT_WRITE = 2
+
+
+class GeventIOEvent(IOEvent):
+    def __init__(self):
+        super(GeventIOEvent, self).__init__()
+        self._watcher = None
+
+
+class GeventTimer(TimerEvent):
+    def __init__(self):
+        super(GeventTimer, self).__init__()
+        self._watcher = None
+
+
+class GeventIOPS(object):
+    """
+    I/O procs for :class:`~couchbase_ffi.iops.IOPSWrapper` backed by the
+    gevent hub's event loop, using its ``io`` and ``timer`` watchers
+    """
+
+    event_pool_size = 64
+
+    def __init__(self, hub=None):
+        self.loop = (hub or gevent.get_hub()).loop
+
+    def io_event_factory(self):
+        return GeventIOEvent()
+
+    def timer_event_factory(self):
+        return GeventTimer()
+
+    def update_event(self, event, action, flags):
+        if action != PYCBC_EVACTION_WATCH:
+            flags = 0
+
+        watcher = event._watcher
+        if watcher is not None:
+            if flags == event.flags and watcher.fd == event.fd:
+                return
+            watcher.stop()
+            event._watcher = None
+
+        if not flags:
+            return
+
+        gflags = 0
+        if flags & LCB_READ_EVENT:
+            gflags |= _GEVENT_READ
+        if flags & LCB_WRITE_EVENT:
+            gflags |= _GEVENT_WRITE
+
+        watcher = self.loop.io(event.fd, gflags)
+        watcher.start(self._io_ready, event, pass_events=True)
+        event._watcher = watcher
+
+    @staticmethod
+    def _io_ready(revents, event):
+        flags = 0
+        if revents & _GEVENT_READ:
+            flags |= LCB_READ_EVENT
+        if revents & _GEVENT_WRITE:
+            flags |= LCB_WRITE_EVENT
+        event.ready(flags)
+
+    def update_timer(self, timer, action, usecs):
+        if timer._watcher is not None:
+            timer._watcher.stop()
+            timer._watcher = None
+        if action == PYCBC_EVACTION_WATCH:
+            watcher = self.loop.timer(usecs / 1000000.0)
+            watcher.start(timer.ready)
+            timer._watcher = watcher
+
+    def start_watching(self):
+        pass
+
+    def stop_watching(self):
+        pass
+
+
+def _wait_result(meth):
+    def wrapped(self, *args, **kwargs):
+        res = meth(self, *args, **kwargs)
+        waiter = GeventResult()
+
+        def on_err(_, exc_type, exc_value, tb):
+            waiter.set_exception(exc_value)
+
+        res.set_callbacks(waiter.set, on_err)
+        return waiter.get()
+
+    wrapped.__name__ = meth.__name__
+    wrapped.__doc__ = meth.__doc__
+    return wrapped
+
+
+class GeventBucket(Bucket):
+    """
+    A bucket whose operations block only the calling greenlet.
+
+    Operations return and raise exactly as with the synchronous
+    :class:`Bucket`; meanwhile the hub keeps running other greenlets,
+    including those issuing operations on the same bucket. This covers the
+    key-value operations (including ``observe`` and ``endure``), ``stats``
+    and HTTP requests. View queries, whose rows are streamed through
+    callbacks, are not supported; nor is N1QL, which is not implemented by
+    :class:`Bucket` itself.
+    """
+
+    __slots__ = []
+
+    def __init__(self, *args, **kwargs):
+        """
+        Accepts the same arguments as :class:`Bucket`, and connects to the
+        cluster, suspending the calling greenlet until the bucket is ready
+        """
+        kwargs['_iops'] = GeventIOPS()
+        kwargs['_flags'] = kwargs.get('_flags', 0) | \
+            PYCBC_CONN_F_ASYNC | PYCBC_CONN_F_ASYNC_DTOR
+        super(GeventBucket, self).__init__(*args, **kwargs)
+
+        waiter = GeventResult()
+        self._conncb = waiter.set
+        self._connect()
+        err = waiter.get()
+        if err is not None:
+            raise err
+
+    for _name in Bucket._VALUE_METHS + Bucket._KEY_METHS:
+        locals()[_name] = _wait_result(getattr(Bucket, _name))
+        locals()[_name + '_multi'] = \
+            _wait_result(getattr(Bucket, _name + '_multi'))
+    del _name
+
+    # noinspection PyUnresolvedReferences
+    unlock_multi = _unlock_multi
+
+    _stats = _wait_result(Bucket._stats)
+    _http_request = _wait_result(Bucket._http_request)
+
+    def _view_request(self, *args, **kwargs):
+        raise pycbc_exc_args(
+            'Views are not supported by ' + type(self).__name__)
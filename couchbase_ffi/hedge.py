@@ -0,0 +1,178 @@
+"""
+Hedged reads: racing a slow primary ``get`` against a replica read
+"""
+from couchbase_ffi._cinit import get_handle
+from couchbase_ffi.metrics import Histogram, clock
+
+ffi, C = get_handle()
+
+
+class _HedgedGet(object):
+    """
+    State of a single hedged ``get``
+    """
+    def __init__(self, policy, parent, key, kwargs):
+        self.policy = policy
+        self.parent = parent
+        self.key = key
+        self.kwargs = kwargs
+        self.start = clock()
+        self.primary = None
+        self.replica = None
+        self.winner = None
+        self.timer = None
+
+    def fire(self):
+        """
+        Called when the hedge delay expires before the primary completed
+        """
+        self.timer = None
+        if self.winner is not None:
+            return
+
+        kwargs = dict(self.kwargs)
+        kwargs.pop('replica', None)
+        try:
+            replica = self.parent._executors['_rget'].execute(
+                (self.key,), **kwargs)
+        except Exception:
+            # E.g. no replicas are configured. Keep waiting for the primary
+            return
+
+        replica._hedge = self
+        self.replica = replica
+        self.parent._handles.add(replica)
+        self.policy.hedges += 1
+
+    def completed(self, mres):
+        """
+        Called when either the primary or the replica read is complete
+        :param mres: The completed MultiResult
+        """
+        if mres is self.primary:
+            self.policy._record_primary(clock() - self.start)
+        if self.winner is not None:
+            return
+
+        other = self.replica if mres is self.primary else self.primary
+        if mres is self.replica and not mres.all_ok and \
+                other._remaining:
+            # A replica which failed (e.g. because it is not yet in sync)
+            # cannot answer for the primary
+            return
+
+        self.winner = mres
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        if other is not None and other._remaining:
+            # Don't leave the loser for the next operation to wait for
+            self.parent._abandon(other)
+            self.parent._end_op(other)
+            C.lcb_breakout(self.parent._lcbh)
+
+
+class HedgePolicy(object):
+    """
+    Policy for hedging single-key ``get`` operations.
+
+    When assigned to :attr:`Bucket.hedge_policy`, a synchronous ``get``
+    which has not completed within the hedge delay issues an additional
+    replica read (``LCB_REPLICA_FIRST``), and returns whichever answer
+    arrives first. A successful replica answer may be stale, and has its
+    ``possibly_stale`` attribute set. Failed replica answers never win over
+    the primary.
+
+    The delay is either fixed, or adapts to the given percentile of the
+    primary's recent latencies.
+    """
+
+    def __init__(self, delay=None, percentile=95, initial_delay=0.05,
+                 min_delay=0.001, max_delay=1.0, min_samples=100,
+                 window=10000):
+        """
+        :param delay: A fixed hedge delay in seconds. If None, the delay is
+            adaptive
+        :param percentile: The percentile of primary latencies used as the
+            adaptive delay
+        :param initial_delay: The delay used until enough latencies have
+            been observed
+        :param min_delay: Lower bound for the adaptive delay
+        :param max_delay: Upper bound for the adaptive delay
+        :param min_samples: Number of latencies needed before adapting
+        :param window: Number of latencies after which older observations
+            are discarded
+        """
+        self.delay = delay
+        self.percentile = percentile
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.min_samples = min_samples
+        self.window = window
+
+        self._primary_latency = Histogram()
+        self._adaptive_delay = initial_delay
+
+        self.hedges = 0
+        """Number of replica reads issued"""
+
+        self.replica_wins = 0
+        """Number of gets answered by the replica"""
+
+        self.latency = Histogram()
+        """Histogram of the latency (in microseconds) of hedged gets"""
+
+    def current_delay(self):
+        """
+        :return: The hedge delay, in seconds
+        """
+        if self.delay is not None:
+            return self.delay
+        return self._adaptive_delay
+
+    def _record_primary(self, elapsed):
+        hist = self._primary_latency
+        hist.record(elapsed * 1000000)
+        if hist.count >= self.min_samples:
+            delay = hist.percentile(self.percentile) / 1000000.0
+            self._adaptive_delay = min(max(delay, self.min_delay),
+                                       self.max_delay)
+        if hist.count >= self.window:
+            self._primary_latency = Histogram()
+
+    def execute(self, parent, key, kwargs):
+        """
+        Perform a hedged get
+        :param parent: The bucket
+        :param key: The key to get
+        :param kwargs: The options for the get
+        :return: The completed MultiResult of the winning read
+        """
+        state = _HedgedGet(self, parent, key, kwargs)
+        primary = parent._executors['get'].execute((key,), **kwargs)
+        primary._hedge = state
+        state.primary = primary
+        parent._handles.add(primary)
+
+        state.timer = parent._start_timer(self.current_delay(), state.fire)
+        C.lcb_wait(parent._lcbh)
+
+        winner = state.winner or primary
+        self.latency.record((clock() - state.start) * 1000000)
+        if winner is not primary:
+            self.replica_wins += 1
+            for result in winner.values():
+                result.possibly_stale = True
+        return winner
+
+    def stats(self):
+        """
+        :return: A dictionary of the hedging counters, the current delay
+            and a snapshot of the hedged get latencies
+        """
+        return {
+            'hedges': self.hedges,
+            'replica_wins': self.replica_wins,
+            'delay': self.current_delay(),
+            'latency': self.latency.snapshot()
+        }
@@ -0,0 +1,173 @@
+"""
+Detection of frequently accessed keys
+"""
+import hashlib
+import struct
+import time
+
+
+class CountMinSketch(object):
+    """
+    A Count-Min sketch estimating how often each key was seen, using a fixed
+    ``width * depth`` table of counters. Estimates never undercount; they
+    may overcount by roughly ``total / width``.
+
+    Keys are byte strings (text is encoded as UTF-8). They are hashed with
+    MD5 rather than :func:`hash`, so that the counters of a key do not
+    depend on the process's hash seed.
+    """
+
+    def __init__(self, width=2048, depth=4):
+        self.width = width
+        self.depth = depth
+        self._rows = [[0] * width for _ in range(depth)]
+
+    def _positions(self, key):
+        if not isinstance(key, bytes):
+            key = key.encode('utf-8')
+        h1, h2 = struct.unpack('<QQ', hashlib.md5(key).digest())
+        h2 |= 1
+        width = self.width
+        return [(h1 + i * h2) % width for i in range(self.depth)]
+
+    def add(self, key, count=1):
+        """
+        Count occurrences of a key
+        :param key: The key
+        :param count: The number of occurrences
+        :return: The new estimate for the key
+        """
+        estimate = None
+        for row, pos in zip(self._rows, self._positions(key)):
+            row[pos] += count
+            if estimate is None or row[pos] < estimate:
+                estimate = row[pos]
+        return estimate
+
+    def estimate(self, key):
+        """
+        :param key: The key
+        :return: The estimated number of occurrences of the key
+        """
+        return min(row[pos]
+                   for row, pos in zip(self._rows, self._positions(key)))
+
+    def decay(self, factor):
+        """
+        Scale all counters down, so old occurrences weigh less
+        :param factor: The factor (0-1) to multiply the counters by
+        """
+        self._rows = [[int(c * factor) for c in row] for row in self._rows]
+
+
+class HotKeyTracker(object):
+    """
+    Tracks the most frequently accessed keys of each operation type, and
+    the most frequently accessed vBuckets.
+
+    When assigned to :attr:`Bucket.hot_key_tracker`, every key scheduled
+    is counted in a :class:`CountMinSketch`. The ``top`` keys with the
+    highest estimates are kept for each operation type, so memory use does
+    not depend on the number of distinct keys. Every ``decay_interval``
+    seconds all counts are multiplied by ``decay``, so keys which stop
+    being hot eventually drop out.
+
+    With ``by_vbucket``, each key is also mapped to its vBucket, which
+    costs a lookup per key. Keys scheduled before the bucket has a
+    configuration are not counted per vBucket.
+    """
+
+    def __init__(self, top=20, width=2048, depth=4, decay_interval=60.0,
+                 decay=0.5, by_vbucket=True):
+        """
+        :param top: The number of hot keys kept per operation type
+        :param width: The width of the sketch
+        :param depth: The number of hash functions of the sketch
+        :param decay_interval: The interval, in seconds, at which counts
+            are decayed
+        :param decay: The factor applied to the counts at each interval
+        :param by_vbucket: Whether to also count accesses per vBucket
+        """
+        self.top = top
+        self.decay_interval = decay_interval
+        self.decay = decay
+        self.by_vbucket = by_vbucket
+
+        self._sketch = CountMinSketch(width, depth)
+        self._hitters = {}
+        self._floors = {}
+        self._key_vbuckets = {}
+        self._vbuckets = {}
+        self._last_decay = time.time()
+
+    def record(self, op, key, vbucket=None):
+        """
+        Count an access to a key
+        :param op: The operation type
+        :param key: The encoded key
+        :param vbucket: The vBucket of the key, if known
+        """
+        now = time.time()
+        if now - self._last_decay >= self.decay_interval:
+            self._decay(now)
+
+        estimate = self._sketch.add(op.encode('utf-8') + b':' + key)
+        if vbucket is not None:
+            self._vbuckets[vbucket] = self._vbuckets.get(vbucket, 0) + 1
+
+        try:
+            hitters = self._hitters[op]
+        except KeyError:
+            hitters = self._hitters[op] = {}
+            self._floors[op] = 0
+
+        if key not in hitters and len(hitters) >= self.top:
+            if estimate <= self._floors[op]:
+                return
+            coldest = min(hitters, key=hitters.get)
+            del hitters[coldest]
+            self._key_vbuckets.pop((op, coldest), None)
+
+        hitters[key] = estimate
+        if vbucket is not None:
+            self._key_vbuckets[(op, key)] = vbucket
+        if len(hitters) >= self.top:
+            self._floors[op] = min(hitters.values())
+
+    def _decay(self, now):
+        factor = self.decay
+        self._last_decay = now
+        self._sketch.decay(factor)
+        for op, hitters in self._hitters.items():
+            for key in hitters:
+                hitters[key] = int(hitters[key] * factor)
+            self._floors[op] = int(self._floors[op] * factor)
+        self._vbuckets = dict(
+            (vb, int(n * factor)) for vb, n in self._vbuckets.items()
+            if int(n * factor))
+
+    def snapshot(self, n=None):
+        """
+        :param n: The maximum number of keys (per operation type) and
+            vBuckets to return. Defaults to all those tracked
+        :return: A dictionary with a ``keys`` entry mapping each operation
+            type to a list of ``(key, estimated count, vbucket)`` tuples,
+            and a ``vbuckets`` entry with a list of ``(vbucket, count)``
+            tuples, hottest first
+        """
+        keys = {}
+        for op, hitters in self._hitters.items():
+            ranked = sorted(hitters.items(), key=lambda kv: kv[1],
+                            reverse=True)[:n]
+            keys[op] = [(k, count, self._key_vbuckets.get((op, k)))
+                        for k, count in ranked]
+        vbuckets = sorted(self._vbuckets.items(), key=lambda kv: kv[1],
+                          reverse=True)[:n]
+        return {'keys': keys, 'vbuckets': vbuckets}
+
+    def reset(self):
+        """
+        Discard all counts
+        """
+        self.__init__(self.top, self._sketch.width, self._sketch.depth,
+                      self.decay_interval, self.decay, self.by_vbucket)
@@ -1,4 +1,5 @@
 from couchbase_ffi._cinit import get_handle
+from couchbase_ffi.timerwheel import TimerWheel
 from couchbase_ffi.constants import (
     PYCBC_EVACTION_WATCH, PYCBC_EVACTION_UNWATCH,
     PYCBC_EVACTION_CLEANUP, PYCBC_EVSTATE_ACTIVE,
@@ -40,6 +41,12 @@ class IOEvent(Event):
 
 
 class TimerEvent(Event):
+    def __init__(self):
+        super(TimerEvent, self).__init__()
+        # Used when the timer is scheduled on a TimerWheel
+        self._wheel_slot = None
+        self._wheel_expires = None
+
     def ready(self, *_):
         C._Cb_do_callback(0, 0, self._c_callback, self._c_arg)
 
@@ -150,6 +157,22 @@ def getprocs(version,
 
 
 class IOPSWrapper(object):
+    """
+    Exposes a Python I/O procs object to libcouchbase. Besides the
+    ``update_event`` and ``update_timer`` methods, the procs object may
+    define these attributes:
+
+    ``event_pool_size``
+        Keep up to this many freed events of each kind for reuse, rather
+        than creating new ones. Events must be reusable once cleaned up.
+
+    ``timer_wheel_resolution``
+        Multiplex all of libcouchbase's timers onto a single timer of the
+        procs object using a :class:`~couchbase_ffi.timerwheel.TimerWheel`
+        with this tick length, in seconds.
+
+    See :meth:`stats` for the resulting counters.
+    """
     def __init__(self, procs_obj):
         self._pyprocs = procs_obj
 
@@ -172,6 +195,23 @@ class IOPSWrapper(object):
         self._c_iops.v.v2.get_procs = getprocs
         self._c_iops.destructor = destructor
         self._handles = {}
+
+        # Freed events kept for reuse, per factory. Opt-in, as the procs
+        # object's events must then be reusable once cleaned up
+        self._pool_size = getattr(procs_obj, 'event_pool_size', 0)
+        self._pools = {}
+        self.pool_hits = 0
+        self.pool_misses = 0
+
+        # All timers multiplexed onto a single timer of the procs object
+        self._wheel = None
+        resolution = getattr(procs_obj, 'timer_wheel_resolution', None)
+        if resolution:
+            self._wheel_timer = self._do_create_timer()
+            # Fired by the procs object in place of a libcouchbase callback
+            self._wheel_timer.ready = self._expire_wheel
+            self._wheel = TimerWheel(self._arm_wheel, resolution)
+
         ALL_REFS.add(self)
 
     def get_lcb_iops(self):
@@ -189,6 +229,12 @@ class IOPSWrapper(object):
     def _default_stop(self):
         pass
 
+    def _arm_wheel(self, usecs):
+        self._do_update_timer(self._wheel_timer, PYCBC_EVACTION_WATCH, usecs)
+
+    def _expire_wheel(self, *_):
+        self._wheel.expire()
+
     def mod_event_common(self, event, action, newsock, extra):
         if isinstance(event, IOEvent):
             # Extra is flags
@@ -196,6 +242,8 @@ class IOPSWrapper(object):
                 event.fd = newsock
             self._do_update_event(event, action, extra)
             event.flags = extra
+        elif self._wheel is not None:
+            self._wheel.update(event, action, extra)
         else:
             self._do_update_timer(event, action, extra)
 
@@ -205,14 +253,49 @@ class IOPSWrapper(object):
             event.state = PYCBC_EVSTATE_SUSPENDED
 
     def new_event_common(self, fn):
-        event = fn()
+        pool = self._pools.get(fn)
+        if pool:
+            self.pool_hits += 1
+            event = pool.pop()
+        else:
+            if self._pool_size:
+                self.pool_misses += 1
+            event = fn()
         self._handles[id(event)] = event
         return event._cdata
 
     def free_event_common(self, ev):
         self.mod_event_common(ev, PYCBC_EVACTION_CLEANUP, None, 0)
-        del ev._cdata
         del self._handles[id(ev)]
 
+        fn = self._do_create_event if isinstance(ev, IOEvent) \
+            else self._do_create_timer
+        pool = self._pools.setdefault(fn, [])
+        if len(pool) < self._pool_size:
+            ev.state = 0
+            ev._c_callback = None
+            ev._c_arg = None
+            if isinstance(ev, IOEvent):
+                ev.fd = -1
+                ev.flags = 0
+            pool.append(ev)
+        else:
+            del ev._cdata
+
+    def stats(self):
+        """
+        :return: A dictionary with the event pool counters and, if timers
+            are multiplexed, those of the timer wheel
+        """
+        rv = {
+            'events': len(self._handles),
+            'pooled': sum(len(pool) for pool in self._pools.values()),
+            'pool_hits': self.pool_hits,
+            'pool_misses': self.pool_misses
+        }
+        if self._wheel is not None:
+            rv['timers'] = self._wheel.stats()
+        return rv
+
     def __hash__(self):
         return hash(id(self))
\ No newline at end of file
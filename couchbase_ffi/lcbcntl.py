@@ -1,3 +1,5 @@
+from threading import local
+
 from couchbase_ffi._cinit import get_handle
 from couchbase_ffi._rtconfig import pycbc_exc_lcb, pycbc_exc_args
 from couchbase_ffi._strutil import from_cstring
@@ -6,6 +8,22 @@ ffi, C = get_handle()
 
 
 class CntlHandler(object):
+    def __init__(self):
+        # The handlers are shared by all buckets, so each thread reuses its
+        # own buffers rather than allocating one per call
+        self._buffers = local()
+
+    def buffer(self, mode):
+        """
+        Get this thread's buffer for `mode`, allocating it on first use
+        """
+        cache = self._buffers.__dict__
+        try:
+            return cache[mode]
+        except KeyError:
+            c_data = cache[mode] = self.allocate(mode)
+            return c_data
+
     def allocate(self, mode):
         """
         Allocate the pointer. Mode is provided in case input and output allocations differ
@@ -23,7 +41,7 @@ class CntlHandler(object):
             mode = C.LCB_CNTL_SET
         else:
             mode = C.LCB_CNTL_GET
-        c_data = self.allocate(mode)
+        c_data = self.buffer(mode)
 
         if mode == C.LCB_CNTL_SET:
             try:
@@ -0,0 +1,242 @@
+"""
+Forwarding of libcouchbase's log messages to the :mod:`logging` module
+"""
+import logging
+import random
+import time
+from collections import deque
+from threading import Event, Lock, Thread
+
+from couchbase_ffi._cinit import get_handle
+
+ffi, C = get_handle()
+
+HANDLER_DECL = \
+    'void(unsigned int,const char*,int,const char*,int,const char*)'
+
+LOG_TRACE = 5
+"""The :mod:`logging` level used for libcouchbase's TRACE messages"""
+
+logging.addLevelName(LOG_TRACE, 'TRACE')
+
+_SEVERITY_LEVELS = (
+    (C.LCB_LOG_TRACE, LOG_TRACE),
+    (C.LCB_LOG_DEBUG, logging.DEBUG),
+    (C.LCB_LOG_INFO, logging.INFO),
+    (C.LCB_LOG_WARN, logging.WARNING),
+    (C.LCB_LOG_ERROR, logging.ERROR),
+    (C.LCB_LOG_FATAL, logging.CRITICAL)
+)
+
+
+def severity_to_level(severity):
+    """
+    :param severity: A libcouchbase log severity
+    :return: The corresponding :mod:`logging` level
+    """
+    for sev, level in _SEVERITY_LEVELS:
+        if severity <= sev:
+            return level
+    return logging.CRITICAL
+
+
+def level_to_severity(level):
+    """
+    :param level: A :mod:`logging` level
+    :return: The lowest libcouchbase severity which maps to at least
+        `level`
+    """
+    for sev, lvl in _SEVERITY_LEVELS:
+        if lvl >= level:
+            return sev
+    return C.LCB_LOG_FATAL
+
+
+class LcbLogger(object):
+    """
+    A libcouchbase logger which forwards messages to a :class:`logging.Logger`.
+
+    Assign it to :attr:`Bucket.lcb_logger` (or pass it to
+    :func:`set_default_logger` to use it for all new buckets). A single
+    logger may be shared by several buckets; the instance ID of the bucket
+    is available in each record as ``lcb_iid``.
+
+    Messages below ``level`` are discarded in C without being formatted.
+    The remaining messages are subject to per-subsystem sampling and rate
+    limiting, and are then queued; they are passed to the Python logger
+    from a background thread so that slow handlers do not stall the event
+    loop. When more than ``max_buffered`` messages are waiting, new messages
+    are dropped.
+    """
+
+    def __init__(self, logger='couchbase.lcb', level=None, rate=100,
+                 sample=None, max_buffered=10000, flush_interval=0.1):
+        """
+        :param logger: The :class:`logging.Logger`, or its name
+        :param level: The minimum :mod:`logging` level to forward. Defaults
+            to the effective level of `logger`
+        :param rate: The maximum average number of messages per second
+            forwarded for any one subsystem (e.g. ``server`` or
+            ``confmon``). Bursts of up to this many messages are allowed.
+            None disables rate limiting
+        :param sample: A dictionary mapping subsystem names to the fraction
+            (0-1) of their messages which should be forwarded
+        :param max_buffered: The maximum number of queued messages
+        :param flush_interval: How often, in seconds, queued messages are
+            passed to the logger
+        """
+        if not isinstance(logger, logging.Logger):
+            logger = logging.getLogger(logger)
+        self.logger = logger
+        self.rate = rate
+        self.sample = dict(sample or {})
+        self.max_buffered = max_buffered
+        self.flush_interval = flush_interval
+
+        self.rate_limited = 0
+        """Messages dropped by the rate limit"""
+
+        self.sampled_out = 0
+        """Messages dropped by sampling"""
+
+        self.overflowed = 0
+        """Messages dropped because too many were queued"""
+
+        self._buckets = {}
+        self._queue = deque()
+        self._flush_lock = Lock()
+        self._wakeup = Event()
+        self._thread = None
+        self._closed = False
+
+        self._c_handler = ffi.callback(HANDLER_DECL, self._on_message)
+        if level is None:
+            level = logger.getEffectiveLevel()
+        self._c_logger = ffi.gc(
+            C._Cb_logger_new(level_to_severity(level), self._c_handler),
+            C._Cb_logger_free)
+
+    @property
+    def _procs(self):
+        return C._Cb_logger_procs(self._c_logger)
+
+    def set_level(self, level):
+        """
+        Change the minimum :mod:`logging` level to forward
+        :param level: The level
+        """
+        C._Cb_logger_set_level(self._c_logger, level_to_severity(level))
+
+    def _allow(self, subsys):
+        fraction = self.sample.get(subsys)
+        if fraction is not None and random.random() >= fraction:
+            self.sampled_out += 1
+            return False
+
+        if self.rate is None:
+            return True
+
+        now = time.time()
+        try:
+            state = self._buckets[subsys]
+        except KeyError:
+            state = self._buckets[subsys] = [float(self.rate), now]
+
+        tokens = min(float(self.rate),
+                     state[0] + (now - state[1]) * self.rate)
+        state[1] = now
+        if tokens < 1:
+            state[0] = tokens
+            self.rate_limited += 1
+            return False
+        state[0] = tokens - 1
+        return True
+
+    def _on_message(self, iid, subsys, severity, srcfile, srcline, msg):
+        # Called from within libcouchbase. Do as little as possible here
+        subsys = ffi.string(subsys).decode('utf-8', 'replace')
+        if not self._allow(subsys):
+            return
+        if len(self._queue) >= self.max_buffered:
+            self.overflowed += 1
+            return
+
+        self._queue.append((time.time(), iid, subsys, severity,
+                            ffi.string(srcfile), srcline, ffi.string(msg)))
+        if self._thread is None and not self._closed:
+            self._thread = Thread(target=self._run, name='couchbase-lcblog')
+            self._thread.daemon = True
+            self._thread.start()
+
+    def _run(self):
+        while not self._closed:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            self.flush()
+
+    def flush(self):
+        """
+        Pass all queued messages to the logger
+        """
+        logger = self.logger
+        queue = self._queue
+        with self._flush_lock:
+            while queue:
+                created, iid, subsys, severity, srcfile, srcline, msg = \
+                    queue.popleft()
+                level = severity_to_level(severity)
+                if not logger.isEnabledFor(level):
+                    continue
+
+                record = logger.makeRecord(
+                    logger.name, level, srcfile.decode('utf-8', 'replace'),
+                    srcline, '[%d] <%s> %s',
+                    (iid, subsys, msg.decode('utf-8', 'replace')), None,
+                    extra={'lcb_iid': iid, 'lcb_subsys': subsys})
+                record.created = created
+                record.msecs = (created - int(created)) * 1000
+                logger.handle(record)
+
+    def close(self):
+        """
+        Flush any queued messages and stop the background thread. The
+        logger should no longer be installed in any bucket.
+        """
+        self._closed = True
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.flush()
+
+    def stats(self):
+        """
+        :return: A dictionary of the drop counters and the number of
+            queued messages
+        """
+        return {
+            'queued': len(self._queue),
+            'rate_limited': self.rate_limited,
+            'sampled_out': self.sampled_out,
+            'overflowed': self.overflowed
+        }
+
+
+_default_logger = None
+
+
+def set_default_logger(logger):
+    """
+    Set the logger installed in every bucket created from now on. This
+    allows capturing messages logged while connecting.
+    :param logger: An :class:`LcbLogger`, or None
+    """
+    global _default_logger
+    _default_logger = logger
+
+
+def get_default_logger():
+    """
+    :return: The logger set by :func:`set_default_logger`
+    """
+    return _default_logger
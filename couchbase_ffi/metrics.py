@@ -0,0 +1,371 @@
+"""
+Lightweight instrumentation helpers used by the optional metrics and
+batching features. Everything here is pure Python and cheap enough to be
+updated from inside the operation callbacks.
+"""
+import time
+
+try:
+    clock = time.perf_counter
+except AttributeError:
+    clock = time.time
+
+
+class Histogram(object):
+    """
+    Log-linear histogram in the style of HdrHistogram.
+
+    Values are integers (typically microseconds). Each power of two is split
+    into ``2**SUB_BITS`` linear sub-buckets, so any recorded value can be
+    reported back with a relative error of about 3%, while the cost of
+    recording and the memory used stay constant regardless of the number of
+    samples.
+    """
+
+    SUB_BITS = 5
+    _SUB = 1 << SUB_BITS
+
+    def __init__(self):
+        self._counts = {}
+        self.count = 0
+        self.total = 0
+        self.min = 0
+        self.max = 0
+
+    @classmethod
+    def _index(cls, value):
+        if value < cls._SUB << 1:
+            return value
+        shift = value.bit_length() - (cls.SUB_BITS + 1)
+        return shift * cls._SUB + (value >> shift)
+
+    @classmethod
+    def _lower(cls, index):
+        if index < cls._SUB << 1:
+            return index
+        shift = index // cls._SUB - 1
+        return (index - shift * cls._SUB) << shift
+
+    def record(self, value):
+        """
+        Record a single value
+        :param value: The value. Negative values are recorded as 0
+        """
+        value = int(value)
+        if value < 0:
+            value = 0
+
+        ix = self._index(value)
+        counts = self._counts
+        counts[ix] = counts.get(ix, 0) + 1
+
+        if not self.count or value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+        self.count += 1
+        self.total += value
+
+    def merge(self, other):
+        """
+        Add all the samples from another histogram into this one
+        :param other: The other :class:`Histogram`
+        """
+        if not other.count:
+            return
+        for ix, n in dict(other._counts).items():
+            self._counts[ix] = self._counts.get(ix, 0) + n
+        if not self.count or other.min < self.min:
+            self.min = other.min
+        if other.max > self.max:
+            self.max = other.max
+        self.count += other.count
+        self.total += other.total
+
+    def reset(self):
+        """
+        Discard all recorded samples
+        """
+        self.__init__()
+
+    @property
+    def mean(self):
+        if not self.count:
+            return 0
+        return float(self.total) / self.count
+
+    def percentile(self, pct):
+        """
+        Get the value at the given percentile
+        :param pct: The percentile, between 0 and 100
+        :return: The (upper bound of the) value at the percentile, or 0 if
+            nothing was recorded
+        """
+        if not self.count:
+            return 0
+
+        counts = dict(self._counts)
+        target = max(1, pct / 100.0 * self.count)
+        seen = 0
+        for ix in sorted(counts):
+            seen += counts[ix]
+            if seen >= target:
+                return min(self._lower(ix + 1) - 1, self.max)
+        return self.max
+
+    def snapshot(self):
+        """
+        Get a summary of the recorded values
+        :return: A dictionary of the count, min, max, mean and common
+            percentiles
+        """
+        return {
+            'count': self.count,
+            'min': self.min,
+            'max': self.max,
+            'mean': self.mean,
+            'p50': self.percentile(50),
+            'p90': self.percentile(90),
+            'p99': self.percentile(99),
+            'p999': self.percentile(99.9)
+        }
+
+
+class PhaseTimes(object):
+    """
+    Time, in seconds, spent in each phase of one or more operations:
+
+    * ``encode``: encoding keys and values
+    * ``schedule``: building and scheduling the commands
+    * ``wait``: waiting for responses in the event loop, excluding the
+      time spent in callbacks
+    * ``callback``: handling responses, excluding value decoding
+    * ``decode``: decoding values
+    """
+
+    PHASES = ('encode', 'schedule', 'wait', 'callback', 'decode')
+
+    def __init__(self, totals=None):
+        """
+        :param totals: Another :class:`PhaseTimes` to which all the time
+            added to this one is also added
+        """
+        self._totals = totals
+        self.operations = 0
+        self.encode = 0.0
+        self.schedule = 0.0
+        self.wait = 0.0
+        self.callback = 0.0
+        self.decode = 0.0
+
+    def add(self, phase, elapsed):
+        """
+        Account for time spent in a phase
+        :param phase: One of :attr:`PHASES`
+        :param elapsed: The time spent, in seconds
+        """
+        setattr(self, phase, getattr(self, phase) + elapsed)
+        if self._totals is not None:
+            self._totals.add(phase, elapsed)
+
+    def as_dict(self):
+        """
+        :return: A dictionary of the number of operations and the time
+            spent in each phase
+        """
+        rv = dict((phase, getattr(self, phase)) for phase in self.PHASES)
+        rv['operations'] = self.operations
+        return rv
+
+
+class LargestValues(object):
+    """
+    Tracks the keys with the largest values seen, using memory bounded by
+    ``capacity`` regardless of the number of distinct keys.
+    """
+
+    def __init__(self, capacity=20):
+        """
+        :param capacity: The number of keys to keep
+        """
+        self.capacity = capacity
+        self._sizes = {}
+        self._floor = 0
+
+    def accepts(self, size):
+        """
+        Check whether a value of the given size might be tracked. Allows
+        callers to avoid building the key for small values.
+        """
+        return size > self._floor or len(self._sizes) < self.capacity
+
+    def add(self, key, size):
+        """
+        Record the size of a key's value
+        :param key: The key
+        :param size: The size of the value in bytes
+        """
+        sizes = self._sizes
+        if key in sizes:
+            if size > sizes[key]:
+                sizes[key] = size
+                if len(sizes) >= self.capacity:
+                    self._floor = min(sizes.values())
+            return
+
+        if len(sizes) >= self.capacity:
+            if size <= self._floor:
+                return
+            del sizes[min(sizes, key=sizes.get)]
+
+        sizes[key] = size
+        if len(sizes) >= self.capacity:
+            self._floor = min(sizes.values())
+
+    def top(self, n=None):
+        """
+        :param n: The number of keys to return. Defaults to all tracked keys
+        :return: A list of ``(key, size)`` tuples, largest first
+        """
+        rv = sorted(self._sizes.items(), key=lambda kv: kv[1], reverse=True)
+        if n is not None:
+            rv = rv[:n]
+        return rv
+
+
+class OperationMetrics(object):
+    """
+    A set of latency histograms, one per operation type. Latencies are
+    recorded in microseconds, from the time an operation was scheduled until
+    its last callback was received.
+
+    Also counts the bytes sent and received and records the sizes of the
+    values stored and retrieved by each operation type, and tracks the
+    keys with the largest values.
+    """
+
+    def __init__(self, large_values=20):
+        """
+        :param large_values: The number of keys with the largest values to
+            track
+        """
+        self._histograms = {}
+        self._bytes_sent = {}
+        self._bytes_received = {}
+        self._value_sizes = {}
+        self._servers = {}
+        self.large_values = LargestValues(large_values)
+
+        self.per_server = False
+        """Whether key latencies are also recorded per server"""
+
+    def start(self, mres, name):
+        """
+        Mark the beginning of an operation
+        :param mres: The operation's MultiResult
+        :param name: The operation type
+        """
+        mres._op_name = name
+        mres._t_start = clock()
+
+    def finish(self, mres):
+        """
+        Record the latency of a completed operation
+        :param mres: The operation's MultiResult
+        """
+        name = mres._op_name
+        if name is None:
+            return
+        mres._op_name = None
+        try:
+            hist = self._histograms[name]
+        except KeyError:
+            hist = self._histograms[name] = Histogram()
+        hist.record((clock() - mres._t_start) * 1000000)
+
+    def add_bytes(self, name, sent=0, received=0):
+        """
+        Count bytes sent or received by an operation
+        :param name: The operation type
+        :param sent: The number of bytes sent
+        :param received: The number of bytes received
+        """
+        if sent:
+            self._bytes_sent[name] = self._bytes_sent.get(name, 0) + sent
+        if received:
+            self._bytes_received[name] = \
+                self._bytes_received.get(name, 0) + received
+
+    def record_value_size(self, name, size):
+        """
+        Record the size of a value stored or retrieved
+        :param name: The operation type
+        :param size: The size of the value in bytes
+        """
+        try:
+            hist = self._value_sizes[name]
+        except KeyError:
+            hist = self._value_sizes[name] = Histogram()
+        hist.record(size)
+
+    def traffic(self):
+        """
+        :return: A dictionary mapping each operation type to its byte
+            counters and a snapshot of its value size histogram (if values
+            were transferred)
+        """
+        names = set(self._bytes_sent) | set(self._bytes_received)
+        rv = {}
+        for name in names:
+            info = rv[name] = {
+                'bytes_sent': self._bytes_sent.get(name, 0),
+                'bytes_received': self._bytes_received.get(name, 0)
+            }
+            hist = self._value_sizes.get(name)
+            if hist is not None:
+                info['value_sizes'] = hist.snapshot()
+        return rv
+
+    def record_server(self, server, start):
+        """
+        Record the latency of a single key
+        :param server: The index of the server owning the key
+        :param start: The time at which the key's operation began
+        """
+        try:
+            hist = self._servers[server]
+        except KeyError:
+            hist = self._servers[server] = Histogram()
+        hist.record((clock() - start) * 1000000)
+
+    def servers(self):
+        """
+        :return: A dictionary mapping each server index to a snapshot of
+            the latencies of its keys
+        """
+        return dict((ix, hist.snapshot())
+                    for ix, hist in list(self._servers.items()))
+
+    def histogram(self, name):
+        """
+        :param name: The operation type
+        :return: The :class:`Histogram` for the operation type, or None if
+            no operation of this type has completed
+        """
+        return self._histograms.get(name)
+
+    def snapshot(self):
+        """
+        :return: A dictionary mapping each operation type to a snapshot of
+            its histogram
+        """
+        return dict((name, hist.snapshot())
+                    for name, hist in list(self._histograms.items()))
+
+    def reset(self):
+        """
+        Discard all recorded latencies, byte counts and value sizes
+        """
+        per_server = self.per_server
+        self.__init__(self.large_values.capacity)
+        self.per_server = per_server
@@ -0,0 +1,455 @@
+"""
+Running libcouchbase's own event loop on a background thread
+"""
+import errno
+import os
+import sys
+from collections import deque
+from operator import itemgetter
+from threading import Condition, Event, Thread
+
+from couchbase_ffi._cinit import get_handle
+from couchbase_ffi._rtconfig import PyCBC, pycbc_exc_args, pycbc_exc_lcb
+from couchbase_ffi.bucket import Bucket
+from couchbase_ffi.executors import MultiContextExecutor
+from couchbase_ffi.result import AsyncResult
+from couchbase_ffi.constants import LCB_READ_EVENT, PYCBC_CONN_F_ASYNC
+
+ffi, C = get_handle()
+
+
+class IOThread(object):
+    """
+    Owns a bucket's ``lcb_t`` on a dedicated thread. Once started, the
+    handle may only be used from callables passed to :meth:`call`, which
+    are run on the I/O thread in the order they were submitted.
+
+    The thread sleeps while there is nothing to do. While operations are in
+    flight or library timers are pending, it runs ``lcb_wait`` (with the
+    GIL released), so socket and timer events are handled entirely in C; a
+    submission wakes it through a pipe watched by the library's own I/O
+    plugin.
+    """
+
+    def __init__(self, bucket, name='couchbase-io'):
+        self.bucket = bucket
+        self._queue = deque()
+        self._cond = Condition()
+        self._stopping = False
+        self._waker = None
+        self._thread = Thread(target=self._run, name=name)
+        self._thread.daemon = True
+
+    def start(self):
+        self._thread.start()
+
+    def call(self, fn, *args):
+        """
+        Run `fn(*args)` on the I/O thread
+        """
+        self.submit(fn, args)
+
+    def call_batched(self, fn, *args):
+        """
+        Like :meth:`call`, but `fn` may be run within a scheduling context
+        (``lcb_sched_enter``) shared with other callables submitted in the
+        same wakeup, so that their commands are flushed together. `fn` must
+        schedule at most a single-key operation
+        """
+        self.submit(fn, args, batched=True)
+
+    def submit(self, fn, args, batched=False, priority=0):
+        """
+        Queue `fn(*args)` to be run on the I/O thread
+        :param batched: See :meth:`call_batched`
+        :param priority: Callables submitted in the same wakeup are run in
+            order of decreasing priority, and in submission order within
+            the same priority. Every wakeup runs all the callables queued
+            so far, so a callable is never held back behind those of a
+            later wakeup, whatever their priority
+        """
+        with self._cond:
+            if self._stopping:
+                raise pycbc_exc_args('I/O thread is stopped')
+            self._queue.append((fn, args, batched, priority))
+            if len(self._queue) == 1:
+                self._wake()
+
+    def stop(self):
+        """
+        Wait for all outstanding operations, then stop the thread
+        """
+        with self._cond:
+            self._stopping = True
+            self._wake()
+        self._thread.join()
+
+    def _wake(self):
+        # Called with the condition held
+        self._cond.notify()
+        if self._waker is not None:
+            self._waker.signal()
+
+    def _busy(self):
+        # Whether lcb_wait has anything to wait for: operations in flight,
+        # or timers (e.g. deferred deliveries) which are not standalone
+        bucket = self.bucket
+        if bucket._handles:
+            return True
+        for timer in bucket._timers:
+            if not timer.standalone:
+                return True
+        return False
+
+    def _next_batch(self):
+        with self._cond:
+            while not self._queue and not self._busy() and \
+                    not self._stopping:
+                self._cond.wait()
+            # Every submission after this point signals the pipe again
+            self._waker.clear()
+            batch = list(self._queue)
+            self._queue.clear()
+        if len(batch) > 1:
+            # Stable, so submission order is kept within a priority
+            batch.sort(key=_priority_of, reverse=True)
+        return batch
+
+    def _run(self):
+        bucket = self.bucket
+        waker = _Waker(bucket)
+        with self._cond:
+            self._waker = waker
+        try:
+            while True:
+                batch = self._next_batch()
+                if batch:
+                    self._dispatch(batch)
+                elif not self._busy():
+                    # Stopping, and everything has completed
+                    return
+
+                if self._busy():
+                    C.lcb_wait(bucket._lcbh)
+        finally:
+            with self._cond:
+                self._waker = None
+            waker.close()
+
+    def _dispatch(self, batch):
+        """
+        Run the submitted callables. Consecutive callables submitted with
+        :meth:`call_batched` share a single scheduling context
+        :param batch: A list of ``(fn, args, batched, priority)`` tuples
+        """
+        bucket = self.bucket
+        in_sched = False
+        try:
+            for fn, args, batched, _ in batch:
+                if batched and not in_sched:
+                    C.lcb_sched_enter(bucket._lcbh)
+                    bucket._sched_batch = in_sched = True
+                elif in_sched and not batched:
+                    bucket._sched_batch = in_sched = False
+                    C.lcb_sched_leave(bucket._lcbh)
+                fn(*args)
+        finally:
+            if in_sched:
+                bucket._sched_batch = False
+                C.lcb_sched_leave(bucket._lcbh)
+
+
+_priority_of = itemgetter(3)
+
+
+class _Pipe(object):
+    """
+    A non-blocking pipe used to make another thread's event loop wake up
+    """
+
+    def __init__(self):
+        self.rfd, self.wfd = os.pipe()
+        for fd in (self.rfd, self.wfd):
+            _set_nonblocking(fd)
+
+    def signal(self):
+        """
+        Make the read end readable
+        """
+        try:
+            os.write(self.wfd, b'x')
+        except OSError as e:
+            if e.errno != errno.EAGAIN:
+                raise
+
+    def clear(self):
+        """
+        Consume all signals
+        """
+        try:
+            while os.read(self.rfd, 4096):
+                pass
+        except OSError as e:
+            if e.errno != errno.EAGAIN:
+                raise
+
+    def close(self):
+        os.close(self.rfd)
+        os.close(self.wfd)
+
+
+@ffi.callback('void(lcb_socket_t,short,void*)')
+def _waker_callback(sock, events, arg):
+    C.lcb_breakout(ffi.from_handle(arg).bucket._lcbh)
+
+
+class _Waker(_Pipe):
+    """
+    A pipe whose read end is watched by the library's I/O plugin. Writing
+    to it from another thread breaks the I/O thread out of ``lcb_wait``.
+    Only used on the I/O thread, except for :meth:`signal`
+    """
+
+    def __init__(self, bucket):
+        super(_Waker, self).__init__()
+        self.bucket = bucket
+        self._cdata = ffi.new_handle(self)
+
+        io = ffi.new('lcb_io_opt_t*')
+        rc = C.lcb_cntl(bucket._lcbh, C.LCB_CNTL_GET, C.LCB_CNTL_IOPS, io)
+        if rc:
+            raise pycbc_exc_lcb(rc)
+        iops = self._iops = io[0]
+        if iops.version >= 2:
+            procs = ffi.new('lcb_ev_procs*')
+            iops.v.v2.get_procs(
+                C.LCB_IOPROCS_VERSION, ffi.new('lcb_loop_procs*'),
+                ffi.new('lcb_timer_procs*'), ffi.new('lcb_bsd_procs*'),
+                procs, ffi.new('lcb_completion_procs*'),
+                ffi.new('lcb_iomodel_t*'))
+            create, self._watch = procs.create, procs.watch
+            self._cancel, self._destroy = procs.cancel, procs.destroy
+        else:
+            table = iops.v.v0
+            create, self._watch = table.create_event, table.update_event
+            self._cancel = table.delete_event
+            self._destroy = table.destroy_event
+
+        self._event = create(iops)
+        self._watch(iops, self.rfd, self._event, LCB_READ_EVENT,
+                    self._cdata, _waker_callback)
+
+    def close(self):
+        self._cancel(self._iops, self.rfd, self._event)
+        self._destroy(self._iops, self._event)
+        super(_Waker, self).close()
+
+
+class _PipeCompletions(_Pipe):
+    """
+    Queue of completed results, signalled through a pipe so any event loop
+    can wait for completions by watching its read end
+    """
+
+    def __init__(self):
+        super(_PipeCompletions, self).__init__()
+        self._queue = deque()
+        self._signalled = False
+
+    def append(self, mres):
+        self._queue.append(mres)
+        if not self._signalled:
+            self._signalled = True
+            self.signal()
+
+    def drain(self):
+        # Only reset once the pipe is empty: a completion appended in
+        # between is popped below, and any later one signals again
+        self.clear()
+        self._signalled = False
+
+        queue = self._queue
+        rv = []
+        while queue:
+            rv.append(queue.popleft())
+        return rv
+
+
+def _set_nonblocking(fd):
+    import fcntl
+    flags = fcntl.fcntl(fd, fcntl.F_GETFL)
+    fcntl.fcntl(fd, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+
+
+class IOThreadBucket(Bucket):
+    """
+    Base class for asynchronous buckets whose ``lcb_t`` is owned by an
+    :class:`IOThread`. Operations may be issued from any thread; they are
+    scheduled on the I/O thread, and single-key operations submitted
+    together are flushed as one batch. Operations accept a ``priority``
+    option (see :mod:`couchbase_ffi.priority`); those submitted together
+    are scheduled highest priority first. Priorities only order the
+    scheduling of operations queued while the I/O thread was busy; once
+    scheduled, operations are sent and completed by the library in its own
+    order, and an operation deferred by a
+    :class:`~couchbase_ffi.ratelimit.RateLimiter` waits in submission
+    order.
+
+    Only key-value operations are supported; views and HTTP requests are
+    not.
+    """
+
+    __slots__ = ['_io']
+
+    def __init__(self, *args, **kwargs):
+        """
+        Accepts the same arguments as :class:`Bucket`, except ``_iops``
+        """
+        if kwargs.get('_iops'):
+            raise pycbc_exc_args('Cannot use custom I/O procs')
+        kwargs['_flags'] = kwargs.get('_flags', 0) | PYCBC_CONN_F_ASYNC
+        super(IOThreadBucket, self).__init__(*args, **kwargs)
+
+        self._io = IOThread(self)
+        self._io.start()
+
+    def connect(self):
+        """
+        Connect to the cluster, waiting until the bucket is ready
+        """
+        done = Event()
+        status = []
+
+        def on_connected(err):
+            status.append(err)
+            done.set()
+
+        def do_connect():
+            self._conncb = on_connected
+            try:
+                Bucket._connect(self)
+                C.lcb_wait(self._lcbh)
+            except Exception as e:
+                self._conncb = None
+                on_connected(e)
+                return
+
+            if not done.is_set():
+                self._conncb = None
+                rc = C.lcb_get_bootstrap_status(self._lcbh)
+                on_connected(PyCBC.make_exc_lcb(rc) if rc else None)
+
+        self._io.call(do_connect)
+        done.wait()
+        if status[0] is not None:
+            raise status[0]
+
+    _connect = connect
+
+    def close(self):
+        """
+        Wait for outstanding operations and stop the I/O thread
+        """
+        self._io.stop()
+
+    def _wrap_result(self, mres):
+        """
+        Called before an operation is queued
+        :param mres: The operation's :class:`AsyncResult`
+        :return: The object returned to the caller
+        """
+        return mres
+
+    def _submit(self, meth, name, args, kwargs, is_single=True):
+        mres = AsyncResult()
+        mres._is_single = is_single
+        kwargs['_MRES'] = mres
+        priority = kwargs.pop('priority', None) or 0
+        rv = self._wrap_result(mres)
+
+        # A failed multi-key operation may already have scheduled some of
+        # its keys, which is only safe to undo in a context of its own
+        batched = is_single and not isinstance(self._executors[name],
+                                               MultiContextExecutor)
+        self._io.submit(self._schedule, (meth, mres, name, args, kwargs),
+                        batched, priority)
+        return rv
+
+    def _schedule(self, meth, mres, name, args, kwargs):
+        # Runs on the I/O thread
+        try:
+            self._begin_op(mres, self._executors[name].OPNAME)
+            meth(self, name, *args, **kwargs)
+        except Exception:
+            mres._add_err(sys.exc_info())
+            # Like a completion, so the result reaches the caller the
+            # same way
+            self._deliver(mres)
+
+    def _execute_single_k(self, name, key, **kwargs):
+        return self._submit(Bucket._execute_single_k, name, (key,), kwargs)
+
+    def _execute_single_kv(self, name, key, value, **kwargs):
+        return self._submit(
+            Bucket._execute_single_kv, name, (key, value), kwargs)
+
+    def _execute_multi(self, name, kv, **kwargs):
+        return self._submit(Bucket._execute_multi, name, (kv,), kwargs,
+                            is_single=False)
+
+    def _view_request(self, *args, **kwargs):
+        raise pycbc_exc_args(
+            'Views are not supported by ' + type(self).__name__)
+
+    def _http_request(self, *args, **kwargs):
+        raise pycbc_exc_args(
+            'HTTP requests are not supported by ' + type(self).__name__)
+
+
+class NativeLoopBucket(IOThreadBucket):
+    """
+    An asynchronous bucket which keeps libcouchbase's built-in I/O plugin
+    (libev, libevent or select, as configured for the library) running on an
+    :class:`IOThread`. Python code is only entered for operation
+    completions, rather than for every socket and timer event as with a
+    Python I/O plugin.
+
+    Operations may be issued from any thread and return an
+    :class:`~couchbase_ffi.result.AsyncResult`. Completed results are queued,
+    and the read end of a pipe (see :meth:`fileno`) becomes readable; the
+    application's event loop should then call :meth:`process_completions`,
+    which invokes the results' callbacks on the calling thread.
+    """
+
+    __slots__ = ['_completions']
+
+    def __init__(self, *args, **kwargs):
+        super(NativeLoopBucket, self).__init__(*args, **kwargs)
+        self._completions = _PipeCompletions()
+        self._completion_queue = self._completions
+
+    def fileno(self):
+        """
+        :return: A descriptor which is readable while completed results are
+            waiting to be processed
+        """
+        return self._completions.rfd
+
+    def close(self):
+        """
+        Wait for outstanding operations and stop the I/O thread, then
+        process the remaining completions and close the descriptor
+        """
+        super(NativeLoopBucket, self).close()
+        self.process_completions()
+        self._completions.close()
+
+    def process_completions(self):
+        """
+        Invoke the callbacks of all completed results
+        :return: The number of results processed
+        """
+        results = self._completions.drain()
+        for mres in results:
+            mres.invoke()
+        return len(results)
@@ -0,0 +1,75 @@
+"""
+Routing of operations to separate connections by priority
+"""
+from couchbase_ffi.bucket import Bucket
+from couchbase_ffi._rtconfig import pycbc_exc_args
+
+PRIORITY_LOW = -1
+PRIORITY_NORMAL = 0
+PRIORITY_HIGH = 1
+
+
+def _route(name):
+    def routed(self, *args, **kwargs):
+        bucket = self.bucket_for(kwargs.get('priority'))
+        return getattr(bucket, name)(*args, **kwargs)
+    routed.__name__ = name
+    routed.__doc__ = getattr(Bucket, name).__doc__
+    return routed
+
+
+class PriorityRouter(object):
+    """
+    Sends each operation to the bucket configured for its ``priority``
+    option, so that latency-critical requests have their own ``lcb_t``
+    (and connections) and are not queued behind bulk traffic.
+
+    Operations are called as on a :class:`Bucket`, with an additional
+    ``priority`` option; the routed bucket receives the option too (an
+    :class:`~couchbase_ffi.native.IOThreadBucket` uses it to order its
+    submissions). Combined with the ``deadline`` option, late low-priority
+    work fails fast instead of waiting for the library's timeout.
+
+    Priorities are not a global queue: a bucket shared by several
+    priorities only reorders the operations submitted to it in the same
+    wakeup of its I/O thread, and never holds back scheduled work. The
+    isolation comes from giving the priorities buckets of their own.
+    """
+
+    def __init__(self, buckets, default=PRIORITY_NORMAL):
+        """
+        :param buckets: A dictionary mapping priorities to buckets. Several
+            priorities may share a bucket
+        :param default: The priority of operations without a ``priority``
+            option, and of those whose priority has no bucket of its own
+        """
+        if default not in buckets:
+            raise pycbc_exc_args('No bucket for the default priority',
+                                 obj=default)
+        self.buckets = dict(buckets)
+        self.default = default
+
+    def bucket_for(self, priority=None):
+        """
+        :param priority: The priority of an operation
+        :return: The bucket the operation is sent to
+        """
+        try:
+            return self.buckets[priority]
+        except KeyError:
+            return self.buckets[self.default]
+
+    def close(self):
+        """
+        Close those buckets which have a ``close`` method
+        """
+        for bucket in set(self.buckets.values()):
+            if hasattr(bucket, 'close'):
+                bucket.close()
+
+    for _name in Bucket._VALUE_METHS + Bucket._KEY_METHS:
+        locals()[_name] = _route(_name)
+        locals()[_name + '_multi'] = _route(_name + '_multi')
+    del _name
+
+    unlock_multi = _route('unlock_multi')
@@ -0,0 +1,101 @@
+"""
+Named groups of ``lcb_cntl_string()`` settings
+"""
+try:
+    from urlparse import parse_qsl
+except ImportError:
+    from urllib.parse import parse_qsl
+
+from couchbase._pyport import basestring
+
+from couchbase_ffi._rtconfig import pycbc_exc_args
+from couchbase_ffi.constants import LCB_CNTL_OP_TIMEOUT, LCB_CNTL_VIEW_TIMEOUT
+
+# Not exported by the C extension (see <libcouchbase/cntl.h>)
+LCB_CNTL_DURABILITY_TIMEOUT = 0x0D
+LCB_CNTL_DURABILITY_INTERVAL = 0x0E
+LCB_CNTL_HTTP_TIMEOUT = 0x0F
+LCB_CNTL_CONFIGURATION_TIMEOUT = 0x12
+LCB_CNTL_CONFIG_NODE_TIMEOUT = 0x1B
+
+PROFILES = {
+    # Fail fast and keep requests on the wire immediately
+    'low-latency': {
+        'operation_timeout': '0.5',
+        'durability_timeout': '2.0',
+        'durability_interval': '0.01',
+        'config_node_timeout': '1.0',
+        'config_poll_interval': '2.5',
+        'tcp_nodelay': '1',
+        'compression': 'off'
+    },
+    # Tolerate queueing on the server and favour larger, fuller packets
+    'bulk-throughput': {
+        'operation_timeout': '10.0',
+        'durability_timeout': '30.0',
+        'durability_interval': '0.1',
+        'config_node_timeout': '5.0',
+        'config_poll_interval': '10.0',
+        'tcp_nodelay': '0',
+        'compression': 'on'
+    },
+    # High round-trip times and limited bandwidth
+    'wan': {
+        'operation_timeout': '5.0',
+        'views_timeout': '150.0',
+        'http_timeout': '150.0',
+        'durability_timeout': '20.0',
+        'durability_interval': '0.2',
+        'config_total_timeout': '20.0',
+        'config_node_timeout': '10.0',
+        'config_poll_interval': '5.0',
+        'tcp_nodelay': '1',
+        'compression': 'on'
+    }
+}
+
+# Settings which older versions of the library do not know, and which
+# are skipped there
+OPTIONAL = frozenset(['compression', 'tcp_nodelay', 'config_poll_interval'])
+
+# Settings which can be read back from the library, as (op, value_type)
+READABLE = {
+    'operation_timeout': (LCB_CNTL_OP_TIMEOUT, 'timeout'),
+    'views_timeout': (LCB_CNTL_VIEW_TIMEOUT, 'timeout'),
+    'durability_timeout': (LCB_CNTL_DURABILITY_TIMEOUT, 'timeout'),
+    'durability_interval': (LCB_CNTL_DURABILITY_INTERVAL, 'timeout'),
+    'http_timeout': (LCB_CNTL_HTTP_TIMEOUT, 'timeout'),
+    'config_total_timeout': (LCB_CNTL_CONFIGURATION_TIMEOUT, 'timeout'),
+    'config_node_timeout': (LCB_CNTL_CONFIG_NODE_TIMEOUT, 'timeout')
+}
+
+
+def _setting_value(value):
+    if isinstance(value, bool):
+        return '1' if value else '0'
+    return str(value)
+
+
+def parse_profile(profile):
+    """
+    Resolve a profile into the settings it applies
+    :param profile: The name of one of :data:`PROFILES`, a dictionary of
+        settings, or a connection string fragment of the form
+        ``operation_timeout=2.5&compression=on``
+    :return: A dictionary mapping ``lcb_cntl_string()`` keys to values, as
+        strings
+    """
+    if isinstance(profile, dict):
+        items = profile.items()
+    elif profile in PROFILES:
+        items = PROFILES[profile].items()
+    elif isinstance(profile, basestring) and '=' in profile:
+        try:
+            items = parse_qsl(profile.lstrip('?'), strict_parsing=True)
+        except ValueError:
+            items = None
+        if not items or not all(k for k, _ in items):
+            raise pycbc_exc_args('Malformed profile', obj=profile)
+    else:
+        raise pycbc_exc_args('Unknown profile', obj=profile)
+    return dict((k, _setting_value(v)) for k, v in items)
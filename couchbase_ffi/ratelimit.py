@@ -0,0 +1,381 @@
+"""
+Rate limiting and adaptive concurrency control for the scheduling path
+"""
+import sys
+import time
+from collections import deque
+
+from couchbase.items import ItemCollection
+
+from couchbase_ffi.metrics import clock
+from couchbase_ffi.constants import (
+    LCB_ETMPFAIL, LCB_CLIENT_ETMPFAIL, LCB_ETIMEDOUT)
+
+
+class TokenBucket(object):
+    """
+    A token bucket refilled at `rate` tokens per second, holding at most
+    `capacity` tokens. Tokens may be taken while any are available, leaving
+    the bucket in debt; nothing more is admitted until the debt is repaid.
+    """
+
+    def __init__(self, rate, capacity):
+        self.rate = float(rate)
+        self.capacity = float(capacity)
+        self._tokens = self.capacity
+        self._last = clock()
+
+    def _refill(self):
+        now = clock()
+        self._tokens = min(self.capacity,
+                           self._tokens + (now - self._last) * self.rate)
+        self._last = now
+
+    def delay(self):
+        """
+        :return: The time, in seconds, until tokens are available
+        """
+        self._refill()
+        if self._tokens > 0:
+            return 0
+        return -self._tokens / self.rate + 1e-6
+
+    def take(self, n):
+        """
+        Take `n` tokens, regardless of how many are available
+        """
+        self._refill()
+        self._tokens -= n
+
+
+class AIMDController(object):
+    """
+    Additive-increase/multiplicative-decrease control of the number of
+    operations in flight.
+
+    The window grows by ``increase`` for each window's worth of operations
+    completed without temporary failures (``LCB_ETMPFAIL``, its client-side
+    equivalent, and timeouts) and, if ``latency_target`` is set, within
+    that latency. Otherwise it is multiplied by ``decrease``, at most once
+    per window's worth of operations, so a single burst of failures only
+    shrinks it once.
+    """
+
+    FAILURE_CODES = frozenset([
+        LCB_ETMPFAIL, LCB_CLIENT_ETMPFAIL, LCB_ETIMEDOUT])
+
+    def __init__(self, initial=64, min_window=1, max_window=4096,
+                 increase=1.0, decrease=0.5, latency_target=None):
+        """
+        :param initial: The initial window
+        :param min_window: The smallest window
+        :param max_window: The largest window
+        :param increase: The additive increase per window's worth of
+            successful operations
+        :param decrease: The factor (0-1) applied on failures
+        :param latency_target: The maximum acceptable time, in seconds, for
+            a batch (synchronous) or an operation (asynchronous) to complete
+        """
+        self.min_window = min_window
+        self.max_window = max_window
+        self.increase = increase
+        self.decrease = decrease
+        self.latency_target = latency_target
+        self._window = float(initial)
+        self._since_decrease = None
+
+        self.decreases = 0
+        """Number of times the window was shrunk"""
+
+    @property
+    def window(self):
+        """The current number of operations allowed in flight"""
+        return max(int(self._window), self.min_window)
+
+    def record(self, n, failures, latency):
+        """
+        Record completed operations
+        :param n: The number of operations (keys)
+        :param failures: How many of them failed temporarily
+        :param latency: The time, in seconds, they took to complete
+        """
+        target = self.latency_target
+        if failures or (target is not None and latency > target):
+            since = self._since_decrease
+            if since is None or since >= self._window:
+                self._window = max(self._window * self.decrease,
+                                   float(self.min_window))
+                self._since_decrease = 0
+                self.decreases += 1
+            else:
+                self._since_decrease += n
+            return
+
+        if self._since_decrease is not None:
+            self._since_decrease += n
+        self._window = min(self._window + self.increase * n / self._window,
+                           float(self.max_window))
+
+
+def _chunks(kv, size_fn):
+    """
+    Split the input of a multi operation into chunks
+    :param kv: The input passed to the executor
+    :param size_fn: Returns the size of the next chunk
+    """
+    if isinstance(kv, ItemCollection):
+        yield kv
+        return
+    if isinstance(kv, dict):
+        items = list(kv.items())
+        wrap = dict
+    else:
+        items = list(kv)
+        wrap = list
+
+    pos = 0
+    while pos < len(items):
+        size = size_fn()
+        yield wrap(items[pos:pos + size])
+        pos += size
+
+
+class RateLimiter(object):
+    """
+    Limits the rate at which operations are scheduled, in keys and in
+    (encoded) bytes sent per second, and optionally the number of keys in
+    flight using an :class:`AIMDController`.
+
+    When assigned to :attr:`Bucket.rate_limiter`:
+
+    * Synchronous multi operations (including write-behind flushes) are
+      scheduled in chunks of at most the controller's window (or
+      ``max_batch``) keys, waiting for each chunk to complete and for the
+      rate limits before scheduling the next. Results are merged into one
+      :class:`MultiResult` as usual; an encoding error in a later chunk
+      leaves earlier chunks applied.
+    * Synchronous single operations wait for the rate limits.
+    * Asynchronous operations are queued while the limits are exceeded
+      or the window is full, and scheduled from the event loop once
+      allowed. Their results are returned immediately, as usual.
+    """
+
+    def __init__(self, ops_per_sec=None, bytes_per_sec=None, burst=0.1,
+                 controller=None, max_batch=1000):
+        """
+        :param ops_per_sec: The maximum rate of keys scheduled, or None
+        :param bytes_per_sec: The maximum rate of key and value bytes
+            sent, or None
+        :param burst: How many seconds' worth of each rate may be scheduled
+            at once after being idle
+        :param controller: An :class:`AIMDController`, or None
+        :param max_batch: The chunk size for synchronous multi operations
+            without a controller
+        """
+        self.ops = self.bytes = None
+        if ops_per_sec:
+            self.ops = TokenBucket(ops_per_sec, max(ops_per_sec * burst, 1))
+        if bytes_per_sec:
+            self.bytes = TokenBucket(bytes_per_sec,
+                                     max(bytes_per_sec * burst, 1))
+        self.controller = controller
+        self.max_batch = max_batch
+
+        self.in_flight = 0
+        """The number of asynchronous keys in flight"""
+
+        self.throttled = 0.0
+        """Total time, in seconds, spent waiting for the rate limits"""
+
+        self.deferred = 0
+        """Number of asynchronous operations which had to be queued"""
+
+        self._backlog = deque()
+        self._started = {}
+        self._timer = None
+
+    def delay(self):
+        """
+        :return: The time, in seconds, until more operations may be
+            scheduled
+        """
+        rv = 0
+        if self.ops is not None:
+            rv = self.ops.delay()
+        if self.bytes is not None:
+            rv = max(rv, self.bytes.delay())
+        return rv
+
+    def charge_bytes(self, n):
+        """
+        Account bytes being sent. Called by the executors
+        """
+        self.bytes.take(n)
+
+    def _take(self, nops):
+        if self.ops is not None:
+            self.ops.take(nops)
+
+    def _batch_size(self):
+        if self.controller is not None:
+            return self.controller.window
+        return self.max_batch
+
+    def _throttle(self):
+        delay = self.delay()
+        if delay:
+            self.throttled += delay
+            time.sleep(delay)
+
+    def wait(self, nops):
+        """
+        Block until `nops` keys may be scheduled, and account them
+        """
+        self._throttle()
+        self._take(nops)
+
+    def run_chunked(self, parent, proc, kv, kwargs):
+        """
+        Schedule a synchronous multi operation chunk by chunk
+        :param parent: The bucket
+        :param proc: The executor
+        :param kv: The operation's input
+        :param kwargs: The operation's options
+        :return: The completed MultiResult
+        """
+        mres = parent._make_mres()
+        controller = self.controller
+        kwargs = dict(kwargs)
+        kwargs['_MRES'] = mres
+
+        # The chunks make up a single operation: hold it open until the
+        # last one completes, so it is begun and ended only once
+        parent._begin_op(mres, proc.OPNAME)
+        mres._remaining += 1
+        parent._handles.add(mres)
+        try:
+            for chunk in _chunks(kv, self._batch_size):
+                self._throttle()
+                self._take(len(chunk))
+                t_start = clock()
+                proc.execute(chunk, **kwargs)
+                parent._wait(mres)
+
+                if controller is not None:
+                    if isinstance(chunk, ItemCollection):
+                        results = list(mres.values())
+                    else:
+                        results = [mres[k] for k in chunk if k in mres]
+                    controller.record(len(chunk), self._failures(results),
+                                      clock() - t_start)
+        except Exception:
+            if mres._decr_remaining():
+                parent._handles.discard(mres)
+            raise
+
+        parent._chk_op_done(mres)
+        return mres
+
+    def _failures(self, results):
+        codes = self.controller.FAILURE_CODES
+        return sum(1 for result in results if result.rc in codes)
+
+    def defer(self, parent, meth, name, args, kwargs, nops, is_single):
+        """
+        Queue an asynchronous operation until the limits allow it
+        :param parent: The bucket
+        :param meth: The unbound bucket method scheduling the operation
+        :param name: The operation type
+        :param args: The positional arguments for `meth`
+        :param kwargs: The operation's options
+        :param nops: The number of keys
+        :param is_single: Whether the operation is a single-key one
+        :return: The operation's result object
+        """
+        mres = kwargs.get('_MRES')
+        begin = mres is None
+        if begin:
+            mres = parent._make_mres()
+            kwargs['_MRES'] = mres
+        mres._is_single = is_single
+        kwargs['_ADMITTED'] = True
+
+        if self._backlog or not self._may_schedule(parent):
+            self.deferred += 1
+        self._backlog.append((meth, name, args, kwargs, nops, begin))
+        self._pump(parent, mres)
+        return mres
+
+    def _may_schedule(self, parent):
+        if self.controller is not None and \
+                self.in_flight >= self.controller.window:
+            return False
+        delay = self.delay()
+        if delay:
+            if self._timer is None:
+                self._timer = parent._start_timer(
+                    delay, lambda: self._timer_fired(parent))
+            return False
+        return True
+
+    def _timer_fired(self, parent):
+        self._timer = None
+        self._pump(parent)
+
+    def _pump(self, parent, current=None):
+        """
+        Schedule queued operations while the limits allow it
+        :param parent: The bucket
+        :param current: The result of an operation being queued by the
+            caller. If it fails to be scheduled right away, the error is
+            raised to the caller, who has not set any callbacks yet.
+            Other operations are completed with their error.
+        """
+        backlog = self._backlog
+        while backlog and self._may_schedule(parent):
+            meth, name, args, kwargs, nops, begin = backlog.popleft()
+            mres = kwargs['_MRES']
+            self._take(nops)
+            if begin:
+                parent._begin_op(mres, parent._executors[name].OPNAME)
+            try:
+                meth(parent, name, *args, **kwargs)
+            except Exception:
+                if mres is current:
+                    raise
+                mres._add_err(sys.exc_info())
+                parent._deliver(mres)
+                continue
+
+            if mres._remaining:
+                self.in_flight += nops
+                self._started[mres] = (nops, clock())
+
+    def completed(self, parent, mres):
+        """
+        Called when an asynchronous operation completes
+        """
+        try:
+            nops, t_start = self._started.pop(mres)
+        except KeyError:
+            return
+
+        self.in_flight -= nops
+        if self.controller is not None:
+            self.controller.record(nops, self._failures(mres.values()),
+                                   clock() - t_start)
+        if self._backlog:
+            self._pump(parent)
+
+    def stats(self):
+        """
+        :return: A dictionary of the limiter's counters
+        """
+        return {
+            'in_flight': self.in_flight,
+            'backlog': len(self._backlog),
+            'deferred': self.deferred,
+            'throttled': self.throttled,
+            'window': self.controller.window
+            if self.controller is not None else None
+        }
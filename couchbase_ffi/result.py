@@ -5,7 +5,7 @@ from couchbase_ffi.constants import (
     PYCBC_RESFLD_HTCODE, PYCBC_RESFLD_URL)
 
 from couchbase_ffi._cinit import get_handle
-from couchbase_ffi._rtconfig import PyCBC, pycbc_exc_lcb
+from couchbase_ffi._rtconfig import PyCBC
 from couchbase_ffi._strutil import from_cstring
 
 """
@@ -43,6 +43,9 @@ class ValueResult(OperationResult):
     # __slots__ = ['value', 'flags']
     _fldprops = (PYCBC_RESFLD_KEY | PYCBC_RESFLD_CAS | PYCBC_RESFLD_VALUE)
 
+    # Set when the value was read from a replica by a hedged get
+    possibly_stale = False
+
     def __init__(self):
         super(ValueResult, self).__init__()
         self.value = None
@@ -111,12 +114,34 @@ class MultiResult(dict):
 
         # Private attributes
         self._err = None
+        self._bad_rc = None
         self._remaining = 0
         self._cdata = ffi.new_handle(self)
         self._dur = None
         self._quiet = False
         self._no_format = False
         self._is_single = True
+        self._key_filter = None
+        self._hedge = None
+        self._op_name = None
+        self._t_start = 0
+        self._phases = None
+        self._span = None
+
+        # Per-call deadline (see Bucket._arm_deadline)
+        self._deadline_timer = None
+        self._expired = False
+
+    @property
+    def phase_times(self):
+        """
+        The time spent in each phase of this operation (see
+        :class:`~couchbase_ffi.metrics.PhaseTimes`), or None if the bucket
+        was not profiling phases when the operation was scheduled
+        """
+        if self._phases is None:
+            return None
+        return self._phases.as_dict()
 
     def _add_err(self, exinfo):
         """
@@ -124,15 +149,19 @@ class MultiResult(dict):
         already set.
         :param exinfo: Return value from ``sys.exc_info()``
         """
-        if self._err:
+        if self._err or self._bad_rc:
             return
         self._err = exinfo
         self.all_ok = False
 
-    def _add_bad_rc(self, rc, result):
+    def _add_bad_rc(self, rc, result=None):
         """
-        Sets an error with a bad return code. Handles 'quiet' logic
+        Sets an error with a bad return code. Handles 'quiet' logic.
+
+        Only the code and result are recorded here; the exception itself is
+        created by :meth:`_maybe_throw`, if and when it is actually raised.
         :param rc: The error code
+        :param result: The result which failed
         """
         if not rc:
             return
@@ -140,14 +169,28 @@ class MultiResult(dict):
         self.all_ok = False
         if rc == C.LCB_KEY_ENOENT and self._quiet:
             return
+        if self._err or self._bad_rc:
+            return
+        self._bad_rc = (rc, result)
 
-        try:
-            raise pycbc_exc_lcb(rc)
-        except PyCBC.default_exception as e:
-            e.all_results = self
-            e.key = result.key
-            e.result = result
-            self._add_err(sys.exc_info())
+    def _rescan_bad_rc(self):
+        """
+        Recompute the deferred error code from the current results. Used
+        when some of the results have been replaced
+        """
+        self._bad_rc = None
+        self.all_ok = not self._err
+        for result in self.values():
+            self._add_bad_rc(result.rc, result)
+
+    def _make_bad_rc_exc(self):
+        rc, result = self._bad_rc
+        ex = PyCBC.make_exc_lcb(rc)
+        ex.all_results = self
+        if result is not None:
+            ex.key = result.key
+            ex.result = result
+        return ex
 
     def _decr_remaining(self):
         """
@@ -162,8 +205,13 @@ class MultiResult(dict):
 
     def _maybe_throw(self):
         """
-        Throw any deferred exceptions set via :meth:`_add_err`
+        Throw any deferred exceptions set via :meth:`_add_err` or
+        :meth:`_add_bad_rc`
         """
+        if self._bad_rc:
+            ex = self._make_bad_rc_exc()
+            self._bad_rc = None
+            raise ex
         if self._err:
             ex_cls, ex_obj, ex_bt = self._err
             self._err = None
@@ -190,6 +238,10 @@ class AsyncResult(MultiResult):
         self.callback = None
         self.errback = None
 
+        # Single-flight bookkeeping (see Bucket.coalesce_gets)
+        self._coalesce_key = None
+        self._followers = None
+
     def clear_callbacks(self):
         self.callback = None
         self.errback = None
@@ -197,7 +249,43 @@ class AsyncResult(MultiResult):
     def set_callbacks(self, callback, errback):
         self.callback, self.errback = callback, errback
 
+    def _add_follower(self, follower=None):
+        """
+        Attach a result which is completed along with this one, rather than
+        being scheduled on its own. The follower shares this object's
+        result items and error.
+        :param follower: The :class:`AsyncResult` to attach, or None to
+            create one
+        :return: The follower
+        """
+        if follower is None:
+            follower = AsyncResult()
+        follower._cdata = None
+        if self._followers is None:
+            self._followers = []
+        self._followers.append(follower)
+        return follower
+
+    def _release_followers(self):
+        """
+        Detach the followers, passing them this object's result items and
+        error. Called once the result is complete
+        :return: The list of followers, which are ready to be invoked
+        """
+        followers = self._followers
+        if not followers:
+            return ()
+        self._followers = None
+        for follower in followers:
+            follower.update(self)
+            follower.all_ok = self.all_ok
+            follower._err = self._err
+            follower._bad_rc = self._bad_rc
+        return followers
+
     def invoke(self):
+        followers = self._release_followers()
+
         cb, eb = self.callback, self.errback
         self.clear_callbacks()
 
@@ -205,8 +293,10 @@ class AsyncResult(MultiResult):
             self._maybe_throw()
         except:
             eb(self, *sys.exc_info())
-            return
+        else:
+            res = self.unwrap_single() if self._is_single else self
+            cb(res)
+            del res
 
-        res = self.unwrap_single() if self._is_single else self
-        cb(res)
-        del res
+        for follower in followers:
+            follower.invoke()
@@ -0,0 +1,181 @@
+"""
+Retrying of keys which failed with transient errors
+"""
+import random
+import time
+
+from couchbase.items import ItemCollection
+
+from couchbase_ffi.constants import (
+    LCB_ETMPFAIL, LCB_CLIENT_ETMPFAIL, LCB_NOT_MY_VBUCKET, LCB_ETIMEDOUT)
+
+
+def _subset(kv, keys):
+    """
+    Get the entries of the operation's input which belong to `keys`
+    :param kv: The input originally passed to the executor
+    :param keys: The keys to select
+    :return: The subset of `kv`, or None if it cannot be subset
+    """
+    if isinstance(kv, ItemCollection):
+        return None
+    if isinstance(kv, dict):
+        return dict((k, v) for k, v in kv.items() if k in keys)
+    try:
+        return [k for k in kv if k in keys]
+    except TypeError:
+        return None
+
+
+class RetryPolicy(object):
+    """
+    Policy for transparently retrying keys which fail with a transient
+    error, such as during a rebalance.
+
+    When assigned to :attr:`Bucket.retry_policy`, the keys of a synchronous
+    operation which failed with one of :attr:`retry_codes` are scheduled
+    again through the same executor after an exponential backoff, and their
+    new results replace the failed ones in the original
+    :class:`MultiResult`. Keys which succeeded are never resubmitted.
+
+    Operations with durability requirements, operations given a CAS, and
+    operations whose input is an :class:`~couchbase.items.ItemCollection`,
+    are not retried. Timeouts of non-idempotent commands (insert, append,
+    prepend, counter, remove and lock) are not retried either, since the
+    command may already have been applied.
+
+    Retrying stops once the next backoff would pass the policy's
+    ``deadline`` or the operation's own ``deadline``, and when failed keys
+    cannot be scheduled again; the last results of the keys are kept.
+    """
+
+    DEFAULT_RETRY_CODES = frozenset([
+        LCB_ETMPFAIL, LCB_CLIENT_ETMPFAIL, LCB_NOT_MY_VBUCKET, LCB_ETIMEDOUT])
+
+    def __init__(self, max_attempts=3, initial_delay=0.01, max_delay=1.0,
+                 multiplier=2.0, jitter=0.5, deadline=None, retry_codes=None):
+        """
+        :param max_attempts: The maximum number of attempts for each key,
+            including the first one
+        :param initial_delay: The delay, in seconds, before the first retry
+        :param max_delay: The maximum delay between retries
+        :param multiplier: The factor by which the delay grows each retry
+        :param jitter: The fraction (0-1) of each delay which is randomized
+        :param deadline: If set, the maximum time in seconds to spend
+            retrying a single operation
+        :param retry_codes: The error codes to retry. Defaults to
+            :attr:`DEFAULT_RETRY_CODES`
+        """
+        self.max_attempts = max_attempts
+        self.initial_delay = initial_delay
+        self.max_delay = max_delay
+        self.multiplier = multiplier
+        self.jitter = jitter
+        self.deadline = deadline
+        if retry_codes is None:
+            retry_codes = self.DEFAULT_RETRY_CODES
+        self.retry_codes = frozenset(retry_codes)
+
+        self.retries = 0
+        """Number of times failed keys were resubmitted"""
+
+        self.keys_retried = 0
+        """Total number of key resubmissions"""
+
+        self.keys_recovered = 0
+        """Keys which succeeded after being retried"""
+
+        self.keys_exhausted = 0
+        """Keys which were still failing when retrying stopped"""
+
+    def backoff(self, attempt):
+        """
+        Get the delay before a given retry
+        :param attempt: The retry number, starting at 1
+        :return: The delay in seconds
+        """
+        delay = self.initial_delay * self.multiplier ** (attempt - 1)
+        delay = min(delay, self.max_delay)
+        return delay * (1 - self.jitter * random.random())
+
+    @staticmethod
+    def _has_cas(proc, kv, kwargs):
+        # A CAS was valid for the first attempt only; if that attempt was
+        # applied, a retry fails with a misleading CAS mismatch
+        if kwargs.get('cas'):
+            return True
+        if proc.CAS_VALUES and isinstance(kv, dict):
+            for value in kv.values():
+                if getattr(value, 'cas', value):
+                    return True
+        return False
+
+    @staticmethod
+    def _failed_keys(mres, codes):
+        return set(k for k, r in mres.items() if r.rc in codes)
+
+    def run(self, parent, proc, kv, kwargs, mres):
+        """
+        Retry the failed keys of a completed operation
+        :param parent: The bucket
+        :param proc: The executor which ran the operation
+        :param kv: The operation's original input
+        :param kwargs: The operation's original options
+        :param mres: The completed :class:`MultiResult`
+        """
+        if mres._err or mres._dur or self._has_cas(proc, kv, kwargs):
+            return
+
+        codes = self.retry_codes
+        if not proc.IDEMPOTENT:
+            codes = codes - frozenset([LCB_ETIMEDOUT])
+
+        failed = self._failed_keys(mres, codes)
+        if not failed:
+            return
+
+        start = time.time()
+        op_deadline = kwargs.get('deadline')
+        attempt = 1
+        retried = set()
+        while failed and attempt < self.max_attempts:
+            delay = self.backoff(attempt)
+            now = time.time()
+            if self.deadline is not None and \
+                    now + delay - start > self.deadline:
+                break
+            if op_deadline is not None and now + delay >= op_deadline:
+                break
+
+            sub_kv = _subset(kv, failed)
+            if not sub_kv:
+                break
+
+            time.sleep(delay)
+            try:
+                parent._resubmit(proc, sub_kv, kwargs, mres)
+            except Exception:
+                # The previous results were restored
+                break
+            self.retries += 1
+            self.keys_retried += len(sub_kv)
+            retried.update(sub_kv)
+
+            attempt += 1
+            failed = self._failed_keys(mres, codes)
+            if mres._err:
+                break
+
+        self.keys_recovered += sum(1 for k in retried if not mres[k].rc)
+        self.keys_exhausted += len(failed)
+
+    def stats(self):
+        """
+        :return: A dictionary of the retry counters
+        """
+        return {
+            'retries': self.retries,
+            'keys_retried': self.keys_retried,
+            'keys_recovered': self.keys_recovered,
+            'keys_exhausted': self.keys_exhausted
+        }
@@ -0,0 +1,51 @@
+"""
+A bucket usable from any number of threads, returning
+:class:`concurrent.futures.Future` objects::
+
+    bucket = ThreadedBucket('couchbase://localhost/default')
+    bucket.connect()
+    futures = [bucket.get(key) for key in keys]
+    values = [f.result().value for f in futures]
+
+Requires Python 3.2 or later, or the ``futures`` backport.
+"""
+from concurrent.futures import Future
+
+from couchbase_ffi.native import IOThreadBucket
+
+
+class ThreadedBucket(IOThreadBucket):
+    """
+    A bucket whose ``lcb_t`` is owned by a dedicated I/O thread.
+
+    Every operation may be called from any thread and returns a
+    :class:`~concurrent.futures.Future`. Single-key operations resolve to
+    their result object and multi-key operations to their
+    :class:`~couchbase_ffi.result.AsyncResult`; failed operations set the
+    exception which the synchronous bucket would have raised. Futures are
+    resolved on the I/O thread, so their done-callbacks should not block.
+
+    Single-key operations submitted while the I/O thread is busy are
+    scheduled together and sent in a single flush. An operation whose
+    future is cancelled before it is scheduled is never sent.
+    """
+
+    __slots__ = []
+
+    def _wrap_result(self, mres):
+        fut = Future()
+
+        def on_ok(result):
+            fut.set_result(result)
+
+        def on_err(_, exc_type, exc_value, tb):
+            fut.set_exception(exc_value)
+
+        mres.set_callbacks(on_ok, on_err)
+        mres._future = fut
+        return fut
+
+    def _schedule(self, meth, mres, name, args, kwargs):
+        if not mres._future.set_running_or_notify_cancel():
+            return
+        super(ThreadedBucket, self)._schedule(meth, mres, name, args, kwargs)
@@ -0,0 +1,227 @@
+"""
+Adaptive operation timeouts
+"""
+import logging
+import time
+from collections import deque
+
+from couchbase_ffi._cinit import get_handle
+from couchbase_ffi.metrics import Histogram
+
+ffi, C = get_handle()
+
+KV_OPERATIONS = frozenset([
+    'upsert', 'insert', 'replace', 'append', 'prepend', 'get',
+    'get_replica', 'lock', 'remove', 'counter', 'unlock', 'touch'])
+
+
+class AdaptiveTimeout(object):
+    """
+    Adjusts the library's operation timeout (``LCB_CNTL_OP_TIMEOUT``) to the
+    latencies actually observed.
+
+    When assigned to :attr:`Bucket.timeout_controller`, the latency of
+    every key-value operation is recorded in a rolling histogram per
+    operation type, covering the last one or two ``interval`` periods.
+    Once per ``interval`` the timeout is set to the highest ``percentile``
+    among the operation types with at least ``min_samples`` latencies,
+    multiplied by ``factor`` and bounded by ``min_timeout`` and
+    ``max_timeout``. Changes smaller than ``tolerance`` (a fraction of the
+    current timeout) are not applied.
+
+    Operations which time out are not recorded as latencies, since their
+    latency is only known to exceed the timeout; they are counted instead,
+    and ranked above every completed operation. When more than the
+    fraction of operations above ``percentile`` time out, the percentile is
+    taken to be the current timeout, which is therefore raised by
+    ``factor``. Once timeouts become rare again, the percentile is computed
+    from the completed operations, and the timeout is lowered.
+
+    The timeout is adjusted when an operation completes after the interval
+    has elapsed, and from a timer while the bucket's event loop runs.
+
+    Each change is logged, kept in :attr:`decisions`, and passed to the
+    optional ``on_change`` callable.
+    """
+
+    def __init__(self, percentile=99.9, factor=3.0, min_timeout=0.05,
+                 max_timeout=10.0, interval=10.0, min_samples=1000,
+                 tolerance=0.1, operations=KV_OPERATIONS,
+                 logger='couchbase.timeouts', on_change=None):
+        """
+        :param percentile: The latency percentile the timeout is based on
+        :param factor: The multiple of the percentile used as the timeout
+        :param min_timeout: The lowest timeout, in seconds
+        :param max_timeout: The highest timeout, in seconds
+        :param interval: How often, in seconds, the timeout is adjusted
+        :param min_samples: The number of latencies an operation type needs
+            before it is taken into account
+        :param tolerance: The smallest relative change applied
+        :param operations: The operation types whose latencies are
+            recorded
+        :param logger: The :class:`logging.Logger`, or its name
+        :param on_change: A callable receiving each decision (see
+            :attr:`decisions`)
+        """
+        self.percentile = percentile
+        self.factor = factor
+        self.min_timeout = min_timeout
+        self.max_timeout = max_timeout
+        self.interval = interval
+        self.min_samples = min_samples
+        self.tolerance = tolerance
+        self.operations = frozenset(operations)
+        if not isinstance(logger, logging.Logger):
+            logger = logging.getLogger(logger)
+        self.logger = logger
+        self.on_change = on_change
+
+        self.decisions = deque(maxlen=100)
+        """
+        The most recent changes, as dictionaries with the ``time`` of the
+        change, the ``old`` and ``new`` timeouts and the ``percentiles``
+        (in seconds) of each operation type taken into account
+        """
+
+        self.timeout = None
+        """The timeout last read or set, in seconds"""
+
+        # Latency histograms and timeout counts per operation type, for
+        # the current and the previous period
+        self._current = {}
+        self._previous = {}
+        self._timeouts = {}
+        self._previous_timeouts = {}
+        self._last_adjust = time.time()
+        self._timer = None
+
+    def attach(self, parent):
+        """
+        Called when assigned to a bucket; reads the current timeout and
+        starts the adjustment timer
+        """
+        self.timeout = parent._cntl(C.LCB_CNTL_OP_TIMEOUT,
+                                    value_type='timeout')
+        self._last_adjust = time.time()
+        self._start_timer(parent, self.interval)
+
+    def detach(self):
+        """
+        Called when removed from a bucket; stops the adjustment timer
+        """
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+    def _start_timer(self, parent, delay):
+        # Standalone, so that waiting on the bucket does not also wait for
+        # the next adjustment
+        self._timer = parent._start_timer(
+            delay, lambda: self._on_timer(parent), standalone=True)
+
+    def _on_timer(self, parent):
+        self._timer = None
+        self._maybe_adjust(parent)
+        delay = self._last_adjust + self.interval - time.time()
+        self._start_timer(parent, max(delay, 0))
+
+    def _maybe_adjust(self, parent):
+        now = time.time()
+        if now - self._last_adjust >= self.interval:
+            self._last_adjust = now
+            self.adjust(parent)
+
+    def record(self, parent, name, elapsed, timed_out=False):
+        """
+        Record the latency of a completed operation. Called by the bucket
+        :param parent: The bucket
+        :param name: The operation type
+        :param elapsed: The latency, in seconds
+        :param timed_out: Whether the operation failed with a timeout, in
+            which case its latency is not recorded
+        """
+        if name not in self.operations:
+            return
+        if timed_out:
+            self._timeouts[name] = self._timeouts.get(name, 0) + 1
+        else:
+            try:
+                hist = self._current[name]
+            except KeyError:
+                hist = self._current[name] = Histogram()
+            hist.record(elapsed * 1000000)
+        self._maybe_adjust(parent)
+
+    def percentiles(self):
+        """
+        :return: A dictionary mapping each operation type with enough
+            operations to its current percentile, in seconds
+        """
+        rv = {}
+        tail = 1 - self.percentile / 100.0
+        names = (set(self._current) | set(self._previous) |
+                 set(self._timeouts) | set(self._previous_timeouts))
+        for name in names:
+            hist = Histogram()
+            for window in (self._previous, self._current):
+                if name in window:
+                    hist.merge(window[name])
+            timeouts = (self._previous_timeouts.get(name, 0) +
+                        self._timeouts.get(name, 0))
+            total = hist.count + timeouts
+            if not total or total < self.min_samples:
+                continue
+            if timeouts > total * tail:
+                # The percentile lies beyond the timeout
+                rv[name] = self.timeout or self.max_timeout
+            else:
+                # The timed out operations rank above all of the histogram
+                rank = min(self.percentile * float(total) / hist.count, 100)
+                rv[name] = hist.percentile(rank) / 1000000.0
+        return rv
+
+    def adjust(self, parent):
+        """
+        Recompute the timeout and apply it to `parent` if it changed enough,
+        then start a new period
+        :return: The decision, or None if the timeout was not changed
+        """
+        percentiles = self.percentiles()
+        self._previous, self._current = self._current, {}
+        self._previous_timeouts, self._timeouts = self._timeouts, {}
+        if not percentiles:
+            return None
+
+        new = max(percentiles.values()) * self.factor
+        new = min(max(new, self.min_timeout), self.max_timeout)
+        old = self.timeout
+        if old and abs(new - old) < old * self.tolerance:
+            return None
+
+        parent._cntl(C.LCB_CNTL_OP_TIMEOUT, new, 'timeout')
+        self.timeout = new
+        decision = {
+            'time': time.time(),
+            'old': old,
+            'new': new,
+            'percentiles': percentiles
+        }
+        self.decisions.append(decision)
+        self.logger.info(
+            'Operation timeout changed from %s to %.6fs (p%s: %s)',
+            '%.6fs' % old if old else 'unknown', new, self.percentile,
+            ', '.join('%s=%.6fs' % kv for kv in sorted(percentiles.items())))
+        if self.on_change is not None:
+            self.on_change(decision)
+        return decision
+
+    def stats(self):
+        """
+        :return: A dictionary with the current timeout, the current
+            percentiles and the number of changes made
+        """
+        return {
+            'timeout': self.timeout,
+            'percentiles': self.percentiles(),
+            'changes': len(self.decisions)
+        }
@@ -0,0 +1,216 @@
+"""
+Multiplexing of libcouchbase's timers onto a single event loop timer
+"""
+from couchbase_ffi.metrics import clock
+from couchbase_ffi.constants import PYCBC_EVACTION_WATCH
+
+
+class TimerWheel(object):
+    """
+    A hierarchical timing wheel.
+
+    Level 0 has ``2**ROOT_BITS`` slots of one tick each; every further level
+    has ``2**LEVEL_BITS`` slots, each spanning a whole turn of the level
+    below. Timers are placed in the slot of the lowest level covering their
+    expiry, and moved down a level (cascaded) as the wheel turns, so
+    scheduling and cancelling a timer costs O(1) however many are pending.
+
+    Only a single timer of the event loop is used (via the `arm` callable),
+    and it is only updated when the earliest expiry changes. Timers are
+    rounded up to whole ticks, so they fire up to one tick late.
+    """
+
+    ROOT_BITS = 8
+    LEVEL_BITS = 6
+    LEVELS = 4
+
+    def __init__(self, arm, resolution=0.001):
+        """
+        :param arm: A callable taking a delay in microseconds, after which
+            :meth:`expire` should be called. It replaces any delay passed
+            before
+        :param resolution: The length of a tick, in seconds
+        """
+        self.resolution = resolution
+        self._arm = arm
+
+        root_bits, level_bits = self.ROOT_BITS, self.LEVEL_BITS
+        self._levels = [[set() for _ in range(1 << root_bits)]]
+        for _ in range(self.LEVELS - 1):
+            self._levels.append([set() for _ in range(1 << level_bits)])
+        self._shifts = [0] + [root_bits + level_bits * i
+                              for i in range(self.LEVELS - 1)]
+
+        self._origin = clock()
+        self._current = 0
+        self._armed = None
+        self._pending = 0
+
+        self.scheduled = 0
+        """Timers scheduled while not pending"""
+
+        self.rescheduled = 0
+        """Timers scheduled while already pending"""
+
+        self.cancelled = 0
+        """Pending timers cancelled"""
+
+        self.fired = 0
+        """Timers which expired"""
+
+        self.loop_updates = 0
+        """Updates of the event loop's timer"""
+
+    def __len__(self):
+        return self._pending
+
+    def _now(self):
+        return int((clock() - self._origin) / self.resolution)
+
+    def update(self, timer, action, usecs):
+        """
+        Schedule or cancel a timer, in place of ``update_timer`` of the
+        I/O procs
+        :param timer: The :class:`~couchbase_ffi.iops.TimerEvent`
+        :param action: The ``PYCBC_EVACTION_*`` action
+        :param usecs: The delay, in microseconds, for ``WATCH``
+        """
+        if timer._wheel_slot is not None:
+            self._remove(timer)
+            if action == PYCBC_EVACTION_WATCH:
+                self.rescheduled += 1
+            else:
+                self.cancelled += 1
+        elif action == PYCBC_EVACTION_WATCH:
+            self.scheduled += 1
+
+        if action != PYCBC_EVACTION_WATCH:
+            return
+
+        if not self._pending:
+            # Nothing can be waiting to cascade; skip the idle period
+            self._current = max(self._current, self._now())
+
+        # The first tick starting at or after the expiry time
+        expires = int((clock() - self._origin + usecs / 1000000.0) /
+                      self.resolution) + 1
+        self._insert(timer, max(expires, self._current + 1))
+
+        if self._armed is None or expires < self._armed:
+            self._rearm(expires)
+
+    def _insert(self, timer, expires):
+        timer._wheel_expires = expires
+        delta = expires - self._current
+        level = 0
+        root_bits, level_bits = self.ROOT_BITS, self.LEVEL_BITS
+        limit = 1 << root_bits
+        while delta >= limit and level < self.LEVELS - 1:
+            level += 1
+            limit <<= level_bits
+
+        if delta >= limit:
+            # Beyond the top level; parked in its furthest slot and
+            # re-inserted when that slot cascades
+            expires = self._current + limit - 1
+
+        slots = self._levels[level]
+        slot = slots[(expires >> self._shifts[level]) & (len(slots) - 1)]
+        slot.add(timer)
+        timer._wheel_slot = slot
+        self._pending += 1
+
+    def _remove(self, timer):
+        timer._wheel_slot.discard(timer)
+        timer._wheel_slot = None
+        self._pending -= 1
+
+    def _cascade(self, tick):
+        # Move the timers of every level which completed a turn at `tick`
+        # down, starting from the highest
+        levels = [level for level in range(1, self.LEVELS)
+                  if not tick & ((1 << self._shifts[level]) - 1)]
+        for level in reversed(levels):
+            slots = self._levels[level]
+            slot = slots[(tick >> self._shifts[level]) & (len(slots) - 1)]
+            timers = list(slot)
+            slot.clear()
+            for timer in timers:
+                timer._wheel_slot = None
+                self._pending -= 1
+                self._insert(timer, max(timer._wheel_expires, tick))
+
+    def expire(self):
+        """
+        Fire all timers which have expired. Called when the event loop's
+        timer fires
+        """
+        self._armed = None
+        now = self._now()
+        root = self._levels[0]
+        root_mask = len(root) - 1
+
+        while self._current < now and self._pending:
+            # Skip straight to the next tick with anything to do
+            tick = self._next_expiry()
+            if tick > now:
+                break
+            self._current = tick
+            if not tick & root_mask:
+                self._cascade(tick)
+
+            slot = root[tick & root_mask]
+            while slot:
+                timer = slot.pop()
+                timer._wheel_slot = None
+                self._pending -= 1
+                self.fired += 1
+                timer.ready()
+
+        self._current = max(self._current, now)
+        if self._pending:
+            self._rearm(self._next_expiry())
+
+    def _next_expiry(self):
+        # A tick no later than the earliest expiry: the next non-empty root
+        # slot, or the start of the earliest non-empty slot of the higher
+        # levels (where it cascades), whichever comes first
+        current = self._current
+        root = self._levels[0]
+        root_mask = len(root) - 1
+        earliest = None
+        for tick in range(current + 1, current + root_mask + 1):
+            if root[tick & root_mask]:
+                earliest = tick
+                break
+
+        for level in range(1, self.LEVELS):
+            slots, shift = self._levels[level], self._shifts[level]
+            base = current >> shift
+            for n in range(1, len(slots) + 1):
+                if slots[(base + n) & (len(slots) - 1)]:
+                    start = (base + n) << shift
+                    if earliest is None or start < earliest:
+                        earliest = start
+                    break
+        return earliest
+
+    def _rearm(self, expires):
+        self._armed = expires
+        self.loop_updates += 1
+        delay = (expires - self._now()) * self.resolution
+        self._arm(max(int(delay * 1000000), 0))
+
+    def stats(self):
+        """
+        :return: A dictionary of the counters and the number of pending
+            timers
+        """
+        return {
+            'pending': self._pending,
+            'scheduled': self.scheduled,
+            'rescheduled': self.rescheduled,
+            'cancelled': self.cancelled,
+            'fired': self.fired,
+            'loop_updates': self.loop_updates
+        }
@@ -0,0 +1,98 @@
+"""
+Pluggable tracing of operations
+"""
+import random
+
+from couchbase_ffi.metrics import clock
+
+
+class Span(object):
+    """
+    Information about a single traced operation. Spans are created by
+    :meth:`Tracer.start_span` when the operation is scheduled and passed to
+    :meth:`Tracer.finish_span` once it completes.
+    """
+    __slots__ = ['op', 'keys', 'bytes_out', 'bytes_in', 'servers', 'rc',
+                 'start', 'end', 'context']
+
+    def __init__(self, op, context=None):
+        self.op = op
+        """The operation type, e.g. ``get`` or ``upsert``"""
+
+        self.keys = 0
+        """The number of keys scheduled"""
+
+        self.bytes_out = 0
+        """The size of the encoded keys and values sent"""
+
+        self.bytes_in = 0
+        """The size of the values received"""
+
+        self.servers = set()
+        """
+        The indexes of the servers the keys were sent to. Keys scheduled
+        before the bucket has a configuration are not included.
+        """
+
+        self.rc = 0
+        """The first error code received, or 0 if all keys succeeded"""
+
+        self.start = clock()
+        self.end = None
+
+        self.context = context
+        """Arbitrary data attached by the tracer, e.g. a parent span"""
+
+    @property
+    def duration(self):
+        """
+        The duration of the operation in seconds, or None if it has not
+        completed
+        """
+        if self.end is None:
+            return None
+        return self.end - self.start
+
+
+class Tracer(object):
+    """
+    Base class for tracers. Assign an instance to :attr:`Bucket.tracer` to
+    have a :class:`Span` created for the given fraction of operations.
+
+    This class itself discards every span. Subclasses override
+    :meth:`finish_span` to forward spans to a tracing system, and may
+    override :meth:`make_context` to link them to the current trace.
+    """
+
+    def __init__(self, sample_rate=1.0):
+        """
+        :param sample_rate: The fraction (0-1) of operations to trace
+        """
+        self.sample_rate = sample_rate
+
+    def make_context(self, op):
+        """
+        Hook called when a sampled operation is scheduled
+        :param op: The operation type
+        :return: An object stored as the span's ``context``
+        """
+        return None
+
+    def start_span(self, op):
+        """
+        Called when an operation is created
+        :param op: The operation type
+        :return: A new :class:`Span`, or None if the operation is not
+            sampled
+        """
+        rate = self.sample_rate
+        if rate < 1 and (rate <= 0 or random.random() >= rate):
+            return None
+        return Span(op, self.make_context(op))
+
+    def finish_span(self, span):
+        """
+        Called when a traced operation is complete, with ``span.end`` set
+        :param span: The :class:`Span`
+        """
+        pass
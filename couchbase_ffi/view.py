@@ -79,6 +79,7 @@ class ViewResult(Result):
     def _handle_done(self, resp, mres):
         self.done = True
         self._c_handle = None
+        self._parent._end_op(mres, resp.rc)
         if resp.rc:
             if resp.rc == C.LCB_HTTP_ERROR:
                 try:
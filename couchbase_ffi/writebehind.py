@@ -0,0 +1,188 @@
+"""
+Write-behind buffering of upserts
+"""
+import sys
+from collections import OrderedDict
+from threading import RLock, Timer
+
+
+class WriteBehindBuffer(object):
+    """
+    Buffers upserts and writes them to the bucket in batches.
+
+    Only the latest value for each key is kept: writing a key which is
+    already pending replaces the pending value, and the superseded write is
+    never sent to the server (it is counted in :attr:`elided`).
+
+    Pending writes are flushed via ``upsert_multi`` once ``max_items`` keys
+    are pending, once the oldest pending write is ``max_delay`` seconds old,
+    or when :meth:`flush` is called. Time-based flushes run from a timer
+    thread, so the bucket should be created with ``LOCKMODE_WAIT`` if it is
+    also used directly by the application.
+    """
+
+    def __init__(self, bucket, max_items=1000, max_delay=1.0,
+                 persist_to=0, replicate_to=0):
+        """
+        :param bucket: The bucket to write to
+        :param max_items: Flush once this many keys are pending
+        :param max_delay: Flush once the oldest pending write is this many
+            seconds old. If 0, only size triggered and explicit flushes
+            are performed
+        :param persist_to: Default persistence requirement for flushes
+        :param replicate_to: Default replication requirement for flushes
+        """
+        self._bucket = bucket
+        self.max_items = max_items
+        self.max_delay = max_delay
+        self.persist_to = persist_to
+        self.replicate_to = replicate_to
+
+        self._lock = RLock()
+        self._pending = OrderedDict()
+        self._timer = None
+
+        self.elided = 0
+        """Number of writes replaced by a newer write before being flushed"""
+
+        self.written = 0
+        """Number of keys successfully written by flushes"""
+
+        self.flushes = 0
+        """Number of flushes which had pending writes"""
+
+        self.last_error = None
+        """The last exception raised by a time-triggered flush"""
+
+    def __len__(self):
+        return len(self._pending)
+
+    def upsert(self, key, value, ttl=0, format=None):
+        """
+        Buffer a write of `value` to `key`
+        :param key: The key to write
+        :param value: The value to write
+        :param ttl: The expiration for the item
+        :param format: The format for the value
+        :return: The results of the flush if this write triggered one,
+            otherwise None
+        """
+        with self._lock:
+            if key in self._pending:
+                self.elided += 1
+                del self._pending[key]
+            self._pending[key] = (value, ttl, format)
+
+            if len(self._pending) >= self.max_items:
+                return self.flush()
+            self._arm_timer()
+
+    def flush(self, persist_to=None, replicate_to=None):
+        """
+        Write all pending values to the bucket.
+
+        If any write fails, the keys which were not written are returned to
+        the buffer (unless a newer value was buffered in the meantime) and
+        the exception is raised.
+
+        :param persist_to: Persistence requirement for this flush. Defaults
+            to the buffer's setting
+        :param replicate_to: Replication requirement for this flush.
+            Defaults to the buffer's setting
+        :return: A dictionary of keys to their results
+        """
+        if persist_to is None:
+            persist_to = self.persist_to
+        if replicate_to is None:
+            replicate_to = self.replicate_to
+
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+
+            pending, self._pending = self._pending, OrderedDict()
+            if not pending:
+                return {}
+            self.flushes += 1
+
+            groups = OrderedDict()
+            for key, (value, ttl, fmt) in pending.items():
+                groups.setdefault((ttl, fmt), {})[key] = value
+
+            results = {}
+            remaining = list(groups.items())
+            while remaining:
+                (ttl, fmt), kv = remaining[0]
+                try:
+                    mres = self._bucket._execute_multi(
+                        'upsert', kv, ttl=ttl, format=fmt,
+                        persist_to=persist_to, replicate_to=replicate_to)
+                except Exception as e:
+                    self._requeue(pending, e, remaining)
+                    raise
+                results.update(mres)
+                self.written += len(kv)
+                remaining.pop(0)
+
+            return results
+
+    def close(self):
+        """
+        Flush any pending writes and stop the flush timer
+        """
+        self.flush()
+
+    def stats(self):
+        """
+        :return: A dictionary of buffer statistics
+        """
+        return {
+            'pending': len(self._pending),
+            'elided': self.elided,
+            'written': self.written,
+            'flushes': self.flushes
+        }
+
+    def _requeue(self, pending, exc, remaining):
+        """
+        Return the keys which were not written to the buffer
+        :param pending: The writes being flushed
+        :param exc: The exception raised for the first remaining group
+        :param remaining: The groups which were not (fully) written
+        """
+        all_results = getattr(exc, 'all_results', None)
+        failed = []
+        (_, kv), rest = remaining[0], remaining[1:]
+        for key in kv:
+            result = all_results.get(key) if all_results else None
+            if result is None or result.rc:
+                failed.append(key)
+            else:
+                self.written += 1
+        for _, kv in rest:
+            failed.extend(kv)
+
+        for key in failed:
+            if key not in self._pending:
+                self._pending[key] = pending[key]
+        self._arm_timer()
+
+    def _arm_timer(self):
+        if self.max_delay and self._timer is None and self._pending:
+            timer = self._timer = Timer(self.max_delay, self._timer_flush)
+            timer.args = (timer,)
+            timer.daemon = True
+            timer.start()
+
+    def _timer_flush(self, timer):
+        with self._lock:
+            if timer is not self._timer:
+                # Cancelled (and possibly replaced) while waiting for the
+                # lock
+                return
+            self._timer = None
+            try:
+                self.flush()
+            except Exception:
+                self.last_error = sys.exc_info()[1]
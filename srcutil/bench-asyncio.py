@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+"""
+Compare the throughput of the asyncio bucket with the synchronous bucket.
+
+The synchronous bucket upserts and gets the keys one at a time, while the
+asyncio bucket keeps a number of them in flight at once, all coroutines
+sharing its single connection. Configurations are interleaved over several
+rounds and the best round of each is reported.
+
+Run against CouchbaseMock (started from its JAR) or an existing cluster:
+
+    srcutil/bench-asyncio.py --mock CouchbaseMock.jar
+    srcutil/bench-asyncio.py --connstr couchbase://localhost/default -c 100
+"""
+from __future__ import print_function
+
+import argparse
+import asyncio
+import time
+
+import couchbase_ffi
+from couchbase.bucket import Bucket
+from couchbase_ffi.aio import AsyncBucket
+
+from benchutil import add_cluster_args, best_of, cluster
+
+
+def run_sync(cb, keys):
+    for key in keys:
+        cb.upsert(key, key)
+        cb.get(key)
+
+
+def run_async(loop, cb, keys, concurrency):
+    for pos in range(0, len(keys), concurrency):
+        wave = keys[pos:pos + concurrency]
+        loop.run_until_complete(asyncio.gather(
+            *[cb.upsert(key, key) for key in wave]))
+        loop.run_until_complete(asyncio.gather(
+            *[cb.get(key) for key in wave]))
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    add_cluster_args(ap)
+    ap.add_argument('-n', '--keys', type=int, default=10000,
+                    help='Number of keys per round (default: %(default)s)')
+    ap.add_argument('-c', '--concurrency', type=int, default=1000,
+                    help='Operations in flight in the asyncio bucket '
+                         '(default: %(default)s)')
+    ap.add_argument('-r', '--rounds', type=int, default=5,
+                    help='Rounds per configuration (default: %(default)s)')
+    options = ap.parse_args()
+
+    loop = asyncio.new_event_loop()
+    keys = ['bench-asyncio-{0}'.format(n) for n in range(options.keys)]
+
+    with cluster(ap, options) as (connstr, _):
+        sync_cb = Bucket(connstr, password=options.password)
+        async_cb = AsyncBucket(connstr, password=options.password, loop=loop)
+        loop.run_until_complete(async_cb.connect())
+
+        workloads = {
+            'sync': lambda: run_sync(sync_cb, keys),
+            'asyncio': lambda: run_async(loop, async_cb, keys,
+                                         options.concurrency)
+        }
+
+        def run(name):
+            t_start = time.time()
+            workloads[name]()
+            return time.time() - t_start
+
+        # Warm up the connections and the server
+        for name in workloads:
+            run(name)
+        best = best_of(options.rounds, ['sync', 'asyncio'], run)
+
+    nops = options.keys * 2
+    print('{0} operations per round, {1} in flight with asyncio, '
+          'best of {2} rounds'.format(nops, options.concurrency,
+                                      options.rounds))
+    print('{0:<16}{1:>12}{2:>10}'.format('Bucket', 'Ops/sec', 'Speedup'))
+    for name in ('sync', 'asyncio'):
+        print('{0:<16}{1:>12.0f}{2:>9.2f}x'.format(
+            name, nops / best[name], best['sync'] / best[name]))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+"""
+Measure the coalescing of concurrent gets of the same keys.
+
+Waves of concurrent gets are issued through an asyncio bucket, their keys
+drawn from a zipfian distribution so that a few hot keys are requested by
+many callers at once. The same waves are run with and without
+``coalesce_gets``, interleaved over several rounds, and the best round of
+each is reported along with the number of gets actually sent.
+
+Run against CouchbaseMock (started from its JAR) or an existing cluster:
+
+    srcutil/bench-coalesce.py --mock CouchbaseMock.jar
+    srcutil/bench-coalesce.py --connstr couchbase://localhost/default -s 1.2
+"""
+from __future__ import print_function
+
+import argparse
+import asyncio
+import bisect
+import random
+import time
+
+import couchbase_ffi
+from couchbase_ffi.aio import AsyncBucket
+
+from benchutil import add_cluster_args, best_of, cluster
+
+CONFIGURATIONS = (
+    ('plain', False),
+    ('coalesced', True)
+)
+
+
+def zipf_keys(nkeys, skew, count, seed=0):
+    """
+    Draw keys, the probability of the `k`-th key being proportional to
+    ``1 / k ** skew``
+    :param nkeys: The number of distinct keys
+    :param skew: The exponent of the distribution
+    :param count: The number of keys to draw
+    :param seed: The seed of the generator, so every round draws alike
+    :return: The list of keys
+    """
+    rand = random.Random(seed)
+    cumulative = []
+    total = 0.0
+    for k in range(1, nkeys + 1):
+        total += 1.0 / k ** skew
+        cumulative.append(total)
+    return ['bench-coalesce-{0}'.format(
+        bisect.bisect_left(cumulative, rand.random() * total))
+        for _ in range(count)]
+
+
+def run_waves(loop, cb, keys, concurrency):
+    for pos in range(0, len(keys), concurrency):
+        loop.run_until_complete(asyncio.gather(
+            *[cb.get(key) for key in keys[pos:pos + concurrency]]))
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    add_cluster_args(ap)
+    ap.add_argument('-k', '--keys', type=int, default=1000,
+                    help='Number of distinct keys (default: %(default)s)')
+    ap.add_argument('-s', '--skew', type=float, default=1.0,
+                    help='Exponent of the zipfian distribution '
+                         '(default: %(default)s)')
+    ap.add_argument('-n', '--gets', type=int, default=20000,
+                    help='Number of gets per round (default: %(default)s)')
+    ap.add_argument('-c', '--concurrency', type=int, default=500,
+                    help='Gets issued at once (default: %(default)s)')
+    ap.add_argument('-r', '--rounds', type=int, default=5,
+                    help='Rounds per configuration (default: %(default)s)')
+    options = ap.parse_args()
+
+    loop = asyncio.new_event_loop()
+    keys = zipf_keys(options.keys, options.skew, options.gets)
+    sent = {}
+
+    with cluster(ap, options) as (connstr, _):
+        cb = AsyncBucket(connstr, password=options.password, loop=loop)
+        loop.run_until_complete(cb.connect())
+        loop.run_until_complete(cb.upsert_multi(dict(
+            ('bench-coalesce-{0}'.format(k), k)
+            for k in range(options.keys))))
+        # Warm up the connections and the server
+        run_waves(loop, cb, keys, options.concurrency)
+
+        settings = dict(CONFIGURATIONS)
+
+        def run(name):
+            cb.coalesce_gets = settings[name]
+            coalesced = cb.coalesced_count
+            t_start = time.time()
+            run_waves(loop, cb, keys, options.concurrency)
+            elapsed = time.time() - t_start
+            sent[name] = len(keys) - (cb.coalesced_count - coalesced)
+            return elapsed
+
+        best = best_of(options.rounds, [c[0] for c in CONFIGURATIONS], run)
+
+    print('{0} gets per round of {1} keys (skew {2}), {3} at once, '
+          'best of {4} rounds'.format(options.gets, options.keys,
+                                      options.skew, options.concurrency,
+                                      options.rounds))
+    print('{0:<16}{1:>12}{2:>12}'.format('Configuration', 'Gets/sec', 'Sent'))
+    for name, _ in CONFIGURATIONS:
+        print('{0:<16}{1:>12.0f}{2:>12}'.format(
+            name, options.gets / best[name], sent[name]))
+
+
+if __name__ == '__main__':
+    main()
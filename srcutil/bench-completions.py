@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+"""
+Measure batched delivery of asynchronous completions.
+
+Waves of concurrent gets (10000 at once by default) are issued through an
+asyncio bucket, whose futures are resolved either as each result completes
+or by a single callback per loop iteration (``batch_completions``).
+Configurations are interleaved over several rounds and the best round of
+each is reported.
+
+Run against CouchbaseMock (started from its JAR) or an existing cluster:
+
+    srcutil/bench-completions.py --mock CouchbaseMock.jar
+    srcutil/bench-completions.py --connstr couchbase://localhost/default
+"""
+from __future__ import print_function
+
+import argparse
+import asyncio
+import time
+
+import couchbase_ffi
+from couchbase_ffi.aio import AsyncBucket
+from couchbase_ffi.completions import CompletionBatcher
+
+from benchutil import add_cluster_args, best_of, cluster
+
+
+def run_waves(loop, cb, keys, concurrency):
+    for pos in range(0, len(keys), concurrency):
+        loop.run_until_complete(asyncio.gather(
+            *[cb.get(key) for key in keys[pos:pos + concurrency]]))
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    add_cluster_args(ap)
+    ap.add_argument('-n', '--gets', type=int, default=50000,
+                    help='Number of gets per round (default: %(default)s)')
+    ap.add_argument('-c', '--concurrency', type=int, default=10000,
+                    help='Gets issued at once (default: %(default)s)')
+    ap.add_argument('-r', '--rounds', type=int, default=5,
+                    help='Rounds per configuration (default: %(default)s)')
+    options = ap.parse_args()
+
+    loop = asyncio.new_event_loop()
+    nkeys = min(options.gets, options.concurrency)
+    keys = ['bench-completions-{0}'.format(n % nkeys)
+            for n in range(options.gets)]
+
+    with cluster(ap, options) as (connstr, _):
+        cb = AsyncBucket(connstr, password=options.password, loop=loop)
+        loop.run_until_complete(cb.connect())
+        loop.run_until_complete(cb.upsert_multi(dict(
+            (key, key) for key in keys[:nkeys])))
+
+        batchers = {
+            'per result': None,
+            'batched': CompletionBatcher(loop.call_soon)
+        }
+
+        def run(name):
+            cb.completion_batcher = batchers[name]
+            t_start = time.time()
+            run_waves(loop, cb, keys, options.concurrency)
+            return time.time() - t_start
+
+        # Warm up the connections and the server
+        run_waves(loop, cb, keys, options.concurrency)
+        best = best_of(options.rounds, ['per result', 'batched'], run)
+
+    print('{0} gets per round, {1} at once, best of {2} rounds'.format(
+        options.gets, options.concurrency, options.rounds))
+    print('{0:<16}{1:>12}{2:>14}'.format('Delivery', 'Gets/sec', 'Cost/get'))
+    for name in ('per result', 'batched'):
+        print('{0:<16}{1:>12.0f}{2:>11.2f} us'.format(
+            name, options.gets / best[name],
+            best[name] / options.gets * 1000000))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+"""
+Measure the cost of per-key failures in multi-key gets.
+
+Batches of gets are run where every key exists, and where a fraction of the
+keys is missing, either with ``quiet`` (the misses are only flagged in
+their results) or without it (the operation raises, and the exception is
+caught). Configurations are interleaved over several rounds and the best
+round of each is reported, along with the extra time per missing key.
+
+Run against CouchbaseMock (started from its JAR) or an existing cluster:
+
+    srcutil/bench-errors.py --mock CouchbaseMock.jar
+    srcutil/bench-errors.py --connstr couchbase://localhost/default -m 1
+"""
+from __future__ import print_function
+
+import argparse
+import time
+
+import couchbase_ffi
+from couchbase.bucket import Bucket
+from couchbase.exceptions import NotFoundError
+
+from benchutil import add_cluster_args, best_of, cluster
+
+CONFIGURATIONS = (
+    ('hits', False, False),
+    ('misses, quiet', True, True),
+    ('misses, raised', True, False)
+)
+
+
+def run_workload(cb, batches, quiet):
+    for keys in batches:
+        try:
+            cb.get_multi(keys, quiet=quiet)
+        except NotFoundError:
+            pass
+
+
+def make_batches(keys, batch):
+    return [keys[pos:pos + batch] for pos in range(0, len(keys), batch)]
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    add_cluster_args(ap)
+    ap.add_argument('-n', '--keys', type=int, default=10000,
+                    help='Number of keys per round (default: %(default)s)')
+    ap.add_argument('-b', '--batch', type=int, default=100,
+                    help='Keys per operation (default: %(default)s)')
+    ap.add_argument('-m', '--misses', type=float, default=0.5,
+                    help='Fraction of missing keys (default: %(default)s)')
+    ap.add_argument('-r', '--rounds', type=int, default=5,
+                    help='Rounds per configuration (default: %(default)s)')
+    options = ap.parse_args()
+
+    nmissing = int(options.keys * options.misses)
+    if not nmissing:
+        ap.error('--misses leaves no missing keys')
+    present = ['bench-errors-{0}'.format(n) for n in range(options.keys)]
+    # Every n-th key is replaced by one which is never stored
+    step = float(options.keys) / nmissing
+    mixed = list(present)
+    for n in range(nmissing):
+        pos = int(n * step)
+        mixed[pos] = 'bench-errors-missing-{0}'.format(pos)
+
+    with cluster(ap, options) as (connstr, _):
+        cb = Bucket(connstr, password=options.password)
+        for batch in make_batches(present, 1000):
+            cb.upsert_multi(dict((key, key) for key in batch))
+
+        workloads = {
+            False: make_batches(present, options.batch),
+            True: make_batches(mixed, options.batch)
+        }
+        settings = dict((c[0], c[1:]) for c in CONFIGURATIONS)
+
+        def run(name):
+            missing, quiet = settings[name]
+            t_start = time.time()
+            run_workload(cb, workloads[missing], quiet)
+            return time.time() - t_start
+
+        # Warm up the connections and the server
+        for name, _, _ in CONFIGURATIONS:
+            run(name)
+        best = best_of(options.rounds, [c[0] for c in CONFIGURATIONS], run)
+
+    baseline = best['hits']
+    print('{0} keys per round, {1} per operation, {2} missing, '
+          'best of {3} rounds'.format(options.keys, options.batch, nmissing,
+                                      options.rounds))
+    print('{0:<16}{1:>12}{2:>14}'.format(
+        'Configuration', 'Keys/sec', 'Cost/miss'))
+    for name, _, _ in CONFIGURATIONS:
+        elapsed = best[name]
+        print('{0:<16}{1:>12.0f}{2:>11.2f} us'.format(
+            name, options.keys / elapsed,
+            (elapsed - baseline) / nmissing * 1000000))
+
+
+if __name__ == '__main__':
+    main()
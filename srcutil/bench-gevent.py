@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+"""
+Measure the concurrency of greenlets sharing gevent buckets.
+
+The synchronous bucket upserts and gets the keys one at a time. Then the
+same keys are split between a number of greenlets, which share one or a
+few gevent buckets, each greenlet blocking only itself while it waits.
+Configurations are interleaved over several rounds and the best round of
+each is reported.
+
+Run against CouchbaseMock (started from its JAR) or an existing cluster:
+
+    srcutil/bench-gevent.py --mock CouchbaseMock.jar
+    srcutil/bench-gevent.py --connstr couchbase://localhost/default -g 100
+"""
+from __future__ import print_function
+
+import argparse
+import time
+
+import gevent
+
+import couchbase_ffi
+from couchbase.bucket import Bucket
+from couchbase_ffi.green import GeventBucket
+
+from benchutil import add_cluster_args, best_of, cluster
+
+
+def run_keys(cb, keys):
+    for key in keys:
+        cb.upsert(key, key)
+        cb.get(key)
+
+
+def run_greenlets(buckets, keys, ngreenlets):
+    gevent.joinall([
+        gevent.spawn(run_keys, buckets[n % len(buckets)],
+                     keys[n::ngreenlets])
+        for n in range(ngreenlets)], raise_error=True)
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    add_cluster_args(ap)
+    ap.add_argument('-n', '--keys', type=int, default=10000,
+                    help='Number of keys per round (default: %(default)s)')
+    ap.add_argument('-g', '--greenlets', type=int, default=1000,
+                    help='Number of greenlets (default: %(default)s)')
+    ap.add_argument('-C', '--connections', type=int, nargs='+',
+                    default=[1, 4],
+                    help='Numbers of gevent buckets to compare '
+                         '(default: %(default)s)')
+    ap.add_argument('-r', '--rounds', type=int, default=5,
+                    help='Rounds per configuration (default: %(default)s)')
+    options = ap.parse_args()
+
+    keys = ['bench-gevent-{0}'.format(n) for n in range(options.keys)]
+
+    with cluster(ap, options) as (connstr, _):
+        sync_cb = Bucket(connstr, password=options.password)
+        green_cbs = [GeventBucket(connstr, password=options.password)
+                     for _ in range(max(options.connections))]
+
+        workloads = [('sync', lambda: run_keys(sync_cb, keys))]
+        for count in options.connections:
+            workloads.append((
+                'gevent x{0}'.format(count),
+                lambda count=count: run_greenlets(
+                    green_cbs[:count], keys, options.greenlets)))
+        names = [name for name, _ in workloads]
+        workloads = dict(workloads)
+
+        def run(name):
+            t_start = time.time()
+            workloads[name]()
+            return time.time() - t_start
+
+        # Warm up the connections and the server
+        for name in names:
+            run(name)
+        best = best_of(options.rounds, names, run)
+
+    nops = options.keys * 2
+    print('{0} operations per round, {1} greenlets, best of {2} rounds'.format(
+        nops, options.greenlets, options.rounds))
+    print('{0:<16}{1:>12}{2:>10}'.format('Bucket', 'Ops/sec', 'Speedup'))
+    for name in names:
+        print('{0:<16}{1:>12.0f}{2:>9.2f}x'.format(
+            name, nops / best[name], best['sync'] / best[name]))
+
+
+if __name__ == '__main__':
+    main()
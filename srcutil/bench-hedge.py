@@ -0,0 +1,144 @@
+#!/usr/bin/env python
+"""
+Measure the tail latency of gets with and without hedged reads.
+
+CouchbaseMock is started with four nodes and one replica, and one of the
+nodes periodically stops responding for a while, so that some gets hit a
+slow primary. The same gets are run without hedging, with a fixed hedge
+delay and with the adaptive delay, interleaved over several rounds; the
+latency percentiles of all rounds and the share of gets answered by a
+replica are reported.
+
+Requires the CouchbaseMock JAR:
+
+    srcutil/bench-hedge.py --mock CouchbaseMock.jar
+    srcutil/bench-hedge.py --mock CouchbaseMock.jar --stall 0.2 --period 2
+"""
+from __future__ import print_function
+
+import argparse
+import random
+import threading
+import time
+
+import couchbase_ffi
+from couchbase.bucket import Bucket
+from couchbase_ffi.hedge import HedgePolicy
+from couchbase_ffi.metrics import Histogram, clock
+
+from benchutil import add_cluster_args, best_of, cluster
+
+
+class Staller(threading.Thread):
+    """
+    Periodically stops a node of the mock from responding
+    """
+
+    def __init__(self, control, idx, stall, period):
+        """
+        :param control: The mock's :class:`MockControlClient`
+        :param idx: The index of the node
+        :param stall: How long the node stops responding, in seconds
+        :param period: The interval between the start of two stalls
+        """
+        super(Staller, self).__init__()
+        self.daemon = True
+        self.control = control
+        self.params = {'idx': idx, 'bucket': 'default'}
+        self.stall = stall
+        self.period = period
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.period - self.stall):
+            self.control._get_common('halt', self.params)
+            time.sleep(self.stall)
+            self.control._get_common('resume', self.params)
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+
+def run_workload(cb, keys, hist):
+    for key in keys:
+        t_start = clock()
+        cb.get(key)
+        hist.record((clock() - t_start) * 1000000)
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    add_cluster_args(ap)
+    ap.add_argument('-n', '--gets', type=int, default=10000,
+                    help='Number of gets per round (default: %(default)s)')
+    ap.add_argument('-k', '--keys', type=int, default=1000,
+                    help='Number of distinct keys (default: %(default)s)')
+    ap.add_argument('-d', '--delay', type=float, default=0.005,
+                    help='Fixed hedge delay, in seconds '
+                         '(default: %(default)s)')
+    ap.add_argument('--stall', type=float, default=0.1,
+                    help='Duration of each stall of the node, in seconds '
+                         '(default: %(default)s)')
+    ap.add_argument('--period', type=float, default=1.0,
+                    help='Interval between stalls, in seconds '
+                         '(default: %(default)s)')
+    ap.add_argument('-r', '--rounds', type=int, default=3,
+                    help='Rounds per configuration (default: %(default)s)')
+    options = ap.parse_args()
+
+    if not 0 < options.stall < options.period:
+        ap.error('--stall must be shorter than --period')
+
+    configurations = (
+        ('primary only', None),
+        ('fixed delay', HedgePolicy(delay=options.delay)),
+        ('adaptive delay', HedgePolicy())
+    )
+    settings = dict(configurations)
+    latencies = dict((name, Histogram()) for name, _ in configurations)
+
+    rand = random.Random(0)
+    keys = ['bench-hedge-{0}'.format(rand.randrange(options.keys))
+            for _ in range(options.gets)]
+
+    with cluster(ap, options, mock_only=True) as (connstr, control):
+        cb = Bucket(connstr, password=options.password)
+        cb.upsert_multi(dict(('bench-hedge-{0}'.format(n), n)
+                             for n in range(options.keys)))
+        # Warm up the connections and the server
+        run_workload(cb, keys, Histogram())
+
+        def run(name):
+            cb.hedge_policy = settings[name]
+            t_start = time.time()
+            run_workload(cb, keys, latencies[name])
+            return time.time() - t_start
+
+        staller = Staller(control, 0, options.stall, options.period)
+        staller.start()
+        try:
+            best = best_of(options.rounds, [c[0] for c in configurations],
+                           run)
+        finally:
+            staller.stop()
+
+    print('{0} gets per round, a node stalled for {1}s every {2}s, '
+          '{3} rounds'.format(options.gets, options.stall, options.period,
+                              options.rounds))
+    print('{0:<16}{1:>10}{2:>10}{3:>10}{4:>10}{5:>14}'.format(
+        'Configuration', 'Gets/sec', 'p50 ms', 'p99 ms', 'p999 ms',
+        'Replica wins'))
+    for name, policy in configurations:
+        hist = latencies[name]
+        wins = policy.replica_wins if policy is not None else 0
+        print('{0:<16}{1:>10.0f}{2:>10.2f}{3:>10.2f}{4:>10.2f}{5:>13.1f}%'
+              .format(name, options.gets / best[name],
+                      hist.percentile(50) / 1000.0,
+                      hist.percentile(99) / 1000.0,
+                      hist.percentile(99.9) / 1000.0,
+                      100.0 * wins / (options.gets * options.rounds)))
+
+
+if __name__ == '__main__':
+    main()
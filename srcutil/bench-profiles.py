@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+"""
+Compare tuning profiles.
+
+A bucket is connected for the library's defaults and for each profile.
+Every round runs single-key upserts and gets, timing each one, then the
+same keys in batches, on each bucket in turn. The throughput of the best
+round, the latency percentiles of all rounds, and the time taken to apply
+the profile are reported.
+
+Run against CouchbaseMock (started from its JAR) or an existing cluster:
+
+    srcutil/bench-profiles.py --mock CouchbaseMock.jar
+    srcutil/bench-profiles.py --mock CouchbaseMock.jar \\
+        -p low-latency 'operation_timeout=1.0&tcp_nodelay=0'
+"""
+from __future__ import print_function
+
+import argparse
+import time
+
+import couchbase_ffi
+from couchbase.bucket import Bucket
+from couchbase_ffi.metrics import Histogram, clock
+from couchbase_ffi.profiles import PROFILES
+
+from benchutil import add_cluster_args, best_of, cluster
+
+APPLY_COUNT = 1000
+
+
+def run_single(cb, keys, hist):
+    for key in keys:
+        t_start = clock()
+        cb.upsert(key, key)
+        t_mid = clock()
+        cb.get(key)
+        t_end = clock()
+        hist.record((t_mid - t_start) * 1000000)
+        hist.record((t_end - t_mid) * 1000000)
+
+
+def run_batched(cb, keys, batch):
+    for pos in range(0, len(keys), batch):
+        kv = dict((key, key) for key in keys[pos:pos + batch])
+        cb.upsert_multi(kv)
+        cb.get_multi(kv)
+
+
+def time_apply(cb, profile):
+    """
+    :return: The time taken to apply the profile once, in seconds
+    """
+    t_start = clock()
+    for _ in range(APPLY_COUNT):
+        cb.apply_profile(profile)
+    return (clock() - t_start) / APPLY_COUNT
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    add_cluster_args(ap)
+    ap.add_argument('-p', '--profiles', nargs='+',
+                    default=sorted(PROFILES),
+                    help='Profile names or connection string fragments '
+                         '(default: %(default)s)')
+    ap.add_argument('-n', '--keys', type=int, default=5000,
+                    help='Number of keys per round (default: %(default)s)')
+    ap.add_argument('-b', '--batch', type=int, default=100,
+                    help='Keys per batched operation (default: %(default)s)')
+    ap.add_argument('-r', '--rounds', type=int, default=3,
+                    help='Rounds per profile (default: %(default)s)')
+    options = ap.parse_args()
+
+    names = ['defaults'] + options.profiles
+    latencies = dict((name, Histogram()) for name in names)
+    apply_times = {}
+    keys = ['bench-profiles-{0}'.format(n) for n in range(options.keys)]
+
+    with cluster(ap, options) as (connstr, _):
+        buckets = {}
+        for name in names:
+            cb = buckets[name] = Bucket(connstr, password=options.password)
+            if name != 'defaults':
+                apply_times[name] = time_apply(cb, name)
+            # Warm up the connections and the server
+            run_batched(cb, keys, options.batch)
+
+        def run_single_round(name):
+            t_start = time.time()
+            run_single(buckets[name], keys, latencies[name])
+            return time.time() - t_start
+
+        def run_batched_round(name):
+            t_start = time.time()
+            run_batched(buckets[name], keys, options.batch)
+            return time.time() - t_start
+
+        best_single = best_of(options.rounds, names, run_single_round)
+        best_batched = best_of(options.rounds, names, run_batched_round)
+
+    nops = options.keys * 2
+    print('{0} single-key operations and {1} batches of {2} keys per round, '
+          'best of {3} rounds'.format(nops, nops // options.batch,
+                                      options.batch, options.rounds))
+    print('{0:<20}{1:>10}{2:>10}{3:>10}{4:>12}{5:>12}'.format(
+        'Profile', 'Ops/sec', 'p50 ms', 'p99 ms', 'Keys/sec', 'Apply us'))
+    for name in names:
+        hist = latencies[name]
+        apply_time = apply_times.get(name)
+        print('{0:<20}{1:>10.0f}{2:>10.2f}{3:>10.2f}{4:>12.0f}{5:>12}'.format(
+            name[:19], nops / best_single[name],
+            hist.percentile(50) / 1000.0, hist.percentile(99) / 1000.0,
+            nops / best_batched[name],
+            '-' if apply_time is None
+            else '{0:.1f}'.format(apply_time * 1000000)))
+
+
+if __name__ == '__main__':
+    main()
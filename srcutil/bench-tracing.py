@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+"""
+Measure the cost of tracing hooks.
+
+The same workload of upserts and gets is run without a tracer, with the
+default (no-op) tracer sampling no operations, a tenth of them, and all of
+them. Configurations are interleaved over several rounds and the best
+round of each is reported, so that drift on the server side affects them
+alike.
+
+Run against CouchbaseMock (started from its JAR) or an existing cluster:
+
+    srcutil/bench-tracing.py --mock CouchbaseMock.jar
+    srcutil/bench-tracing.py --connstr couchbase://localhost/default -b 10
+"""
+from __future__ import print_function
+
+import argparse
+import time
+
+import couchbase_ffi
+from couchbase.bucket import Bucket
+from couchbase_ffi.tracing import Tracer
+
+from benchutil import add_cluster_args, best_of, cluster
+
+CONFIGURATIONS = (
+    ('no tracer', None),
+    ('sampled 0%', 0.0),
+    ('sampled 10%', 0.1),
+    ('sampled 100%', 1.0)
+)
+
+
+def run_workload(cb, keys, batch):
+    if batch == 1:
+        for key in keys:
+            cb.upsert(key, key)
+            cb.get(key)
+        return
+
+    for pos in range(0, len(keys), batch):
+        kv = dict((key, key) for key in keys[pos:pos + batch])
+        cb.upsert_multi(kv)
+        cb.get_multi(kv)
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    add_cluster_args(ap)
+    ap.add_argument('-n', '--keys', type=int, default=10000,
+                    help='Number of keys per round (default: %(default)s)')
+    ap.add_argument('-b', '--batch', type=int, default=1,
+                    help='Keys per operation (default: %(default)s)')
+    ap.add_argument('-r', '--rounds', type=int, default=5,
+                    help='Rounds per configuration (default: %(default)s)')
+    options = ap.parse_args()
+
+    tracers = dict((name, None if rate is None else Tracer(rate))
+                   for name, rate in CONFIGURATIONS)
+
+    with cluster(ap, options) as (connstr, _):
+        cb = Bucket(connstr, password=options.password)
+        keys = ['bench-tracing-{0}'.format(n) for n in range(options.keys)]
+        # Warm up the connections and the server
+        run_workload(cb, keys, options.batch)
+
+        def run(name):
+            cb.tracer = tracers[name]
+            t_start = time.time()
+            run_workload(cb, keys, options.batch)
+            return time.time() - t_start
+
+        best = best_of(options.rounds, [c[0] for c in CONFIGURATIONS], run)
+
+    nops = options.keys * 2 // options.batch
+    baseline = best['no tracer']
+    print('{0} operations per round, {1} keys each, best of {2} rounds'.format(
+        nops, options.batch, options.rounds))
+    print('{0:<16}{1:>12}{2:>14}'.format(
+        'Configuration', 'Ops/sec', 'Overhead/op'))
+    for name, _ in CONFIGURATIONS:
+        elapsed = best[name]
+        print('{0:<16}{1:>12.0f}{2:>11.2f} us'.format(
+            name, nops / elapsed, (elapsed - baseline) / nops * 1000000))
+
+
+if __name__ == '__main__':
+    main()
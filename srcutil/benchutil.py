@@ -0,0 +1,68 @@
+"""
+Helpers shared by the benchmark scripts in this directory
+"""
+from contextlib import contextmanager
+
+import couchbase_ffi
+from couchbase.mockserver import BucketSpec, CouchbaseMock, MockControlClient
+
+
+def add_cluster_args(ap):
+    """
+    Add the options selecting the cluster to run against
+    :param ap: The :class:`argparse.ArgumentParser`
+    """
+    ap.add_argument('--mock', metavar='JAR',
+                    help='Path of the CouchbaseMock JAR to start')
+    ap.add_argument('--mock-url',
+                    help='URL to download the JAR from, if it is missing')
+    ap.add_argument('--connstr',
+                    help='Connection string of an existing cluster')
+    ap.add_argument('--password', default=None, help='Bucket password')
+
+
+@contextmanager
+def cluster(ap, options, mock_only=False):
+    """
+    Start CouchbaseMock if requested, and stop it once done
+    :param ap: The :class:`argparse.ArgumentParser`, to report errors
+    :param options: The parsed options
+    :param mock_only: Whether the benchmark needs the mock
+    :return: A context yielding the connection string, and a
+        :class:`MockControlClient` (or None for an existing cluster)
+    """
+    if options.mock:
+        mock = CouchbaseMock([BucketSpec('default', 'couchbase')],
+                             options.mock, options.mock_url, replicas=1,
+                             nodes=4)
+        mock.start()
+        try:
+            yield ('http://127.0.0.1:{0}/default'.format(mock.rest_port),
+                   MockControlClient(mock.rest_port))
+        finally:
+            mock.stop()
+    elif mock_only:
+        ap.error('--mock is required')
+    elif options.connstr:
+        yield options.connstr, None
+    else:
+        ap.error('One of --mock or --connstr is required')
+
+
+def best_of(rounds, names, run):
+    """
+    Run each configuration several times, interleaved so that drift on the
+    server side affects them alike
+    :param rounds: The number of rounds
+    :param names: The names of the configurations
+    :param run: Called with a configuration's name, and returns the time
+        the round took
+    :return: A dictionary of each configuration's best time
+    """
+    best = {}
+    for _ in range(rounds):
+        for name in names:
+            elapsed = run(name)
+            best[name] = min(best.get(name, elapsed), elapsed)
+    return best
+
@@ -0,0 +1,161 @@
+import threading
+import unittest
+
+import couchbase_ffi
+from couchbase.exceptions import (
+    CouchbaseError, NotFoundError, TemporaryFailError)
+from couchbase_ffi.batcher import AutoBatcher, _Request
+from couchbase_ffi.constants import LCB_ETMPFAIL, LCB_KEY_ENOENT
+from couchbase_ffi.result import ValueResult
+
+
+class _Bucket(object):
+    # Stores and reads `values`; keys in `failing` fail temporarily
+    quiet = False
+
+    def __init__(self):
+        self.calls = []
+        self.values = {}
+        self.failing = set()
+        self.broken = False
+
+    def _result(self, key, rc, value=None):
+        result = ValueResult()
+        result.key = key
+        result.rc = rc
+        result.value = value
+        return result
+
+    def _execute_multi(self, name, kv, **kwargs):
+        self.calls.append((name, sorted(kv) if name == 'get' else dict(kv),
+                           kwargs))
+        if self.broken:
+            raise ValueError('Cannot encode')
+        results = {}
+        for key in kv:
+            if key in self.failing:
+                results[key] = self._result(key, LCB_ETMPFAIL)
+            elif name == 'upsert':
+                self.values[key] = kv[key]
+                results[key] = self._result(key, 0)
+            elif key in self.values:
+                results[key] = self._result(key, 0, self.values[key])
+            else:
+                results[key] = self._result(key, LCB_KEY_ENOENT)
+        if self.failing & set(kv):
+            exc = CouchbaseError('Operation failed')
+            exc.all_results = results
+            raise exc
+        return results
+
+
+def _get(key, quiet=False):
+    return _Request('get', key, None, quiet)
+
+
+def _upsert(key, value):
+    return _Request('upsert', key, value, False)
+
+
+class AutoBatcherTest(unittest.TestCase):
+    def setUp(self):
+        self.bucket = _Bucket()
+        self.bucket.values['a'] = 'A'
+
+    def make_batcher(self, **kwargs):
+        batcher = AutoBatcher(self.bucket, **kwargs)
+        self.addCleanup(batcher.close)
+        return batcher
+
+    def call_from_threads(self, calls):
+        # Runs each call in a thread of its own
+        results = [None] * len(calls)
+
+        def run(ix):
+            results[ix] = calls[ix]()
+
+        threads = [threading.Thread(target=run, args=(ix,))
+                   for ix in range(len(calls))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(5)
+            self.assertFalse(thread.is_alive())
+        return results
+
+    def test_per_caller_results(self):
+        batcher = self.make_batcher()
+        reqs = [_get('a'), _get('missing'), _get('missing', quiet=True),
+                _upsert('b', 'B')]
+        batcher._dispatch(reqs)
+        self.assertEqual([('get', ['a', 'missing'], {'quiet': True}),
+                          ('upsert', {'b': 'B'}, {})], self.bucket.calls)
+
+        self.assertEqual('A', reqs[0].result.value)
+        self.assertIs(reqs[1].exc_info[0], NotFoundError)
+        self.assertEqual('missing', reqs[1].exc_info[1].key)
+        self.assertEqual(LCB_KEY_ENOENT, reqs[2].result.rc)
+        self.assertIsNone(reqs[2].exc_info)
+        self.assertTrue(reqs[3].result.success)
+        self.assertTrue(all(req.done.is_set() for req in reqs))
+
+    def test_shared_gets(self):
+        batcher = self.make_batcher()
+        reqs = [_get('a'), _get('a', quiet=True)]
+        batcher._dispatch(reqs)
+        self.assertEqual([('get', ['a'], {'quiet': True})],
+                         self.bucket.calls)
+        self.assertIs(reqs[0].result, reqs[1].result)
+
+    def test_duplicate_upserts_rounds(self):
+        batcher = self.make_batcher()
+        reqs = [_upsert('a', 1), _upsert('a', 2), _upsert('b', 1),
+                _upsert('a', 3)]
+        batcher._dispatch(reqs)
+        self.assertEqual([{'a': 1, 'b': 1}, {'a': 2}, {'a': 3}],
+                         [kv for _, kv, _ in self.bucket.calls])
+        self.assertEqual(3, self.bucket.values['a'])
+
+    def test_failed_keys(self):
+        batcher = self.make_batcher()
+        self.bucket.failing.add('b')
+        reqs = [_upsert('a', 1), _upsert('b', 1)]
+        batcher._dispatch(reqs)
+        self.assertTrue(reqs[0].result.success)
+        self.assertIs(reqs[1].exc_info[0], TemporaryFailError)
+
+        # Without results, every caller gets the exception
+        self.bucket.broken = True
+        reqs = [_get('a'), _upsert('a', 1)]
+        batcher._dispatch(reqs)
+        for req in reqs:
+            self.assertIs(ValueError, req.exc_info[0])
+
+    def test_exceptions_raised_to_callers(self):
+        batcher = self.make_batcher(max_delay=0)
+        self.assertEqual('A', batcher.get('a').value)
+        self.assertRaises(NotFoundError, batcher.get, 'missing')
+        self.assertFalse(batcher.get('missing', quiet=True).success)
+
+    def test_max_ops(self):
+        # Only a full batch is submitted before the delay
+        batcher = self.make_batcher(max_ops=2, max_delay=60)
+        results = self.call_from_threads([
+            lambda: batcher.get('a'), lambda: batcher.upsert('b', 'B')])
+        self.assertEqual('A', results[0].value)
+        self.assertTrue(results[1].success)
+        self.assertEqual(1, batcher.batch_sizes.count)
+        self.assertEqual(2, batcher.batch_sizes.percentile(100))
+
+    def test_max_delay(self):
+        batcher = self.make_batcher(max_ops=100, max_delay=0.01)
+        results = self.call_from_threads([
+            lambda: batcher.get('a'), lambda: batcher.get('a')])
+        self.assertEqual(['A', 'A'], [r.value for r in results])
+        self.assertEqual(len(self.bucket.calls), batcher.batch_sizes.count)
+        self.assertGreaterEqual(batcher.added_latency.percentile(100), 10000)
+
+    def test_closed(self):
+        batcher = AutoBatcher(self.bucket)
+        batcher.close()
+        self.assertRaises(CouchbaseError, batcher.get, 'a')
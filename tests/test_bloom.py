@@ -0,0 +1,70 @@
+import unittest
+
+from couchbase_ffi.bloom import BloomFilter
+from couchbase_ffi.bucket import Bucket
+from couchbase_ffi.executors import GetExecutor
+
+from tests.util import make_unconnected
+
+
+class _LowerTranscoder(object):
+    def encode_key(self, key):
+        return key.lower().encode('utf-8')
+
+
+class _EndOpBucket(Bucket):
+    # Records the operations which were ended
+    def _end_op(self, mres, rc=0):
+        self.ended.append(mres)
+        super(_EndOpBucket, self)._end_op(mres, rc)
+
+
+class BloomFilterTest(unittest.TestCase):
+    def test_transcoder_encodes_keys(self):
+        bf = BloomFilter(100, transcoder=_LowerTranscoder())
+        bf.add('Key')
+        self.assertIn('KEY', bf)
+        self.assertTrue(bf.check(b'key'))
+        self.assertEqual(0, bf.skipped)
+
+    def test_no_false_negatives(self):
+        keys = ['key%d' % n for n in range(1000)]
+        bf = BloomFilter.from_keys(keys, transcoder=_LowerTranscoder())
+        for key in keys:
+            self.assertIn(key, bf)
+
+    def test_false_positive_rate(self):
+        tc = _LowerTranscoder()
+        bf = BloomFilter.from_keys(['key%d' % n for n in range(1000)],
+                                   error_rate=0.01, transcoder=tc)
+        absent = ['other%d' % n for n in range(10000)]
+        passed = sum(1 for key in absent if bf.check(tc.encode_key(key)))
+        self.assertLess(passed, 300)
+        self.assertEqual(len(absent) - passed, bf.skipped)
+
+        bf.false_positives = passed
+        stats = bf.stats()
+        self.assertEqual(bf.skipped, stats['saved_round_trips'])
+        self.assertAlmostEqual(passed / 10000.0,
+                               stats['false_positive_rate'])
+
+    def test_sizing(self):
+        bf = BloomFilter(1000, error_rate=0.01)
+        # About 9.6 bits and 7 hashes per key
+        self.assertEqual(9586, bf.nbits)
+        self.assertEqual(7, bf.nhashes)
+        self.assertEqual(0.0, bf.false_positive_rate)
+        self.assertRaises(ValueError, BloomFilter, 0)
+        self.assertRaises(ValueError, BloomFilter, 10, error_rate=1)
+
+    def test_local_get_ends_operation(self):
+        cb = make_unconnected(_EndOpBucket)
+        cb._lcbh = None
+        cb.ended = []
+        cb._executors['get'] = GetExecutor(cb)
+        cb.key_filter = BloomFilter(100, transcoder=_LowerTranscoder())
+
+        rv = cb.get('missing', quiet=True)
+        self.assertFalse(rv.success)
+        self.assertEqual(1, len(cb.ended))
+        self.assertEqual(1, cb.key_filter.skipped)
@@ -0,0 +1,194 @@
+import time
+import unittest
+
+from couchbase_ffi.bloom import BloomFilter
+from couchbase_ffi.bucket import Bucket, ffi
+from couchbase_ffi.breaker import (
+    CircuitBreaker, CircuitOpenError, TooManyInFlightError)
+from couchbase_ffi.constants import (
+    LCB_ETMPFAIL, LCB_KEY_ENOENT, LCB_NETWORK_ERROR)
+from couchbase_ffi.executors import GetExecutor
+from couchbase_ffi.result import MultiResult, OperationResult
+
+from tests.util import make_unconnected
+
+
+class _FailingExecutor(object):
+    OPNAME = 'upsert'
+
+    def execute(self, kv, **kwargs):
+        raise ValueError('Cannot encode')
+
+
+class _MappedBucket(Bucket):
+    # The "pointer" to each key is the index of the server owning it
+    def _vbmap_c(self, c_key, c_len):
+        return 0, c_key
+
+
+class _KeyMappedBucket(Bucket):
+    # Keys are owned by the server named by their first character
+    def _vbmap_c(self, c_key, c_len):
+        return 0, int(ffi.buffer(c_key, c_len)[0:1])
+
+
+class _Transcoder(object):
+    def encode_key(self, key):
+        return key.encode('utf-8')
+
+
+class CircuitBreakerTest(unittest.TestCase):
+    def setUp(self):
+        self.cb = make_unconnected()
+        self.breaker = CircuitBreaker(min_requests=2, reset_timeout=60)
+        self.cb.circuit_breaker = self.breaker
+
+    def trip(self):
+        for _ in range(2):
+            self.breaker.record(self.cb, LCB_NETWORK_ERROR, None, 0)
+        self.assertEqual('open', self.breaker.stats()['state'])
+
+    def wait_reset(self):
+        self.breaker._circuit.opened_at -= self.breaker.reset_timeout
+
+    def state(self):
+        return self.breaker.stats()['state']
+
+    def test_opens_at_failure_ratio(self):
+        self.breaker.min_requests = 4
+        for rc in (0, LCB_NETWORK_ERROR, LCB_KEY_ENOENT):
+            self.breaker.record(self.cb, rc, None, 0)
+        # Too few requests yet; missing keys are not failures
+        self.assertEqual('closed', self.state())
+        self.breaker.record(self.cb, LCB_NETWORK_ERROR, None, 0)
+        self.assertEqual('open', self.state())
+        self.assertRaises(CircuitOpenError, self.breaker.admit, self.cb)
+        self.assertEqual(1, self.breaker.stats()['rejected'])
+
+    def test_window_reset(self):
+        self.breaker.record(self.cb, LCB_NETWORK_ERROR, None, 0)
+        self.breaker._circuit.window_start -= self.breaker.window + 1
+        self.breaker.record(self.cb, LCB_NETWORK_ERROR, None, 0)
+        self.assertEqual('closed', self.state())
+
+    def test_half_open_probe_closes(self):
+        self.trip()
+        self.wait_reset()
+        self.breaker.admit(self.cb)
+        self.assertEqual('half_open', self.state())
+        self.assertRaises(CircuitOpenError, self.breaker.admit, self.cb)
+        self.breaker.record(self.cb, 0, None, 0)
+        self.assertEqual('closed', self.state())
+        self.breaker.admit(self.cb)
+
+    def test_half_open_probe_reopens(self):
+        self.trip()
+        self.wait_reset()
+        self.breaker.admit(self.cb)
+        self.breaker.record(self.cb, LCB_NETWORK_ERROR, None, 0)
+        self.assertEqual('open', self.state())
+        self.assertRaises(CircuitOpenError, self.breaker.admit, self.cb)
+
+    def test_max_in_flight(self):
+        self.breaker.max_in_flight = 1
+        self.cb._handles.add(MultiResult())
+        self.assertRaises(TooManyInFlightError, self.breaker.admit, self.cb)
+        self.assertEqual(1, self.breaker.stats()['shed'])
+
+    def test_probe_released_on_schedule_failure(self):
+        self.trip()
+        self.wait_reset()
+        self.cb._executors['upsert'] = _FailingExecutor()
+        self.assertRaises(ValueError, self.cb.upsert, 'k', 'v')
+        self.assertEqual('half_open', self.breaker.stats()['state'])
+
+        # The failed operation did not use up the probe
+        self.breaker.admit(self.cb)
+        self.assertRaises(CircuitOpenError, self.breaker.admit, self.cb)
+
+    def test_server_probe_per_operation(self):
+        self.cb = make_unconnected(_MappedBucket)
+        self.cb.circuit_breaker = self.breaker
+        self.breaker.per_server = True
+        for _ in range(8):
+            self.breaker.record(self.cb, 0, 2, 0)
+        for _ in range(2):
+            self.breaker.record(self.cb, LCB_NETWORK_ERROR, 1, 0)
+        self.assertEqual('closed', self.breaker.stats()['state'])
+        self.breaker._servers[1].opened_at -= self.breaker.reset_timeout
+
+        # Keys owned by the half-open server share its probe
+        mres = MultiResult()
+        self.breaker.admit(self.cb)
+        for key, server in (('a', 1), ('b', 1), ('c', 2)):
+            result = mres[key] = OperationResult()
+            result.key = key
+            self.assertTrue(
+                self.breaker.admit_key(self.cb, server, 0, result, mres))
+        self.assertTrue(mres.all_ok)
+
+        # The next operation is rejected for that server only
+        mres = MultiResult()
+        self.breaker.admit(self.cb)
+        for key, server, admitted in (('a', 1, False), ('c', 2, True)):
+            result = mres[key] = OperationResult()
+            result.key = key
+            self.assertEqual(admitted, self.breaker.admit_key(
+                self.cb, server, 0, result, mres))
+        self.assertEqual(LCB_ETMPFAIL, mres['a'].rc)
+        self.assertRaises(CircuitOpenError, mres._maybe_throw)
+
+    def setup_servers(self):
+        self.cb = make_unconnected(_KeyMappedBucket)
+        self.cb._lcbh = None
+        self.cb._executors['get'] = GetExecutor(self.cb)
+        self.cb.circuit_breaker = self.breaker
+        self.breaker.per_server = True
+
+    def open_server(self, ix, reset=False):
+        circuit = self.breaker._server_circuit(ix, time.time())
+        circuit.state = 'open'
+        circuit.opened_at = time.time()
+        if reset:
+            circuit.opened_at -= self.breaker.reset_timeout
+
+    def test_probe_released_when_all_keys_rejected(self):
+        self.trip()
+        self.wait_reset()
+        self.setup_servers()
+        self.open_server(1)
+        self.assertRaises(CircuitOpenError, self.cb.get_multi, ['1a', '1b'])
+        self.assertEqual('half_open', self.state())
+
+        # No result will arrive for the bucket's probe
+        self.breaker.admit(self.cb)
+        self.assertRaises(CircuitOpenError, self.breaker.admit, self.cb)
+
+    def test_probe_released_when_all_keys_local(self):
+        self.cb._lcbh = None
+        self.cb._executors['get'] = GetExecutor(self.cb)
+        self.cb.key_filter = BloomFilter(10, transcoder=_Transcoder())
+        self.trip()
+        self.wait_reset()
+        self.assertFalse(self.cb.get('k', quiet=True).success)
+        self.assertEqual('half_open', self.state())
+
+        self.breaker.admit(self.cb)
+        self.assertRaises(CircuitOpenError, self.breaker.admit, self.cb)
+
+    def test_local_key_not_a_server_probe(self):
+        self.setup_servers()
+        self.cb.key_filter = BloomFilter(10, transcoder=_Transcoder())
+        self.open_server(1, reset=True)
+        self.assertFalse(self.cb.get('1a', quiet=True).success)
+        self.assertEqual({1: 'open'}, self.breaker.stats()['servers'])
+
+        # The server's probe is still available
+        mres = MultiResult()
+        result = mres['1b'] = OperationResult()
+        result.key = '1b'
+        self.breaker.admit(self.cb)
+        self.assertTrue(
+            self.breaker.admit_key(self.cb, ffi.new('char[]', b'1b'), 2,
+                                   result, mres))
+        self.assertEqual({1: 'half_open'}, self.breaker.stats()['servers'])
@@ -0,0 +1,112 @@
+import unittest
+
+from couchbase_ffi.bucket import Bucket
+from couchbase_ffi.completions import CompletionBatcher
+from couchbase_ffi.executors import GetExecutor
+from couchbase_ffi.ratelimit import AIMDController, RateLimiter
+from couchbase_ffi.result import AsyncResult, ValueResult
+
+from tests.util import make_unconnected
+
+
+class CoalesceTest(unittest.TestCase):
+    def setUp(self):
+        self.cb = make_unconnected(is_async=True)
+        self.cb.coalesce_gets = True
+
+    def start_get(self, key):
+        # Stands in for a get which was scheduled and is awaiting its
+        # response
+        primary = AsyncResult()
+        primary._coalesce_key = self.cb._get_coalesce_key(key, {})
+        primary.set_callbacks(lambda _: None, None)
+        self.cb._inflight_gets[primary._coalesce_key] = primary
+        return primary
+
+    def finish_get(self, primary, key, value):
+        result = ValueResult()
+        result.key = key
+        result.value = value
+        result.rc = 0
+        primary[key] = result
+        self.cb._deliver(primary)
+
+    def test_follower(self):
+        primary = self.start_get('k')
+        follower = self.cb.get('k')
+        self.assertIsNot(primary, follower)
+        self.assertEqual(1, self.cb.coalesced_count)
+
+        values = []
+        follower.set_callbacks(lambda r: values.append(r.value), None)
+        self.finish_get(primary, 'k', 'v')
+        self.assertEqual(['v'], values)
+        self.assertFalse(self.cb._inflight_gets)
+
+    def test_deadline_not_coalesced(self):
+        self.assertIsNone(self.cb._get_coalesce_key('k', {'deadline': 1}))
+        self.assertIsNotNone(self.cb._get_coalesce_key('k', {}))
+
+    def test_follower_batched(self):
+        batches = []
+        self.cb.completion_batcher = CompletionBatcher(
+            batch_callback=batches.append)
+        primary = self.start_get('k')
+        follower = self.cb.get('k')
+
+        self.finish_get(primary, 'k', 'v')
+        self.cb.completion_batcher.drain()
+        self.assertEqual([[primary, follower]], batches)
+        self.assertEqual('v', follower['k'].value)
+
+    def test_passed_result_becomes_follower(self):
+        primary = self.start_get('k')
+        mres = AsyncResult()
+        rv = Bucket._execute_single_k(self.cb, 'get', 'k', _MRES=mres)
+        self.assertIs(mres, rv)
+
+        values = []
+        mres.set_callbacks(lambda r: values.append(r.value), None)
+        self.finish_get(primary, 'k', 'v')
+        self.assertEqual(['v'], values)
+
+    def test_deferred_get_races_inflight_get(self):
+        self.cb._executors['get'] = GetExecutor(self.cb)
+        limiter = RateLimiter(controller=AIMDController(initial=1))
+        self.cb.rate_limiter = limiter
+
+        # The window is full, so the get is queued by the limiter
+        limiter.in_flight = 1
+        deferred = self.cb.get('k')
+        self.assertEqual(1, limiter.deferred)
+        values = []
+        deferred.set_callbacks(lambda r: values.append(r.value), None)
+
+        # Meanwhile another get of the same key is sent
+        primary = self.start_get('k')
+
+        # The deferred get is admitted while the other is in flight
+        limiter.in_flight = 0
+        limiter._pump(self.cb)
+        self.assertEqual(1, self.cb.coalesced_count)
+        self.assertFalse(limiter._backlog)
+
+        self.finish_get(primary, 'k', 'v')
+        self.assertEqual(['v'], values)
+
+    def test_concurrent_threaded_gets(self):
+        from couchbase_ffi.threaded import ThreadedBucket
+        self.cb = make_unconnected(ThreadedBucket, is_async=True)
+        self.cb._executors['get'] = GetExecutor(self.cb)
+        self.cb.coalesce_gets = True
+        primary = self.start_get('k')
+
+        # What the I/O thread runs for a get submitted by another thread
+        mres = AsyncResult()
+        future = self.cb._wrap_result(mres)
+        self.cb._schedule(Bucket._execute_single_k, mres, 'get', ('k',),
+                          {'_MRES': mres})
+        self.assertFalse(future.done())
+
+        self.finish_get(primary, 'k', 'v')
+        self.assertEqual('v', future.result(0).value)
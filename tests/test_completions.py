@@ -0,0 +1,67 @@
+import unittest
+
+from couchbase_ffi.completions import CompletionBatcher
+from couchbase_ffi.constants import LCB_KEY_ENOENT
+from couchbase_ffi.result import AsyncResult, ValueResult
+
+from tests.util import make_unconnected
+
+
+def _completed(key, rc=0):
+    mres = AsyncResult()
+    result = mres[key] = ValueResult()
+    result.key = key
+    result.rc = rc
+    mres._add_bad_rc(rc, result)
+    return mres
+
+
+class CompletionBatcherTest(unittest.TestCase):
+    def test_scheduled_once_per_drain(self):
+        scheduled = []
+        batcher = CompletionBatcher(schedule=scheduled.append)
+        invoked = []
+        for key in ('a', 'b'):
+            mres = _completed(key)
+            mres.set_callbacks(lambda r: invoked.append(r.key), None)
+            batcher.append(mres)
+        self.assertEqual([batcher.drain], scheduled)
+        self.assertEqual(2, len(batcher))
+
+        self.assertEqual(2, scheduled[0]())
+        self.assertEqual(['a', 'b'], invoked)
+        self.assertEqual(0, batcher.drain())
+
+        batcher.append(_completed('c'))
+        self.assertEqual(2, len(scheduled))
+
+    def test_errors_delivered(self):
+        batcher = CompletionBatcher()
+        errors = []
+        mres = _completed('a', LCB_KEY_ENOENT)
+        mres.set_callbacks(None, lambda r, *exc: errors.append(exc[1].rc))
+        batcher.append(mres)
+        batcher.drain()
+        self.assertEqual([LCB_KEY_ENOENT], errors)
+
+    def test_batch_callback(self):
+        batches = []
+        batcher = CompletionBatcher(batch_callback=batches.append)
+        results = [_completed('a'), _completed('b', LCB_KEY_ENOENT)]
+        for mres in results:
+            mres.set_callbacks(self.fail, self.fail)
+            batcher.append(mres)
+        self.assertEqual(2, batcher.drain())
+        self.assertEqual([results], batches)
+        self.assertFalse(results[1].all_ok)
+
+    def test_bucket_queues_results(self):
+        cb = make_unconnected(is_async=True)
+        cb.completion_batcher = batcher = CompletionBatcher()
+        invoked = []
+        mres = _completed('a')
+        mres.set_callbacks(invoked.append, None)
+        cb._deliver(mres)
+        self.assertEqual([], invoked)
+        batcher.drain()
+        self.assertEqual(1, len(invoked))
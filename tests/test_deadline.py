@@ -0,0 +1,67 @@
+import unittest
+
+import couchbase_ffi.bucket
+from couchbase.exceptions import CouchbaseError
+from couchbase_ffi.bucket import ffi
+from couchbase_ffi.constants import LCB_ETIMEDOUT, LCB_NETWORK_ERROR
+from couchbase_ffi.result import MultiResult, ValueResult
+
+from tests.util import LibraryCalls, make_unconnected
+
+
+class _Response(object):
+    def __init__(self, mres, key, rc):
+        self.cookie = mres._cdata
+        self.key = ffi.new('char[]', key)
+        self.nkey = len(key)
+        self.rc = rc
+        self.cas = 0
+
+
+class _Span(object):
+    rc = 0
+
+
+class DeadlineTest(unittest.TestCase):
+    def setUp(self):
+        self.cb = make_unconnected()
+        self.cb._lcbh = None
+        self.calls = LibraryCalls(couchbase_ffi.bucket, 'lcb_breakout')
+        self.calls.install(self)
+
+    def test_expire_pending_keys(self):
+        mres = MultiResult()
+        for key, rc in (('done', 0), ('pending', -1)):
+            mres[key] = ValueResult()
+            mres[key].key = key
+            mres[key].rc = rc
+        mres._remaining = 1
+        self.cb._handles.add(mres)
+
+        self.cb._expire(mres)
+        self.assertEqual(0, mres['done'].rc)
+        self.assertEqual(LCB_ETIMEDOUT, mres['pending'].rc)
+        self.assertEqual(1, len(self.calls.called('lcb_breakout')))
+        try:
+            mres._maybe_throw()
+        except CouchbaseError as e:
+            self.assertEqual(LCB_ETIMEDOUT, e.rc)
+            self.assertEqual('pending', e.key)
+        else:
+            self.fail('No timeout raised')
+
+    def test_late_response_ignored(self):
+        mres = MultiResult()
+        mres['k'] = ValueResult()
+        mres['k'].key = 'k'
+        mres['k'].rc = 0
+        mres._span = _Span()
+        self.cb._abandon(mres)
+
+        result, _ = self.cb._callback_common(
+            None, 0, _Response(mres, b'k', LCB_NETWORK_ERROR))
+        self.assertIsNot(mres['k'], result)
+        self.assertEqual(0, mres['k'].rc)
+        self.assertTrue(mres.all_ok)
+        self.assertIsNone(mres._bad_rc)
+        self.assertEqual(0, mres._span.rc)
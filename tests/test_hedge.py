@@ -0,0 +1,69 @@
+import unittest
+
+import couchbase_ffi.bucket
+import couchbase_ffi.hedge
+from couchbase_ffi.hedge import HedgePolicy, _HedgedGet
+from couchbase_ffi.result import MultiResult, ValueResult
+
+from tests.util import LibraryCalls, make_unconnected
+
+
+class HedgeTest(unittest.TestCase):
+    def setUp(self):
+        self.cb = make_unconnected()
+        self.cb._lcbh = None
+        self.calls = LibraryCalls(couchbase_ffi.bucket, 'lcb_breakout')
+        self.calls.install(self)
+        LibraryCalls(couchbase_ffi.hedge, 'lcb_breakout').install(self)
+
+    def pending(self, key='k'):
+        mres = MultiResult()
+        mres[key] = ValueResult()
+        mres[key].key = key
+        mres._remaining = 1
+        self.cb._handles.add(mres)
+        return mres
+
+    def complete(self, mres, rc=0):
+        result = next(iter(mres.values()))
+        result.rc = rc
+        mres._add_bad_rc(rc, result)
+        self.cb._chk_op_done(mres)
+
+    def test_loser_does_not_delay_next_op(self):
+        policy = HedgePolicy(delay=0.01)
+        state = _HedgedGet(policy, self.cb, 'k', {})
+        state.primary = self.pending()
+        state.replica = self.pending()
+        state.primary._hedge = state.replica._hedge = state
+
+        self.complete(state.replica)
+        self.assertIs(state.replica, state.winner)
+        self.assertTrue(state.primary._expired)
+        self.assertEqual(1, self.cb._stale)
+
+        # The next operation ends the wait as soon as it completes, rather
+        # than when the slow primary finally does
+        del self.calls.calls[:]
+        nxt = self.pending('other')
+        self.complete(nxt)
+        self.assertEqual(1, len(self.calls.called('lcb_breakout')))
+
+        # The late primary is only accounted
+        self.complete(state.primary)
+        self.assertEqual(0, self.cb._stale)
+        self.assertFalse(self.cb._handles)
+        self.assertEqual(1, policy._primary_latency.count)
+
+    def test_failed_replica_does_not_win(self):
+        policy = HedgePolicy(delay=0.01)
+        state = _HedgedGet(policy, self.cb, 'k', {})
+        state.primary = self.pending()
+        state.replica = self.pending()
+        state.primary._hedge = state.replica._hedge = state
+
+        self.complete(state.replica, rc=1)
+        self.assertIsNone(state.winner)
+        self.complete(state.primary)
+        self.assertIs(state.primary, state.winner)
+        self.assertEqual(0, self.cb._stale)
@@ -0,0 +1,74 @@
+import unittest
+
+from couchbase_ffi import executors
+from couchbase_ffi.executors import GetExecutor
+from couchbase_ffi.hotkeys import CountMinSketch, HotKeyTracker
+
+from tests.util import LibraryCalls, UnconfiguredBucket, make_unconnected
+
+
+class CountMinSketchTest(unittest.TestCase):
+    def test_never_undercounts(self):
+        sketch = CountMinSketch(width=64, depth=4)
+        for n in range(500):
+            sketch.add('key%d' % (n % 50))
+        sketch.add('hot', 100)
+        for n in range(50):
+            self.assertGreaterEqual(sketch.estimate('key%d' % n), 10)
+        self.assertGreaterEqual(sketch.estimate('hot'), 100)
+        # Overcounts by about total / width
+        self.assertLess(sketch.estimate('hot'), 100 + 600 // 64 * 4)
+
+    def test_decay(self):
+        sketch = CountMinSketch()
+        self.assertEqual(10, sketch.add('k', 10))
+        sketch.decay(0.5)
+        self.assertEqual(5, sketch.estimate('k'))
+        self.assertEqual(0, sketch.estimate('other'))
+
+    def test_stable_positions(self):
+        # Independent of the hash seed, and of text or bytes keys
+        sketch = CountMinSketch(width=64, depth=4)
+        self.assertEqual([60, 63, 2, 5], sketch._positions(b'key'))
+        self.assertEqual([60, 63, 2, 5], sketch._positions(u'key'))
+
+
+class HotKeyTrackerTest(unittest.TestCase):
+    def test_top_keys(self):
+        tracker = HotKeyTracker(top=2)
+        for key, count in ((b'a', 5), (b'b', 1), (b'c', 3)):
+            for _ in range(count):
+                tracker.record('get', key, vbucket=7)
+        tracker.record('upsert', b'a')
+
+        snapshot = tracker.snapshot()
+        self.assertEqual([(b'a', 5, 7), (b'c', 3, 7)],
+                         snapshot['keys']['get'])
+        self.assertEqual([(b'a', 1, None)], snapshot['keys']['upsert'])
+        self.assertEqual([(7, 9)], snapshot['vbuckets'])
+        self.assertEqual([(b'a', 5, 7)], tracker.snapshot(1)['keys']['get'])
+
+    def test_decay_and_reset(self):
+        tracker = HotKeyTracker(decay_interval=60, decay=0.5)
+        for _ in range(4):
+            tracker.record('get', b'k', vbucket=1)
+        tracker._last_decay -= 60
+        tracker.record('get', b'k', vbucket=1)
+        self.assertEqual([(b'k', 3, 1)], tracker.snapshot()['keys']['get'])
+        self.assertEqual([(1, 3)], tracker.snapshot()['vbuckets'])
+
+        tracker.reset()
+        self.assertEqual({'keys': {}, 'vbuckets': []}, tracker.snapshot())
+
+    def test_unmapped_key_counted(self):
+        LibraryCalls(executors, 'lcb_sched_enter', 'lcb_sched_leave',
+                     'lcb_get3').install(self)
+        cb = make_unconnected(UnconfiguredBucket, is_async=True)
+        cb._lcbh = None
+        cb._executors['get'] = GetExecutor(cb)
+        cb.hot_key_tracker = tracker = HotKeyTracker()
+
+        cb.get('k')
+        self.assertEqual({'get': [(b'k', 1, None)]},
+                         tracker.snapshot()['keys'])
+        self.assertEqual([], tracker.snapshot()['vbuckets'])
@@ -0,0 +1,19 @@
+import unittest
+
+import couchbase_ffi.http
+from couchbase_ffi.result import AsyncResult
+
+from tests.util import LibraryCalls, make_unconnected
+
+
+class HttpRequestTest(unittest.TestCase):
+    def test_async_request_pending(self):
+        LibraryCalls(couchbase_ffi.http, '_Cb_set_key', 'lcb_http3').install(
+            self)
+        cb = make_unconnected(is_async=True)
+        cb._lcbh = None
+
+        mres = cb._http_request('/pools')
+        self.assertIsInstance(mres, AsyncResult)
+        self.assertIn(mres, cb._handles)
+        self.assertFalse(cb._timers)
@@ -0,0 +1,120 @@
+import logging
+import unittest
+
+import couchbase_ffi.lcblog
+from couchbase_ffi.lcblog import LcbLogger, ffi
+
+from tests.util import LibraryCalls
+
+C = couchbase_ffi.lcblog.C
+
+
+class _Clock(object):
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class _Records(logging.Handler):
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record)
+
+
+class LcbLoggerTest(unittest.TestCase):
+    def setUp(self):
+        calls = LibraryCalls(couchbase_ffi.lcblog, '_Cb_logger_new',
+                             '_Cb_logger_free', '_Cb_logger_set_level')
+        calls.install(self)
+        calls.results['_Cb_logger_new'] = ffi.new('int *')
+
+        self.clock = _Clock()
+        orig_time = couchbase_ffi.lcblog.time.time
+        couchbase_ffi.lcblog.time.time = self.clock
+        self.addCleanup(setattr, couchbase_ffi.lcblog.time, 'time',
+                        orig_time)
+
+        self.logger = logging.getLogger('tests.lcblog')
+        self.logger.propagate = False
+        self.handler = _Records()
+        self.logger.addHandler(self.handler)
+        self.addCleanup(self.logger.removeHandler, self.handler)
+
+    def make_lcb_logger(self, **kwargs):
+        # Queued messages are only passed on by explicit flushes
+        lcb_logger = LcbLogger(self.logger, level=logging.DEBUG,
+                               flush_interval=60, **kwargs)
+        self.addCleanup(lcb_logger.close)
+        return lcb_logger
+
+    def log(self, lcb_logger, subsys='server', severity=None, msg=b'msg'):
+        if severity is None:
+            severity = C.LCB_LOG_INFO
+        lcb_logger._on_message(7, ffi.new('char[]', subsys.encode('utf-8')),
+                               severity, ffi.new('char[]', b'file.c'), 42,
+                               ffi.new('char[]', msg))
+
+    def test_sampling(self):
+        lcb_logger = self.make_lcb_logger(sample={'server': 0.5})
+        orig_random = couchbase_ffi.lcblog.random.random
+        self.addCleanup(setattr, couchbase_ffi.lcblog.random, 'random',
+                        orig_random)
+        for value in (0.5, 0.2, 0.9):
+            couchbase_ffi.lcblog.random.random = lambda: value
+            self.log(lcb_logger)
+        self.log(lcb_logger, subsys='confmon')
+        self.assertEqual({'queued': 2, 'rate_limited': 0, 'sampled_out': 2,
+                          'overflowed': 0}, lcb_logger.stats())
+
+    def test_rate_limit(self):
+        lcb_logger = self.make_lcb_logger(rate=2)
+        allowed = [lcb_logger._allow('server') for _ in range(3)]
+        self.assertEqual([True, True, False], allowed)
+        # Subsystems are limited separately
+        self.assertTrue(lcb_logger._allow('confmon'))
+
+        self.clock.now += 0.25
+        self.assertFalse(lcb_logger._allow('server'))
+        self.clock.now += 0.25
+        self.assertTrue(lcb_logger._allow('server'))
+        self.assertEqual(2, lcb_logger.rate_limited)
+
+        # The burst is capped at the rate
+        self.clock.now += 60
+        allowed = [lcb_logger._allow('server') for _ in range(3)]
+        self.assertEqual([True, True, False], allowed)
+
+    def test_overflow(self):
+        lcb_logger = self.make_lcb_logger(rate=None, max_buffered=2)
+        for _ in range(3):
+            self.log(lcb_logger)
+        self.assertEqual(1, lcb_logger.overflowed)
+        self.assertEqual(2, lcb_logger.stats()['queued'])
+
+        lcb_logger.flush()
+        self.log(lcb_logger)
+        self.assertEqual(1, lcb_logger.stats()['queued'])
+
+    def test_flush(self):
+        lcb_logger = self.make_lcb_logger()
+        self.logger.setLevel(logging.INFO)
+        self.addCleanup(self.logger.setLevel, logging.NOTSET)
+        self.log(lcb_logger, severity=C.LCB_LOG_WARN, msg=b'slow')
+        self.clock.now += 1.5
+        self.log(lcb_logger, subsys='confmon', severity=C.LCB_LOG_DEBUG)
+        self.assertEqual([], self.handler.records)
+
+        lcb_logger.flush()
+        self.assertEqual(1, len(self.handler.records))
+        record = self.handler.records[0]
+        self.assertEqual(logging.WARNING, record.levelno)
+        self.assertEqual('[7] <server> slow', record.getMessage())
+        self.assertEqual((7, 'server'), (record.lcb_iid, record.lcb_subsys))
+        self.assertEqual(('file.c', 42), (record.pathname, record.lineno))
+        self.assertEqual(1000.0, record.created)
+        self.assertEqual(0, lcb_logger.stats()['queued'])
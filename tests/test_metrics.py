@@ -0,0 +1,56 @@
+import unittest
+
+from couchbase_ffi.metrics import Histogram
+
+
+class HistogramTest(unittest.TestCase):
+    def test_small_values_exact(self):
+        hist = Histogram()
+        for value in range(64):
+            hist.record(value)
+        self.assertEqual(0, hist.percentile(0))
+        self.assertEqual(31, hist.percentile(50))
+        self.assertEqual(63, hist.percentile(100))
+        self.assertEqual(31.5, hist.mean)
+
+    def test_relative_error(self):
+        for value in (100, 1000, 12345, 10 ** 6, 2 ** 40 + 1):
+            hist = Histogram()
+            hist.record(value)
+            hist.record(value * 4)
+            reported = hist.percentile(50)
+            self.assertGreaterEqual(reported, value)
+            self.assertLessEqual(reported, value * 1.04)
+
+    def test_percentiles(self):
+        hist = Histogram()
+        for value in range(1, 1001):
+            hist.record(value * 100)
+        for pct, expected in ((50, 50000), (90, 90000), (99, 99000)):
+            reported = hist.percentile(pct)
+            self.assertGreaterEqual(reported, expected)
+            self.assertLessEqual(reported, expected * 1.04)
+        self.assertEqual(100000, hist.percentile(100))
+
+    def test_merge(self):
+        first, second = Histogram(), Histogram()
+        first.record(10)
+        first.record(-5)
+        second.record(1000)
+        second.merge(Histogram())
+        first.merge(second)
+        self.assertEqual(3, first.count)
+        self.assertEqual(0, first.min)
+        self.assertEqual(1000, first.max)
+        self.assertEqual(1010, first.total)
+        self.assertEqual(1000, first.percentile(100))
+
+    def test_empty_and_reset(self):
+        hist = Histogram()
+        self.assertEqual(0, hist.percentile(99))
+        self.assertEqual(0, hist.mean)
+        hist.record(5)
+        hist.reset()
+        snapshot = hist.snapshot()
+        self.assertEqual(0, snapshot['count'])
+        self.assertEqual(0, snapshot['p999'])
@@ -0,0 +1,101 @@
+import select
+import unittest
+
+import couchbase_ffi.bucket
+import couchbase_ffi.native
+from couchbase.exceptions import CouchbaseError
+from couchbase_ffi.constants import LCB_NETWORK_ERROR
+from couchbase_ffi.executors import UnlockExecutor
+from couchbase_ffi.native import (
+    IOThread, IOThreadBucket, _Pipe, _PipeCompletions)
+from couchbase_ffi.result import AsyncResult
+
+from tests.util import LibraryCalls, make_unconnected
+
+
+class _RacingCompletions(_PipeCompletions):
+    # A completion arrives from the I/O thread while the pipe is drained
+    def clear(self):
+        if not self._queue:
+            self.append('racing')
+        super(_RacingCompletions, self).clear()
+
+
+class _Timer(object):
+    def __init__(self, standalone):
+        self.standalone = standalone
+
+
+class _InlineIO(object):
+    # Runs calls right away; an escaping exception would kill the thread
+    def call(self, fn, *args):
+        try:
+            fn(*args)
+        except Exception as e:
+            raise AssertionError('I/O thread died: %r' % (e,))
+
+
+def _readable(fd):
+    return bool(select.select([fd], [], [], 0)[0])
+
+
+class PipeCompletionsTest(unittest.TestCase):
+    def test_completion_during_drain(self):
+        completions = _RacingCompletions()
+        self.addCleanup(completions.close)
+        self.assertEqual(['racing'], completions.drain())
+        self.assertFalse(_readable(completions.rfd))
+
+        completions.append('next')
+        self.assertTrue(_readable(completions.rfd))
+        self.assertEqual(['next'], completions.drain())
+
+
+class IOThreadTest(unittest.TestCase):
+    def setUp(self):
+        self.cb = make_unconnected(is_async=True)
+        self.io = IOThread(self.cb)
+        self.io._waker = _Pipe()
+        self.addCleanup(self.io._waker.close)
+
+    def test_waits_for_timers(self):
+        self.assertFalse(self.io._busy())
+        self.cb._timers.add(_Timer(standalone=True))
+        self.assertFalse(self.io._busy())
+
+        # e.g. the delivery of a result completed without being scheduled
+        self.cb._timers.add(_Timer(standalone=False))
+        self.assertTrue(self.io._busy())
+        self.assertEqual([], self.io._next_batch())
+
+
+class IOThreadBucketTest(unittest.TestCase):
+    def test_connect_failure_raised(self):
+        LibraryCalls(couchbase_ffi.bucket, 'lcb_connect').install(
+            self).results['lcb_connect'] = 0
+        calls = LibraryCalls(couchbase_ffi.native, 'lcb_wait',
+                             'lcb_get_bootstrap_status').install(self)
+        calls.results['lcb_get_bootstrap_status'] = LCB_NETWORK_ERROR
+
+        cb = make_unconnected(IOThreadBucket, is_async=True)
+        cb._lcbh = None
+        cb._io = _InlineIO()
+        try:
+            cb.connect()
+        except CouchbaseError as e:
+            self.assertEqual(LCB_NETWORK_ERROR, e.rc)
+        else:
+            self.fail('No error raised')
+
+    def test_operation_named_by_executor(self):
+        begun = []
+
+        class _Bucket(IOThreadBucket):
+            def _begin_op(self, mres, name):
+                begun.append(name)
+
+        cb = make_unconnected(_Bucket, is_async=True)
+        cb._executors['_unlock'] = UnlockExecutor(cb)
+        cb._schedule(lambda *args, **kwargs: None, AsyncResult(), '_unlock',
+                     ('a',), {})
+        self.assertEqual(['unlock'], begun)
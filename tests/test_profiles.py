@@ -0,0 +1,75 @@
+import unittest
+
+from couchbase_ffi.bucket import Bucket
+from couchbase.exceptions import CouchbaseError
+from couchbase_ffi.constants import LCB_EINVAL, LCB_NOT_SUPPORTED
+from couchbase_ffi.profiles import PROFILES, READABLE, parse_profile
+
+from tests.util import make_unconnected
+
+
+class _SettingsBucket(Bucket):
+    # Keeps the settings in a dictionary instead of the library
+    def _cntlstr_rc(self, key, value):
+        if key in ('compression', 'unknown_setting'):
+            return LCB_NOT_SUPPORTED
+        if key == 'bad_setting':
+            return LCB_EINVAL
+        self.settings[key] = value
+        return 0
+
+    def _cntl(self, op, value=None, value_type=None):
+        for key, (key_op, _) in READABLE.items():
+            if key_op == op:
+                return float(self.settings[key])
+
+
+class ApplyProfileTest(unittest.TestCase):
+    def setUp(self):
+        self.cb = make_unconnected(_SettingsBucket)
+        self.cb.settings = dict((key, '2.5') for key in READABLE)
+
+    def test_unsupported_optional_setting_skipped(self):
+        applied = self.cb.apply_profile('low-latency')
+        self.assertNotIn('compression', applied)
+        self.assertEqual('1', applied['tcp_nodelay'])
+        self.assertEqual('0.5', self.cb.settings['operation_timeout'])
+
+    def test_rejected_setting_rolled_back(self):
+        self.cb.apply_profile({'tcp_nodelay': '0'})
+        self.assertRaises(CouchbaseError, self.cb.apply_profile, {
+            'operation_timeout': '1.0',
+            'tcp_nodelay': '1',
+            'bad_setting': '1'})
+        self.assertEqual('2.5', self.cb.settings['operation_timeout'])
+        self.assertEqual('0', self.cb.settings['tcp_nodelay'])
+        self.assertEqual('0', self.cb.get_profile()['tcp_nodelay'])
+
+    def test_unknown_setting_rejected(self):
+        self.assertRaises(CouchbaseError, self.cb.apply_profile,
+                          {'operation_timeout': '1.0', 'compression': 'on',
+                           'unknown_setting': '1'})
+        self.assertEqual('2.5', self.cb.settings['operation_timeout'])
+
+
+class ParseProfileTest(unittest.TestCase):
+    def test_named_profile(self):
+        settings = parse_profile('wan')
+        self.assertEqual(PROFILES['wan'], settings)
+        settings['operation_timeout'] = '1.0'
+        self.assertEqual('5.0', PROFILES['wan']['operation_timeout'])
+
+    def test_dict(self):
+        self.assertEqual(
+            {'operation_timeout': '2.5', 'tcp_nodelay': '0'},
+            parse_profile({'operation_timeout': 2.5, 'tcp_nodelay': False}))
+
+    def test_connection_string(self):
+        self.assertEqual(
+            {'operation_timeout': '2.5', 'compression': 'on'},
+            parse_profile('?operation_timeout=2.5&compression=on'))
+
+    def test_invalid(self):
+        for profile in ('no-such-profile', 'operation_timeout=1&=2',
+                        'operation_timeout=1&compression', None):
+            self.assertRaises(CouchbaseError, parse_profile, profile)
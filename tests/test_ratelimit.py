@@ -0,0 +1,127 @@
+import unittest
+
+from couchbase_ffi import bucket as bucket_module
+from couchbase_ffi import ratelimit
+from couchbase_ffi.bucket import Bucket
+from couchbase_ffi.constants import LCB_ETMPFAIL
+from couchbase_ffi.ratelimit import AIMDController, RateLimiter, TokenBucket
+from couchbase_ffi.result import OperationResult
+
+from tests.util import LibraryCalls, make_unconnected
+
+
+class _CountingBucket(Bucket):
+    def _begin_op(self, mres, name):
+        self.begun += 1
+        super(_CountingBucket, self)._begin_op(mres, name)
+
+    def _end_op(self, mres, rc=0):
+        self.ended += 1
+        super(_CountingBucket, self)._end_op(mres, rc)
+
+
+class _LocalExecutor(object):
+    # Completes every key without scheduling it
+    OPNAME = 'upsert'
+
+    def __init__(self):
+        self.chunks = []
+
+    def execute(self, kv, **kwargs):
+        self.chunks.append(sorted(kv))
+        mres = kwargs['_MRES']
+        for key in kv:
+            mres[key] = OperationResult()
+            mres[key].rc = 0
+        return mres
+
+
+class _FailingExecutor(object):
+    OPNAME = 'upsert'
+
+    def execute(self, kv, **kwargs):
+        raise ValueError('Cannot encode')
+
+
+class TokenBucketTest(unittest.TestCase):
+    def setUp(self):
+        self.now = 100.0
+        orig_clock = ratelimit.clock
+        ratelimit.clock = lambda: self.now
+        self.addCleanup(setattr, ratelimit, 'clock', orig_clock)
+
+    def test_debt(self):
+        tb = TokenBucket(rate=10, capacity=5)
+        self.assertEqual(0, tb.delay())
+        tb.take(4)
+        self.assertEqual(0, tb.delay())
+        # Admitted while tokens remain, leaving the bucket in debt
+        tb.take(6)
+        self.assertAlmostEqual(0.5, tb.delay(), places=4)
+        self.now += 0.5
+        self.assertAlmostEqual(0, tb.delay(), places=4)
+        self.now += 0.1
+        self.assertEqual(0, tb.delay())
+
+    def test_refill_capped(self):
+        tb = TokenBucket(rate=10, capacity=5)
+        tb.take(5)
+        self.now += 60
+        tb.take(5)
+        self.assertGreater(tb.delay(), 0)
+
+
+class AIMDControllerTest(unittest.TestCase):
+    def test_additive_increase(self):
+        ctl = AIMDController(initial=10, max_window=12)
+        ctl.record(10, 0, 0.001)
+        self.assertEqual(11, ctl.window)
+        for _ in range(10):
+            ctl.record(20, 0, 0.001)
+        self.assertEqual(12, ctl.window)
+
+    def test_decrease_once_per_window(self):
+        ctl = AIMDController(initial=16, min_window=3)
+        ctl.record(4, 1, 0.001)
+        self.assertEqual(8, ctl.window)
+        # The rest of the burst does not shrink it again
+        for _ in range(2):
+            ctl.record(4, 4, 0.001)
+            self.assertEqual(8, ctl.window)
+        # A window's worth of operations later, it does
+        ctl.record(4, 4, 0.001)
+        self.assertEqual(4, ctl.window)
+        for _ in range(3):
+            ctl.record(10, 10, 0.001)
+        self.assertEqual(3, ctl.window)
+        self.assertEqual(3, ctl.decreases)
+
+    def test_latency_target(self):
+        ctl = AIMDController(initial=8, latency_target=0.1)
+        ctl.record(8, 0, 0.05)
+        self.assertEqual(9, ctl.window)
+        ctl.record(8, 0, 0.2)
+        self.assertEqual(4, ctl.window)
+        self.assertIn(LCB_ETMPFAIL, ctl.FAILURE_CODES)
+
+
+class RateLimiterTest(unittest.TestCase):
+    def test_chunked_operation_begun_once(self):
+        LibraryCalls(bucket_module, 'lcb_wait').install(self)
+        cb = make_unconnected(_CountingBucket)
+        cb._lcbh = None
+        cb.begun = cb.ended = 0
+        cb.rate_limiter = RateLimiter(max_batch=2)
+        proc = cb._executors['upsert'] = _LocalExecutor()
+
+        mres = cb.upsert_multi(dict((k, 'v') for k in 'abcde'))
+        self.assertEqual([['a', 'b'], ['c', 'd'], ['e']], proc.chunks)
+        self.assertEqual(5, len(mres))
+        self.assertEqual((1, 1), (cb.begun, cb.ended))
+        self.assertFalse(cb._handles)
+
+    def test_deferred_scheduling_error_raised(self):
+        cb = make_unconnected(is_async=True)
+        cb.rate_limiter = RateLimiter()
+        cb._executors['upsert'] = _FailingExecutor()
+        self.assertRaises(ValueError, cb.upsert, 'k', 'v')
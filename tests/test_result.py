@@ -0,0 +1,88 @@
+import sys
+import unittest
+
+import couchbase_ffi
+from couchbase.exceptions import NotFoundError, TemporaryFailError
+from couchbase_ffi.constants import LCB_ETMPFAIL, LCB_KEY_ENOENT
+from couchbase_ffi.result import MultiResult, OperationResult
+
+
+def _results(**codes):
+    mres = MultiResult()
+    for key in sorted(codes):
+        result = mres[key] = OperationResult()
+        result.key = key
+        result.rc = codes[key]
+    return mres
+
+
+def _exc_info(exc):
+    try:
+        raise exc
+    except Exception:
+        return sys.exc_info()
+
+
+class MultiResultErrorTest(unittest.TestCase):
+    def assertRaisesFor(self, exc_cls, mres, rc, key):
+        try:
+            mres._maybe_throw()
+        except exc_cls as e:
+            self.assertEqual(rc, e.rc)
+            self.assertEqual(key, e.key)
+            return e
+        self.fail('No error raised')
+
+    def test_quiet_missing_key(self):
+        mres = _results(a=LCB_KEY_ENOENT, b=LCB_ETMPFAIL)
+        mres._quiet = True
+        mres._add_bad_rc(LCB_KEY_ENOENT, mres['a'])
+        self.assertFalse(mres.all_ok)
+        mres._maybe_throw()
+
+        mres._add_bad_rc(LCB_ETMPFAIL, mres['b'])
+        self.assertRaisesFor(TemporaryFailError, mres, LCB_ETMPFAIL, 'b')
+
+    def test_exception_attributes(self):
+        mres = _results(a=0, b=LCB_KEY_ENOENT)
+        mres._add_bad_rc(LCB_KEY_ENOENT, mres['b'])
+        e = self.assertRaisesFor(NotFoundError, mres, LCB_KEY_ENOENT, 'b')
+        self.assertIs(mres['b'], e.result)
+        self.assertIs(mres, e.all_results)
+
+        # Raised once
+        mres._maybe_throw()
+
+    def test_first_error_wins(self):
+        mres = _results(a=LCB_ETMPFAIL, b=LCB_KEY_ENOENT)
+        mres._add_bad_rc(LCB_ETMPFAIL, mres['a'])
+        mres._add_err(_exc_info(ValueError('Cannot decode')))
+        mres._add_bad_rc(LCB_KEY_ENOENT, mres['b'])
+        self.assertRaisesFor(TemporaryFailError, mres, LCB_ETMPFAIL, 'a')
+
+        mres = _results(a=LCB_ETMPFAIL)
+        mres._add_err(_exc_info(ValueError('Cannot decode')))
+        mres._add_bad_rc(LCB_ETMPFAIL, mres['a'])
+        self.assertFalse(mres.all_ok)
+        self.assertRaises(ValueError, mres._maybe_throw)
+
+    def test_rescan_after_replacing_result(self):
+        mres = _results(a=LCB_ETMPFAIL, b=LCB_KEY_ENOENT)
+        mres._add_bad_rc(LCB_ETMPFAIL, mres['a'])
+
+        mres['a'] = _results(a=0)['a']
+        mres._rescan_bad_rc()
+        self.assertFalse(mres.all_ok)
+        self.assertRaisesFor(NotFoundError, mres, LCB_KEY_ENOENT, 'b')
+
+        mres['b'] = _results(b=0)['b']
+        mres._rescan_bad_rc()
+        self.assertTrue(mres.all_ok)
+        mres._maybe_throw()
+
+    def test_rescan_keeps_error(self):
+        mres = _results(a=0)
+        mres._add_err(_exc_info(ValueError('Cannot decode')))
+        mres._rescan_bad_rc()
+        self.assertFalse(mres.all_ok)
+        self.assertRaises(ValueError, mres._maybe_throw)
@@ -0,0 +1,133 @@
+import time
+import unittest
+
+import couchbase_ffi
+from couchbase.exceptions import CouchbaseError
+from couchbase_ffi import retry
+from couchbase_ffi.constants import (
+    LCB_ETIMEDOUT, LCB_ETMPFAIL, LCB_KEY_ENOENT)
+from couchbase_ffi.executors import RemoveExecutor, UpsertExecutor
+from couchbase_ffi.result import MultiResult, OperationResult
+from couchbase_ffi.retry import RetryPolicy
+
+from tests.util import make_unconnected
+
+
+class _Bucket(object):
+    # Resubmitted keys succeed, unless given another code in `codes`
+    def __init__(self):
+        self.resubmitted = []
+        self.codes = {}
+
+    def _resubmit(self, proc, kv, kwargs, mres):
+        self.resubmitted.append(sorted(kv))
+        for key in kv:
+            mres[key] = _result(key, self.codes.get(key, 0))
+
+
+class _PartialExecutor(UpsertExecutor):
+    # Fails after the first key was submitted
+    def __init__(self):
+        pass
+
+    def execute(self, kv, **kwargs):
+        key = sorted(kv)[0]
+        kwargs['_MRES'][key] = _result(key, -1)
+        raise ValueError('Cannot encode')
+
+
+def _result(key, rc):
+    result = OperationResult()
+    result.key = key
+    result.rc = rc
+    return result
+
+
+def _failed(**codes):
+    mres = MultiResult()
+    for key, rc in codes.items():
+        mres[key] = _result(key, rc)
+    return mres
+
+
+class RetryPolicyTest(unittest.TestCase):
+    def setUp(self):
+        self.policy = RetryPolicy(initial_delay=0, jitter=0)
+        self.parent = _Bucket()
+
+    def test_backoff(self):
+        policy = RetryPolicy(initial_delay=0.01, max_delay=0.05,
+                             multiplier=2.0, jitter=0)
+        self.assertEqual([0.01, 0.02, 0.04, 0.05, 0.05],
+                         [policy.backoff(n) for n in range(1, 6)])
+
+    def test_backoff_jitter(self):
+        orig_random = retry.random.random
+        self.addCleanup(setattr, retry.random, 'random', orig_random)
+        policy = RetryPolicy(initial_delay=0.1, jitter=0.5)
+        retry.random.random = lambda: 1.0
+        self.assertAlmostEqual(0.05, policy.backoff(1))
+        retry.random.random = lambda: 0.0
+        self.assertAlmostEqual(0.1, policy.backoff(1))
+
+    def test_retries_failed_keys(self):
+        mres = _failed(a=0, b=LCB_ETMPFAIL)
+        self.policy.run(self.parent, UpsertExecutor, {'a': 1, 'b': 2}, {},
+                        mres)
+        self.assertEqual([['b']], self.parent.resubmitted)
+        self.assertEqual(0, mres['b'].rc)
+        self.assertEqual(1, self.policy.stats()['keys_recovered'])
+
+    def test_timeouts_of_non_idempotent_commands(self):
+        mres = _failed(a=LCB_ETIMEDOUT)
+        self.policy.run(self.parent, RemoveExecutor, ['a'], {}, mres)
+        self.assertEqual([], self.parent.resubmitted)
+
+    def test_cas_not_retried(self):
+        # A CAS for the whole operation
+        mres = _failed(a=LCB_ETMPFAIL)
+        self.policy.run(self.parent, UpsertExecutor, {'a': 1}, {'cas': 42},
+                        mres)
+        # Per-key CAS values
+        self.policy.run(self.parent, RemoveExecutor, {'a': 42}, {}, mres)
+        self.assertEqual([], self.parent.resubmitted)
+
+        # Values of a store are not CAS values
+        self.policy.run(self.parent, UpsertExecutor, {'a': 42}, {}, mres)
+        self.assertEqual([['a']], self.parent.resubmitted)
+
+    def test_recovered_keys_succeeded(self):
+        mres = _failed(a=LCB_ETMPFAIL, b=LCB_ETMPFAIL)
+        self.parent.codes['b'] = LCB_KEY_ENOENT
+        self.policy.run(self.parent, UpsertExecutor, {'a': 1, 'b': 2}, {},
+                        mres)
+        self.assertEqual({'retries': 1, 'keys_retried': 2,
+                          'keys_recovered': 1, 'keys_exhausted': 0},
+                         self.policy.stats())
+
+    def test_operation_deadline(self):
+        policy = RetryPolicy(initial_delay=1, jitter=0)
+        mres = _failed(a=LCB_ETMPFAIL)
+        policy.run(self.parent, UpsertExecutor, {'a': 1},
+                   {'deadline': time.time() + 0.5}, mres)
+        self.assertEqual([], self.parent.resubmitted)
+        self.assertEqual(1, policy.stats()['keys_exhausted'])
+
+    def test_failed_resubmit_keeps_results(self):
+        cb = make_unconnected()
+        cb._lcbh = None
+        mres = _failed(a=0, b=LCB_ETMPFAIL, c=LCB_ETMPFAIL)
+        failed = mres['b']
+        mres._add_bad_rc(LCB_ETMPFAIL, failed)
+        self.policy.run(cb, _PartialExecutor(), {'a': 1, 'b': 2, 'c': 3}, {},
+                        mres)
+        self.assertIs(failed, mres['b'])
+        self.assertEqual([0, LCB_ETMPFAIL, LCB_ETMPFAIL],
+                         [mres[k].rc for k in 'abc'])
+        self.assertEqual(0, self.policy.stats()['retries'])
+        try:
+            mres._maybe_throw()
+        except CouchbaseError as e:
+            self.assertEqual(LCB_ETMPFAIL, e.rc)
+        else:
+            self.fail('No error raised')
@@ -0,0 +1,93 @@
+import unittest
+
+from couchbase_ffi.bucket import Bucket
+from couchbase_ffi.constants import LCB_CNTL_OP_TIMEOUT
+from couchbase_ffi.timeouts import AdaptiveTimeout
+
+from tests.util import make_unconnected
+
+
+class _Timer(object):
+    def __init__(self, timers, delay, fn, standalone):
+        self.timers = timers
+        self.delay = delay
+        self.fn = fn
+        self.standalone = standalone
+        timers.append(self)
+
+    def cancel(self):
+        self.timers.remove(self)
+
+    def fire(self):
+        self.timers.remove(self)
+        self.fn()
+
+
+class _TimeoutBucket(Bucket):
+    # Keeps the timeout and the timers instead of the library
+    def _cntl(self, op, value=None, value_type=None):
+        assert op == LCB_CNTL_OP_TIMEOUT
+        if value is not None:
+            self.op_timeout = value
+        return self.op_timeout
+
+    def _start_timer(self, timeout, fn, standalone=False):
+        return _Timer(self.pending_timers, timeout, fn, standalone)
+
+
+class AdaptiveTimeoutTest(unittest.TestCase):
+    def setUp(self):
+        self.cb = make_unconnected(_TimeoutBucket)
+        self.cb.op_timeout = 1.0
+        self.cb.pending_timers = []
+        self.ctl = AdaptiveTimeout(percentile=99, min_samples=100,
+                                   interval=10)
+        self.cb.timeout_controller = self.ctl
+
+    def record(self, count, elapsed, timed_out=False):
+        for _ in range(count):
+            self.ctl.record(self.cb, 'get', elapsed, timed_out)
+
+    def test_timeouts_raise(self):
+        self.record(197, 0.01)
+        self.record(3, 1.0, timed_out=True)
+        self.assertEqual({'get': 1.0}, self.ctl.percentiles())
+        self.ctl.adjust(self.cb)
+        self.assertEqual(3.0, self.cb.op_timeout)
+
+    def test_rare_timeouts_lower(self):
+        self.record(199, 0.01)
+        self.record(1, 1.0, timed_out=True)
+        self.assertLess(self.ctl.percentiles()['get'], 0.02)
+        self.ctl.adjust(self.cb)
+        self.assertEqual(self.ctl.min_timeout, self.cb.op_timeout)
+
+    def test_lowered_after_timeouts_stop(self):
+        self.record(100, 0.01)
+        self.record(100, 1.0, timed_out=True)
+        self.ctl.adjust(self.cb)
+        self.assertEqual(3.0, self.cb.op_timeout)
+
+        # The previous period's timeouts still count
+        self.record(200, 0.01)
+        self.ctl.adjust(self.cb)
+        self.assertEqual(9.0, self.cb.op_timeout)
+
+        self.record(200, 0.01)
+        self.ctl.adjust(self.cb)
+        self.assertEqual(self.ctl.min_timeout, self.cb.op_timeout)
+
+    def test_adjust_from_timer(self):
+        timer, = self.cb.pending_timers
+        self.assertTrue(timer.standalone)
+        self.assertEqual(10, timer.delay)
+
+        self.ctl._previous_timeouts['get'] = 200
+        self.ctl._last_adjust -= 10
+        timer.fire()
+        self.assertEqual(3.0, self.cb.op_timeout)
+        self.assertEqual(1, len(self.cb.pending_timers))
+
+    def test_detach(self):
+        self.cb.timeout_controller = None
+        self.assertFalse(self.cb.pending_timers)
@@ -0,0 +1,93 @@
+import unittest
+
+import couchbase_ffi.timerwheel
+from couchbase_ffi.constants import (
+    PYCBC_EVACTION_UNWATCH, PYCBC_EVACTION_WATCH)
+from couchbase_ffi.timerwheel import TimerWheel
+
+
+class _Timer(object):
+    def __init__(self, fired):
+        self.fired = fired
+        self._wheel_slot = None
+        self._wheel_expires = None
+
+    def ready(self):
+        self.fired.append(self)
+
+
+class TimerWheelTest(unittest.TestCase):
+    def setUp(self):
+        self.now = 1000.0
+        orig_clock = couchbase_ffi.timerwheel.clock
+        couchbase_ffi.timerwheel.clock = lambda: self.now
+        self.addCleanup(setattr, couchbase_ffi.timerwheel, 'clock',
+                        orig_clock)
+
+        self.armed = []
+        self.fired = []
+        self.wheel = TimerWheel(self.armed.append, resolution=0.001)
+
+    def schedule(self, msecs, timer=None):
+        if timer is None:
+            timer = _Timer(self.fired)
+        self.wheel.update(timer, PYCBC_EVACTION_WATCH, msecs * 1000)
+        return timer
+
+    def advance(self, msecs):
+        self.now += msecs / 1000.0
+        self.wheel.expire()
+
+    def test_fires_in_order(self):
+        late = self.schedule(20)
+        early = self.schedule(5)
+        self.advance(4)
+        self.assertEqual([], self.fired)
+        # Up to a tick late
+        self.advance(3)
+        self.assertEqual([early], self.fired)
+        self.advance(20)
+        self.assertEqual([early, late], self.fired)
+        self.assertEqual(0, len(self.wheel))
+
+    def test_cascades_from_higher_levels(self):
+        # Beyond the root level, and beyond the first level above it
+        timers = [self.schedule(msecs) for msecs in (1000, 20000)]
+        self.advance(999)
+        self.assertEqual([], self.fired)
+        self.advance(3)
+        self.assertEqual(timers[:1], self.fired)
+        self.advance(18990)
+        self.assertEqual(timers[:1], self.fired)
+        self.advance(20)
+        self.assertEqual(timers, self.fired)
+
+    def test_cancel_and_reschedule(self):
+        cancelled = self.schedule(5)
+        moved = self.schedule(5)
+        self.wheel.update(cancelled, PYCBC_EVACTION_UNWATCH, 0)
+        self.schedule(50, moved)
+        self.advance(10)
+        self.assertEqual([], self.fired)
+        self.advance(50)
+        self.assertEqual([moved], self.fired)
+
+        stats = self.wheel.stats()
+        self.assertEqual(2, stats['scheduled'])
+        self.assertEqual(1, stats['rescheduled'])
+        self.assertEqual(1, stats['cancelled'])
+        self.assertEqual(1, stats['fired'])
+        self.assertEqual(0, stats['pending'])
+
+    def test_loop_timer_follows_earliest_expiry(self):
+        self.schedule(10)
+        self.schedule(20)
+        self.assertEqual(1, len(self.armed))
+        self.schedule(5)
+        self.assertEqual(2, len(self.armed))
+        self.assertLessEqual(self.armed[-1], 6000)
+
+        self.advance(7)
+        # Re-armed for the next pending timer
+        self.assertEqual(3, len(self.armed))
+        self.assertLessEqual(self.armed[-1], 5000)
@@ -0,0 +1,32 @@
+import unittest
+
+from couchbase_ffi import executors
+from couchbase_ffi.executors import GetExecutor
+from couchbase_ffi.tracing import Tracer
+
+from tests.util import LibraryCalls, UnconfiguredBucket, make_unconnected
+
+
+class _CollectingTracer(Tracer):
+    def __init__(self):
+        super(_CollectingTracer, self).__init__()
+        self.spans = []
+
+    def finish_span(self, span):
+        self.spans.append(span)
+
+
+class TracerTest(unittest.TestCase):
+    def test_unmapped_key_traced(self):
+        LibraryCalls(executors, 'lcb_sched_enter', 'lcb_sched_leave',
+                     'lcb_get3').install(self)
+        cb = make_unconnected(UnconfiguredBucket, is_async=True)
+        cb._lcbh = None
+        cb._executors['get'] = GetExecutor(cb)
+        cb.tracer = tracer = _CollectingTracer()
+
+        mres = cb.get('k')
+        cb._end_op(mres)
+        span, = tracer.spans
+        self.assertEqual(1, span.keys)
+        self.assertEqual(set(), span.servers)
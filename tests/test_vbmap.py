@@ -0,0 +1,42 @@
+import unittest
+
+from couchbase_ffi.bucket import Bucket, ffi
+
+from tests.util import make_unconnected
+
+
+class _MappedBucket(Bucket):
+    # The vBucket is the key's length and the server its first digit
+    def _vbmap_c(self, c_key, c_len):
+        k_enc = ffi.buffer(c_key, c_len)[:]
+        self.mapped.append((k_enc, len(ffi.buffer(c_key))))
+        return c_len, int(k_enc[0:1])
+
+
+class VbmapMultiTest(unittest.TestCase):
+    def setUp(self):
+        self.cb = make_unconnected(_MappedBucket)
+        self.cb.mapped = []
+        self.long_key = '2' + 'x' * 300
+        self.keys = ['1a', '0bb', '1ccc', self.long_key, '0e']
+
+    def test_aligned_arrays(self):
+        vbuckets, servers = self.cb.vbmap_multi(iter(self.keys))
+        self.assertEqual([2, 3, 4, 301, 2], list(vbuckets))
+        self.assertEqual([1, 0, 1, 2, 0], list(servers))
+
+    def test_buffer_grows(self):
+        self.cb.vbmap_multi(self.keys)
+        self.assertEqual([key.encode('utf-8') for key in self.keys],
+                         [k_enc for k_enc, _ in self.cb.mapped])
+        sizes = [size for _, size in self.cb.mapped]
+        self.assertEqual([256] * 3, sizes[:3])
+        self.assertGreaterEqual(sizes[3], 301)
+        # The larger buffer is kept for the following keys
+        self.assertEqual(sizes[3], sizes[4])
+
+    def test_group_by_server(self):
+        groups = self.cb.group_by_server(key for key in self.keys)
+        self.assertEqual({0: ['0bb', '0e'], 1: ['1a', '1ccc'],
+                          2: [self.long_key]}, groups)
+        self.assertEqual({}, self.cb.group_by_server([]))
@@ -0,0 +1,111 @@
+import unittest
+
+import couchbase_ffi
+from couchbase.exceptions import CouchbaseError
+from couchbase_ffi.constants import LCB_ETMPFAIL
+from couchbase_ffi.result import OperationResult
+from couchbase_ffi.writebehind import WriteBehindBuffer
+
+
+def _result(key, rc):
+    result = OperationResult()
+    result.key = key
+    result.rc = rc
+    return result
+
+
+class _Bucket(object):
+    # Writes succeed, except for the keys in `failing`
+    def __init__(self):
+        self.writes = []
+        self.failing = set()
+        self.broken = False
+
+    def _execute_multi(self, name, kv, **kwargs):
+        self.writes.append((name, dict(kv), kwargs['ttl'], kwargs['format']))
+        results = dict((key, _result(key, LCB_ETMPFAIL if key in self.failing
+                                     else 0)) for key in kv)
+        if self.broken:
+            raise ValueError('Cannot encode')
+        if self.failing & set(kv):
+            exc = CouchbaseError('Write failed')
+            exc.all_results = results
+            raise exc
+        return results
+
+
+class WriteBehindBufferTest(unittest.TestCase):
+    def setUp(self):
+        self.bucket = _Bucket()
+        self.buf = WriteBehindBuffer(self.bucket, max_items=3, max_delay=0)
+
+    def test_latest_value_written(self):
+        self.buf.upsert('a', 1)
+        self.buf.upsert('a', 2)
+        self.assertEqual(1, len(self.buf))
+        self.buf.flush()
+        self.assertEqual([('upsert', {'a': 2}, 0, None)], self.bucket.writes)
+        self.assertEqual({'pending': 0, 'elided': 1, 'written': 1,
+                          'flushes': 1}, self.buf.stats())
+        self.assertEqual({}, self.buf.flush())
+
+    def test_flush_when_full(self):
+        self.buf.upsert('a', 1)
+        self.buf.upsert('b', 1, ttl=10)
+        self.assertFalse(self.bucket.writes)
+        results = self.buf.upsert('c', 1)
+        self.assertEqual(['a', 'b', 'c'], sorted(results))
+        # Grouped by expiration and format
+        self.assertEqual([({'a': 1, 'c': 1}, 0), ({'b': 1}, 10)],
+                         [(kv, ttl) for _, kv, ttl, _ in self.bucket.writes])
+
+    def test_failed_keys_requeued(self):
+        self.bucket.failing.add('b')
+        self.buf.upsert('a', 1)
+        self.buf.upsert('b', 1)
+        self.assertRaises(CouchbaseError, self.buf.upsert, 'c', 1, ttl=10)
+        self.assertEqual(1, self.buf.written)
+        self.assertEqual(2, len(self.buf))
+
+        self.bucket.failing.clear()
+        self.buf.flush()
+        self.assertEqual(3, self.buf.written)
+        self.assertEqual([{'b': 1}, {'c': 1}],
+                         [kv for _, kv, _, _ in self.bucket.writes[1:]])
+
+    def test_timer_flush(self):
+        buf = WriteBehindBuffer(self.bucket, max_delay=60)
+        buf.upsert('a', 1)
+        self.assertIsNotNone(buf._timer)
+        self.addCleanup(buf._timer.cancel)
+
+        self.bucket.failing.add('a')
+        buf._timer_flush(buf._timer)
+        self.assertIsInstance(buf.last_error, CouchbaseError)
+        self.assertEqual(1, len(buf))
+        buf._timer.cancel()
+
+        self.bucket.failing.clear()
+        buf.close()
+        self.assertIsNone(buf._timer)
+        self.assertEqual(0, len(buf))
+
+    def test_other_errors_requeued(self):
+        self.bucket.broken = True
+        self.buf.upsert('a', 1)
+        self.assertRaises(ValueError, self.buf.flush)
+        self.assertEqual(1, len(self.buf))
+
+    def test_replaced_timer_kept(self):
+        buf = WriteBehindBuffer(self.bucket, max_delay=60)
+        buf.upsert('a', 1)
+        fired = buf._timer
+        buf.flush()
+        buf.upsert('b', 1)
+        current = buf._timer
+        self.addCleanup(current.cancel)
+
+        # The cancelled timer fired while the flush held the lock
+        buf._timer_flush(fired)
+        self.assertIs(current, buf._timer)
+        self.assertEqual(1, len(buf))
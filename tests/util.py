@@ -0,0 +1,77 @@
+"""
+Helpers for testing the pure-Python parts of the bucket without a cluster
+"""
+from threading import Lock
+
+from couchbase_ffi._rtconfig import pycbc_exc_lcb
+from couchbase_ffi.bucket import Bucket
+from couchbase_ffi.constants import (
+    LCB_CLIENT_ETMPFAIL, LOCKMODE_NONE, PYCBC_CONN_F_ASYNC)
+
+
+def make_unconnected(cls=Bucket, is_async=False):
+    """
+    Create a bucket with the state of a newly constructed one, but without
+    a libcouchbase handle. Only code paths which do not call into the
+    library may be used with it; executors must be added as needed.
+    :param cls: The bucket class
+    :param is_async: Whether the bucket behaves as an asynchronous one
+    :return: The bucket
+    """
+    bucket = cls.__new__(cls)
+    bucket._handles = set()
+    bucket._executors = {}
+    bucket.data_passthrough = False
+    bucket.transcoder = None
+    bucket.quiet = False
+    bucket._dur_persist_to = 0
+    bucket._dur_replicate_to = 0
+    bucket._dur_timeout = 0
+    bucket._dur_testhook = None
+    bucket._privflags = PYCBC_CONN_F_ASYNC if is_async else 0
+    bucket._conncb = None
+    bucket._lockmode = LOCKMODE_NONE
+    bucket._lock = Lock()
+    bucket._init_state()
+    return bucket
+
+
+class UnconfiguredBucket(Bucket):
+    """
+    A bucket which fails to map keys, as before its first configuration
+    """
+
+    def _vbmap_c(self, c_key, c_len):
+        raise pycbc_exc_lcb(LCB_CLIENT_ETMPFAIL)
+
+
+class LibraryCalls(object):
+    """
+    Stands in for the library handle (``C``) of a module, recording the
+    calls of the given functions instead of making them. The value returned
+    by each function may be set in :attr:`results`
+    """
+
+    def __init__(self, module, *names):
+        self.module = module
+        self.real = module.C
+        self.names = names
+        self.calls = []
+        self.results = {}
+
+    def __getattr__(self, name):
+        if name in self.names:
+            return lambda *args: self._call(name, args)
+        return getattr(self.real, name)
+
+    def _call(self, name, args):
+        self.calls.append((name, args))
+        return self.results.get(name)
+
+    def install(self, testcase):
+        self.module.C = self
+        testcase.addCleanup(setattr, self.module, 'C', self.real)
+        return self
+
+    def called(self, name):
+        return [args for fn, args in self.calls if fn == name]